@@ -50,6 +50,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'dashboard.middleware.PayloadBudgetMiddleware',   # before CompressionMiddleware (sees both sizes)
+    'dashboard.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -147,4 +149,69 @@ X_FRAME_OPTIONS = 'SAMEORIGIN'
 ASGI_APPLICATION = 'myproject.routing.application'
 
 
-H5_PATH = BASE_DIR.parent / "data/raw/mimic3_data/mimic3_data_2_1.h5"  # Adjust this as needed
\ No newline at end of file
+H5_PATH = BASE_DIR.parent / "data/raw/mimic3_data/mimic3_data_2_1.h5"  # Adjust this as needed
+H5_RDCC_NBYTES = 4 * 1024 * 1024  # HDF5 chunk cache per open dataset; keep >= one chunk (see repack_h5)
+H5_RDCC_NSLOTS = 10007            # prime, ~100x the number of chunks expected in the cache
+
+# Decoded windows shared by every worker process on the host (memory-mapped slab; None disables)
+WINDOW_CACHE_PATH = "/dev/shm/cardio_annotator_windows.slab" if os.path.isdir("/dev/shm") else None
+WINDOW_CACHE_BYTES = 256 * 1024 * 1024  # one budget for the whole host, not per worker
+
+# Subjects whose signals total at most this many bytes (float32) are read whole when loaded and
+# every window is then sliced from memory; 30 min x 125 Hz x 3 signals is ~2.7 MB
+SUBJECT_PRELOAD_MAX_BYTES = 16 * 1024 * 1024
+SUBJECT_PRELOAD_MAX_SUBJECTS = 8  # per worker process
+
+# `load_subject_metadata` reads only datasets up to this many elements (waveforms are described by shape and
+# dtype) and caches the result per subject in each worker
+METADATA_MAX_ELEMENTS = 256
+METADATA_CACHE_SUBJECTS = 1024
+
+# SQLite index of per-window features (label, quality, peaks, HR) and subject metadata used by the
+# dashboard search panel; build or refresh it with `python manage.py build_search_index`
+SEARCH_INDEX_PATH = BASE_DIR / "search_index.sqlite3"
+
+# New recordings are added as shard files in this directory (`python manage.py ingest_recordings`);
+# running servers pick them up on the next page load
+H5_SHARD_DIR = BASE_DIR.parent / "data/shards"
+
+# Exported annotation stores, one directory per annotator (`<subj_id>.json` from the dashboard's Export button),
+# compared with `python manage.py compare_annotators <a> <b>`
+ANNOTATIONS_DIR = BASE_DIR.parent / "data/annotations"
+AGREEMENT_TOLERANCE_S = 0.15   # peaks this close (seconds) count as the same beat
+AGREEMENT_MIN_F1 = 0.9         # windows below this F1 on any signal, or with differing labels, are flagged
+
+# Annotation work queue kept in the search index (`python manage.py build_work_queue`): unlabelled windows are
+# leased to annotators by the dashboard's "Next Task" button, best quality and least covered subjects first
+WORK_QUEUE_LEASE_S = 15 * 60          # an unfinished task returns to the queue after this long
+WORK_QUEUE_COVERAGE_WEIGHT = 0.5      # score bonus for subjects with no labelled windows
+WORK_QUEUE_MIN_QUALITY = None         # windows below this quality are not queued; None queues all
+
+# Filtered views (band-pass, derivative, envelope) and spectrograms are computed over a subject's whole
+# recording once per worker; this many subjects' transforms are kept (one float32 array per signal each)
+TRANSFORM_CACHE_SUBJECTS = 4
+BANDPASS_ORDER = 4             # Butterworth order, applied forward and backward (zero phase)
+SPECTROGRAM_SEGMENT_S = 2.0    # STFT segment length in seconds
+
+# Encoded window payloads kept on disk across restarts (`python manage.py warm_payload_cache`); None disables
+PAYLOAD_CACHE_DIR = BASE_DIR / "payload_cache"
+PAYLOAD_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# Longest sample range /api/subjects/<id>/signals/<sig> serves in one response (4 bytes per sample); a request
+# without `end` gets this many samples from `start`
+SIGNAL_RANGE_MAX_SAMPLES = 1024 * 1024
+
+# Dash responses are compressed with brotli (if the `brotli` package is installed) or gzip; callbacks whose
+# request or response exceeds the budget are logged, with per-callback totals at /api/callback-payloads
+RESPONSE_COMPRESSION_MIN_BYTES = 1024
+RESPONSE_BROTLI_QUALITY = 5
+RESPONSE_GZIP_LEVEL = 6
+CALLBACK_PAYLOAD_BUDGET = 512 * 1024
+
+# Default plot renderer: 'webgl' (Scattergl lines, stays responsive for long windows) or 'svg'
+FIGURE_RENDER_MODE = 'webgl'
+
+# Signals the dashboard loads, plots and annotates (see dashboard/annotations/utils/signals.py); None keeps
+# DEFAULT_SIGNALS. Entries are dicts of SignalSpec fields, e.g.
+# {'name': 'resp', 'group': 'resp', 'label': 'RESP', 'title': 'Respiration', 'units': 'a.u.', 'row': 4}
+SIGNALS = None
@@ -18,10 +18,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from dashboard.views import annotation
+from dashboard.annotations.views import callback_payloads, signal_window
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', annotation, name='annotation'),
+    path('api/subjects/<str:subj_id>/signals/<str:sig>', signal_window, name='signal-window'),
+    path('api/callback-payloads', callback_payloads, name='callback-payloads'),
 
     path('django_plotly_dash/', include('django_plotly_dash.urls')),
 ]
\ No newline at end of file
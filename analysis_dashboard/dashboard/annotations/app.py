@@ -1,15 +1,23 @@
-import dash, json, os
+import dash, json, os, time
 from dash.dependencies import Input, Output, State
 from dash import html,no_update
 import dash_bootstrap_components as dbc
 from django_plotly_dash import DjangoDash
 from dash.exceptions import PreventUpdate
+import numpy as np
 import plotly.graph_objects as go
 
 
 from .layout import serve_layout,initial_ann
-from .utils.generate_shared_axis_figure import generate_shared_xaxis_figure
-from .utils.get_data import FS, WIN_SAMPLES, NUM_WINDOWS,WIN_LEN_SEC,to_json_serializable,overlay_annotations,load_subject_metadata,load_window_slice
+from .utils.generate_shared_axis_figure import build_shared_xaxis_figure
+from .utils.get_data import FS, WIN_SAMPLES, NUM_WINDOWS,WIN_LEN_SEC,to_json_serializable,overlay_annotations,load_subject_metadata,load_window_slice,preload_subject,count_windows,subject_fs
+from .utils.annotation_journal import get_journal
+from .utils.window_labels import WindowLabels, label_code
+from .utils.search_index import search_windows, record_label, load_labels, disagreement_windows
+from .utils.signals import selected
+from .utils.payload_cache import load_window_payload
+from .utils.transforms import load_view_window, spectrogram_window
+from .utils.work_queue import lease_task, complete_task, release_task, reopen_task
 
 app = DjangoDash("SignalAnnotator", external_stylesheets=[dbc.themes.BOOTSTRAP, dbc.icons.FONT_AWESOME],serve_locally=False)
 app.layout = serve_layout
@@ -19,35 +27,51 @@ app.layout = serve_layout
     Output('subject-metadata-cache', 'data'),
     Output('current-subject-id', 'data'),
     Output('current-window', 'data',allow_duplicate=True),
+    Output('num-windows', 'data'),
     Input('load-subject-btn', 'n_clicks'),
     State('subject-dropdown', 'value'),
     State('subject-metadata-cache', 'data'),
+    State('search-target', 'data'),
+    State('signal-select', 'value'),
     prevent_initial_call=True
 )
-def load_subject_metadata_callback(n_clicks, subj_id, metadata_cache):
+def load_subject_metadata_callback(n_clicks, subj_id, metadata_cache, search_target, enabled_signals):
     """
-    Load and cache the first window of data for a selected subject on demand.
+    Load a selected subject on demand: read a short recording whole (`preload_subject`) and keep window 0 in the
+    browser-side metadata cache.
 
     Parameters:
         n_clicks (int)       : Number of times "Load Subject" button was clicked
         subj_id (Any)        : Selected subject identifier from dropdown
         metadata_cache (dict): Previously cached metadata per subject
+        search_target (dict) : Window picked from the search results ({'subj_id', 'widx', 'clicks'}), if this load came from one
+        enabled_signals (list[str]): Signals checked in the signal selector; only these are read
 
     Returns:
         tuple:
             - subject-metadata-cache (dict)  : Updated metadata_cache with window-0 data added if needed
             - current-subject-id (Any)       :  subj_id, to set as the active subject
-            - current-window     (int)       :  0, to set the current window index back to zero
+            - current-window     (int)       :  0 (or the picked search result's window), to set the current window index
+            - num-windows        (int)       :  Number of windows in the subject's recording
 
     Notes:
         - Advantage     : Avoids redundant data loads by checking cache before fetching.
         - Advantage     : Uses `no_update` to prevent unnecessary downstream resets when data is already cached.
-        - Shortcoming   : Only preloads window 0; additional windows must be fetched later, adding complexity if navigation is rapid.
+        - Advantage     : Short recordings (ticked signals below SUBJECT_PRELOAD_MAX_BYTES) are read whole here, so later
+                          navigation does no I/O.
+        - Shortcoming   : Longer recordings are not preloaded: only window 0 is cached here, and other windows come
+                          from the shared window and payload caches or HDF5 as they are shown.
         - Shortcoming   : Entire metadata_cache is sent back each time; for many subjects this could become large and impact performance.
     """
     if not n_clicks or not subj_id:
         raise PreventUpdate
 
+    preload_subject(subj_id, signals=enabled_signals)
+    n_windows = count_windows(subj_id)
+    start_window = 0
+    if search_target and search_target['subj_id'] == subj_id and search_target['clicks'] == n_clicks:
+        start_window = search_target['widx']
+
     if metadata_cache is None:
         metadata_cache = {}
 
@@ -56,7 +80,7 @@ def load_subject_metadata_callback(n_clicks, subj_id, metadata_cache):
        'windows' in metadata_cache[subj_id] and \
        0 in metadata_cache[subj_id]['windows']:
         # If already cached, just update current subject and don't modify cache or trigger reset
-        return no_update, subj_id,0
+        return no_update, subj_id,start_window,n_windows
 
     # Ensure the subject entry and 'windows' dictionary exist
     if subj_id not in metadata_cache:
@@ -65,13 +89,13 @@ def load_subject_metadata_callback(n_clicks, subj_id, metadata_cache):
         metadata_cache[subj_id]['windows'] = {}
 
     # Load data for window 0
-    window_0_data = load_window_slice(subj_id, 0)
+    window_0_data = load_window_slice(subj_id, 0, signals=enabled_signals)
     serializable_window_0_data = to_json_serializable(window_0_data)
 
     # Store window 0 data in the cache
     metadata_cache[subj_id]['windows'][0] = serializable_window_0_data
 
-    return metadata_cache, subj_id,0
+    return metadata_cache, subj_id,start_window,n_windows
 
 
 # 1) Navigation stays the same
@@ -79,11 +103,16 @@ def load_subject_metadata_callback(n_clicks, subj_id, metadata_cache):
     Output('current-window','data'),
     [Input('prev-window-btn','n_clicks_timestamp'),
      Input('next-window-btn','n_clicks_timestamp'),
-     Input('jump-go-btn','n_clicks_timestamp')],
+     Input('jump-go-btn','n_clicks_timestamp'),
+     Input('next-match-btn','n_clicks_timestamp')],
     [State('current-window','data'),
-     State('jump-to-input','value')],prevent_initial_call=True
+     State('jump-to-input','value'),
+     State('label-filter','value'),
+     State('num-windows','data'),
+     State('journal-id','data'),
+     State('annotations','data')],prevent_initial_call=True
 )
-def navigate(prev_ts, next_ts, go_ts, current_idx, jump_sec):
+def navigate(prev_ts, next_ts, go_ts, match_ts, current_idx, jump_sec, label_filter, num_windows, journal_id, ann):
     """
     Update the current window index based on navigation button clicks or a direct jump input.
 
@@ -91,35 +120,46 @@ def navigate(prev_ts, next_ts, go_ts, current_idx, jump_sec):
         prev_ts (float)     : Timestamp (ms) when "Previous Window" button was last clicked
         next_ts (float)     : Timestamp (ms) when "Next Window" button was last clicked
         go_ts   (float)     : Timestamp (ms) when "Go" button was last clicked for jump-to
+        match_ts (float)    : Timestamp (ms) when "Next" button of the label filter was last clicked
         current_idx (int)   : Current window index before navigation
         jump_sec    (float) : Seconds value entered for direct jump
+        label_filter (str)  : Label chosen in the filter dropdown ('' for unlabelled windows)
+        num_windows (int)   : Number of windows of the loaded subject (NUM_WINDOWS before one is loaded)
+        journal_id (str)    : Identifier of this page's edit journal, which holds the window labels
+        ann (dict)          : Current annotations store (seeds the journal if this worker has none)
 
     Returns:
-        current-window (int): New window index, bounded between 0 and NUM_WINDOWS-1
+        current-window (int): New window index, bounded between 0 and num_windows-1
 
     Notes:
         - Advantage     : Uses timestamps to unambiguously determine which button was clicked most recently.
         - Advantage     : Clamps index to valid range, preventing out-of-bounds navigation.
         - Shortcoming   : Interprets any non-positive or missing jump input as no-op, which may confuse users.
-        - Shortcoming   : Relies on global constants (FS, WIN_SAMPLES, NUM_WINDOWS) and manual timestamp logic; could be simplified with `dash.callback_context` comparisons.
+        - Advantage     : "Next" asks the journal's WindowLabels index, O(1) amortized for the next unlabelled window.
+        - Shortcoming   : Relies on global constants (FS, WIN_SAMPLES) and manual timestamp logic; could be simplified with `dash.callback_context` comparisons.
     """
     ctx = dash.callback_context
     trigger_id = ctx.triggered[0]['prop_id']
+    n_windows = num_windows or NUM_WINDOWS
     if trigger_id == 'load-subject-btn.n_clicks':
-        return min(current_idx + 1, NUM_WINDOWS - 1)
-    times = {'prev': prev_ts or 0, 'next': next_ts or 0, 'go': go_ts or 0}
+        return min(current_idx + 1, n_windows - 1)
+    times = {'prev': prev_ts or 0, 'next': next_ts or 0, 'go': go_ts or 0, 'match': match_ts or 0}
     last  = max(times, key=times.get)
     if times[last] == 0:
         return current_idx
     if last == 'prev':
         return max(current_idx - 1, 0)
     if last == 'next':
-        return min(current_idx + 1, NUM_WINDOWS - 1)
+        return min(current_idx + 1, n_windows - 1)
+    if last == 'match':
+        with get_journal(journal_id, ann or initial_ann) as journal:
+            target = journal.labels.next_matching(label_code(label_filter), current_idx + 1)
+        return current_idx if target is None else target
     # go
     if jump_sec is None or jump_sec < 0:
         return current_idx
     current_idx = int((jump_sec * FS) // WIN_SAMPLES)
-    return max(0, min(current_idx, NUM_WINDOWS - 1))
+    return max(0, min(current_idx, n_windows - 1))
 
 # 3) Redraw on window or annotation change
 @app.callback(
@@ -127,39 +167,57 @@ def navigate(prev_ts, next_ts, go_ts, current_idx, jump_sec):
     [
     Input("current-window", "data"),
     Input("annotations", "data"),
+    Input("render-mode", "value"),
+    Input("signal-select", "value"),
+    Input("signal-view", "value"),
+    Input("spectrogram-signal", "value"),
     ],
     [
     State("current-subject-id", "data"),
     ],
     prevent_initial_call=True
 )
-def update_plots(window_idx,annotations, subj_id):
+def update_plots(window_idx,annotations, render_mode, enabled_signals, view, spectrogram_signal, subj_id):
     """
     Redraw the multi-signal figure and reapply any user annotations when data context changes.
 
     Parameters:
         window_idx (int): Index of the current time window (0-based)
         annotations (dict): Annotations dict containing per-signal peak positions and labels
+        render_mode (str): 'svg' or 'webgl' base traces (see RENDER_MODES)
+        enabled_signals (list[str]): Signals checked in the signal selector, one subplot row each
+        view (str): 'raw' or a filtered view from transforms.VIEWS ('bandpass', 'derivative', 'envelope')
+        spectrogram_signal (str): Signal whose spectrogram is drawn as an extra bottom row, or None
         subj_id (Any): Identifier for the current subject whose data is displayed
 
     Returns:
-        plotly.graph_objs.Figure: A new figure with ECG, PPG, ABP traces and overlayed annotations
+        dict: A new figure with one trace per enabled signal and overlayed annotations
 
     Notes:
         - Advantage     : Always generates the figure from raw data, ensuring reproducible plots and clean state.
+        - Advantage     : The layout comes from a cached template (`build_shared_xaxis_figure`); only data is filled in.
         - Advantage     : Clear separation: data loading, base figure creation, then annotation overlay.
+        - Advantage     : Only the enabled signals are read from the store (one dataset per signal).
+        - Advantage     : Windows come pre-encoded from the on-disk payload cache when enabled, so a freshly
+                          started worker answers as fast as a warm one.
+        - Advantage     : Filtered views and spectrograms are sliced from whole-recording transforms (no edge
+                          artefacts, no filtering per navigation).
         - Shortcoming   : Full redraw for every annotation or window change can be inefficient for large windows.
         - Shortcoming   : Does not debounce rapid updates; consider client-side handling or caching for smoother UX.
     """
-    if (window_idx is None) or subj_id is None:
+    if (window_idx is None) or subj_id is None or not enabled_signals:
         raise PreventUpdate
     
-    window_data = load_window_slice(subj_id, window_idx)
-    fs = window_data["fs"]
-    t, ppg, ecg, abp = window_data["t"], window_data["ppg"], window_data["ecg"], window_data["bp"]
+    if view and view != 'raw':
+        window_data = load_view_window(subj_id, window_idx, view, signals=enabled_signals)
+    else:
+        window_data = load_window_payload(subj_id, window_idx, signals=enabled_signals)
+    signals = {spec.name: window_data[spec.name] for spec in selected(enabled_signals)}
+    spectrogram = spectrogram_window(subj_id, window_idx, spectrogram_signal) if spectrogram_signal else None
 
-    fig = generate_shared_xaxis_figure(ecg, ppg, abp, t)
-    fig = overlay_annotations(fig, annotations, subj_id, window_idx, FS, WIN_SAMPLES)
+    fig = build_shared_xaxis_figure(signals, window_data["t"], render_mode=render_mode or 'svg', spectrogram=spectrogram)
+    fig = overlay_annotations(fig, annotations, subj_id, window_idx, window_data['fs'], WIN_SAMPLES,
+                              signals=enabled_signals)
     
     return fig
 
@@ -171,29 +229,39 @@ def update_plots(window_idx,annotations, subj_id):
       Input('clear-all-btn', 'n_clicks'),
       Input('load-subject-btn', 'n_clicks'),
       Input('add-label-btn',  'n_clicks'),
+      Input('undo-btn', 'n_clicks'),
+      Input('redo-btn', 'n_clicks'),
     ],
     [
       State('mode-selector',  'value'),
       State('annotations',     'data'),
       State('current-window',  'data'),
       State('window-label-dropdown', 'value'),
-
+      State('journal-id', 'data'),
+      State('subject-dropdown', 'value'),
+      State('current-subject-id', 'data'),
+      State('signal-select', 'value'),
     ],
     prevent_initial_call=True
 )
-def modify_annotations(clickData, clear_all_clicked,load_subject_clicked,add_label_button_clicked,mode, ann, window_idx,label_value):
+def modify_annotations(clickData, clear_all_clicked,load_subject_clicked,add_label_button_clicked,undo_clicked,redo_clicked,mode, ann, window_idx,label_value,journal_id,subj_id,current_subj_id,enabled_signals):
     """
-    Handle all user-driven annotation events: peak addition/removal, label setting, and resets.
+    Handle all user-driven annotation events: peak addition/removal, label setting, undo/redo and resets.
 
     Parameters:
         clickData (dict)         : Plotly clickData dict when user clicks on plot
         clear_n   (int)          : n_clicks count for "Clear All" button
         load_n    (int)          : n_clicks for "Load Subject" button
         add_label_n (int)        : n_clicks for "Add Label" button
+        undo_n, redo_n (int)     : n_clicks for the "Undo" / "Redo" buttons
         mode      (str)          : 'add' or 'remove' peak mode
         ann       (dict)         : Current annotations store
         window_idx(int)          : Index of the current time window
         label_value (str)        : The user-selected label for this window
+        journal_id (str)         : Identifier of this page's edit journal
+        subj_id (Any)            : Subject selected in the dropdown (sizes the label array on load)
+        current_subj_id (Any)    : Subject currently displayed; label edits are written to its search-index rows
+        enabled_signals (list[str]): Signals displayed, in the figure's row order (maps a click's curveNumber to its signal)
 
     Returns:
         tuple:
@@ -202,125 +270,97 @@ def modify_annotations(clickData, clear_all_clicked,load_subject_clicked,add_lab
 
     Notes:
         - Advantage     : Consolidates all annotation triggers into one callback, centralizing state management.
-        - Advantage     : Uses shallow copies and `no_update` semantics for minimal, controlled state changes.
+        - Advantage     : Edits are recorded as compact deltas in the page's AnnotationJournal and applied in place,
+                          so no copy of the store is made per click and every edit can be undone or redone.
         - Shortcoming   : Logic branches heavily on `trigger_id`, which can become unwieldy as more inputs are added.
-        - Shortcoming   : Resets the entire annotation store on subject load; partial resets or diffing might improve performance.
+        - Advantage     : Labels are kept per window as one uint8 code each ('window_labels'), not a single global string,
+                          seeded from the search index on load and written back to it on every label edit.
+        - Shortcoming   : Resets the entire annotation store (and its history) on subject load.
     """
     ctx = dash.callback_context
     trigger_id = ctx.triggered[0]['prop_id']
     if trigger_id is None:
         raise PreventUpdate
-    
-    if trigger_id == 'add-label-btn.n_clicks':
-        ann = ann.copy()
-        # Overwrite the single-string label
-        ann['window_label'] = label_value
-        return ann, None
 
-    if trigger_id == 'load-subject-btn.n_clicks':
-        return initial_ann.copy(), None
-        
-    # # 1) Figure out what fired us
-    new_ann = {
-    sig: (data.copy() if isinstance(data, dict) else data)
-    for sig, data in (ann or {}).items()
-    }
+    # the store returned is the journal's live dict: a request sent before this response arrives carries the
+    # old revision and reseeds the journal with a new dict, so the returned one is not mutated while serialized
+    with get_journal(journal_id, ann or initial_ann) as journal:
+        if trigger_id == 'load-subject-btn.n_clicks':
+            labels = load_labels(subj_id, count_windows(subj_id)) if subj_id else np.zeros(0, dtype=np.uint8)
+            journal.reset({**initial_ann, 'window_labels': labels})
+            return journal.state, None
+
+        if trigger_id == 'signal-plots.clickData':
+            fs = FS if current_subj_id is None else subject_fs(current_subj_id, enabled_signals)
+            changed = modify_peak_logic(clickData, journal, window_idx, mode, enabled_signals, fs=fs)
+        elif trigger_id == 'add-label-btn.n_clicks':
+            changed = journal.set_label(window_idx, label_value)
+        elif trigger_id == 'clear-all-btn.n_clicks':
+            # only clear this window's peaks
+            changed = journal.clear_range(window_idx*WIN_SAMPLES, (window_idx+1)*WIN_SAMPLES)
+        elif trigger_id == 'undo-btn.n_clicks':
+            changed = journal.undo()
+        elif trigger_id == 'redo-btn.n_clicks':
+            changed = journal.redo()
+        else:
+            raise PreventUpdate
 
-    if trigger_id == 'signal-plots.clickData':
-        return modify_peak_logic(clickData, new_ann, window_idx, mode), None
-
-    elif trigger_id == 'clear-all-btn.n_clicks':
-        # 2) Start from the existing store (or empty template)
-        base = ann.copy() if isinstance(ann, dict) else initial_ann.copy()
-
-        # 2) now shallow-copy only the dict‐valued entries
-        new_ann = {
-            key: (val.copy() if isinstance(val, dict) else val)
-            for key, val in base.items()
-        }
-        # only clear this window’s peaks
-        start, end = window_idx*WIN_SAMPLES, (window_idx+1)*WIN_SAMPLES
-        for sig, data in new_ann.items():
-            if sig == 'window_label': continue
-            sp = data.get('sample_peak_positions', [])
-            tp = data.get('time_peak_positions',    [])
-            kept = [(s,t) for s,t in zip(sp,tp) if not (start <= s < end)]
-            if kept:
-                s_kept, t_kept = map(list, zip(*kept))
-            else:
-                s_kept, t_kept = [], []
-            new_ann[sig]['sample_peak_positions'] = s_kept
-            new_ann[sig]['time_peak_positions']   = t_kept
-        return new_ann, None
-    
-    else:
-        raise PreventUpdate
+        if changed and current_subj_id is not None:
+            # the op just applied (or reverted); label edits are mirrored into the search index
+            op = journal.ops[journal.cursor if trigger_id == 'undo-btn.n_clicks' else journal.cursor - 1]
+            if op[0] == 'label':
+                record_label(current_subj_id, op[1], journal.labels.codes[op[1]])
+                if journal.labels.codes[op[1]]:
+                    complete_task(current_subj_id, op[1])   # a labelled window leaves the work queue
+                else:
+                    reopen_task(current_subj_id, op[1])     # label cleared (e.g. undone): back into the work queue
+
+        return (journal.state if changed else no_update), None
 
-def modify_peak_logic(clickData, ann, window_idx, mode):
+def modify_peak_logic(clickData, journal, window_idx, mode, enabled_signals=None, fs=FS):
 
     """
     Add or remove a single peak annotation for a given signal at the clicked location.
 
     Parameters:
-        clickData (dict): dcc.Graph.clickData event dictionary with point info
-        ann (dict)      :    Existing annotations, keyed by signal names
-        window_idx (int): Zero-based index of the current time window
-        mode (str)      :    'add' to insert or 'remove' to delete peaks
+        clickData (dict)                : dcc.Graph.clickData event dictionary with point info
+        journal (AnnotationJournal)     : Journal of the page's annotation store; the edit is recorded there
+        window_idx (int)                : Zero-based index of the current time window
+        mode (str)                      : 'add' to insert or 'remove' to delete peaks
+        enabled_signals (list[str])     : Signals displayed in the figure (default: every registered signal)
+        fs (float)                      : Sampling rate of the window's time axis (see `get_data.subject_fs`)
 
     Returns:
-        dict: A new annotations dictionary with the update applied
+        bool: True if the annotation store changed
 
     Notes:
-        - Advantage     : Performs a shallow copy to avoid mutating original data and ensures chronological order by sorting peaks after every update.
         - Advantage     : Clear separation between 'add' and 'remove' modes, making it easy to follow and maintain.
-        - Shortcoming   : Sorting the entire list on each modification can become inefficient for large numbers of annotations (O(n log n) per click).
+        - Advantage     : Peaks stay in chronological order via bisection (O(log n) search) rather than a full re-sort per click.
+        - Advantage     : The sample is the one nearest the click's x coordinate, so no per-sample markers or customdata
+                          are needed (works for SVG and WebGL traces, and for clicks on peak markers).
         - Shortcoming   : Removes peaks based on a fixed ±1 sample tolerance, which might not capture all edge cases in noisy signals.
     """
-    # 1) shallow-copy the top-level dict so we don't mutate in place
-    new_ann = {
-    sig: (data.copy() if isinstance(data, dict) else data)
-    for sig, data in (ann or {}).items()
-    }
-    # 2) unpack click info
+    # 1) unpack click info: base traces are identified by curveNumber, peak markers carry their signal
     pt          = clickData['points'][0]
+    custom      = pt.get('customdata')
+    curve       = pt.get('curveNumber')
+    displayed   = selected(enabled_signals)           # base trace i is the i-th displayed signal
+    if isinstance(custom, dict) and 'signal' in custom:
+        sig = custom['signal']
+    elif curve is not None and curve < len(displayed):
+        sig = displayed[curve].name
+    else:
+        raise PreventUpdate
+    if pt.get('x') is None:
+        raise PreventUpdate
+    window_start = window_idx * WIN_SAMPLES
+    sample_idx  = min(max(int(round(pt['x'] * fs)), window_start), window_start + WIN_SAMPLES - 1)
+    t_rel       = sample_idx / fs                     # time of the nearest sample
 
-    try:
-        sig = pt['customdata']['signal']          # 'ecg' / 'ppg' / 'abp'
-    except (KeyError, TypeError, IndexError):
-        raise PreventUpdate 
-    t_rel       = pt['x']                             # seconds into this window
-    local_idx   = pt['pointIndex']                    # 0…WIN_SAMPLES-1
-    sample_idx  = window_idx * WIN_SAMPLES + local_idx
-
-    # 3) make sure this signal has its lists in place
-    sd          = new_ann.setdefault(sig, {})
-    sp          = sd.setdefault('sample_peak_positions', [])
-    tp          = sd.setdefault('time_peak_positions',   [])
-
-    # 4) add or remove
+    # 2) add or remove (drop any peak within ±1 sample of the click)
     if mode == 'add':
-        if sample_idx not in sp:
-            sp.append(sample_idx)
-            tp.append(t_rel)
-
-    else:  # remove
-        # drop any peak within ±1 sample of the click
-        pairs = list(zip(sp, tp))
-        kept  = [(s, t) for s, t in pairs if abs(s - sample_idx) > 1]
-        if kept:
-            sp[:], tp[:] = zip(*kept)
-        else:
-            sp.clear()
-            tp.clear()
-
-    # 5) re‐sort so everything stays in chronological order
-    sorted_pairs = sorted(zip(sp, tp), key=lambda st: st[0])
-    sp[:] = [s for s, _ in sorted_pairs]
-    tp[:] = [t for _, t in sorted_pairs]
-
-    new_ann[sig]['sample_peak_positions'] = sp
-    new_ann[sig]['time_peak_positions']   = tp
-    return new_ann
+        return journal.add_peak(sig, sample_idx, t_rel)
+    return journal.remove_peaks(sig, sample_idx, tolerance=1)
 
 
 @app.callback(
@@ -349,16 +389,19 @@ def debug_annotations(ann, widx):
     window_lo_time   = widx * WIN_LEN_SEC
     window_hi_time   = (widx + 1) * WIN_LEN_SEC
 
+    labels = WindowLabels(ann.get('window_labels', []))
+
     # start building our output
     out = {
         "window_index": widx,
-        "window_label": ann.get('window_label', ""),
+        "window_label": labels.label(widx),
+        "label_counts": labels.counts(),
         "signals": {}
     }
     # 2) now filter each signal’s lists by the window bounds
     for sig, data in (ann or {}).items():
-        # skip the top‐level window_label entry
-        if sig == 'window_label':
+        # skip the top‐level window_labels entry
+        if not isinstance(data, dict):
             continue
         sig_out = {}
         for key, vals in data.items():
@@ -374,3 +417,176 @@ def debug_annotations(ann, widx):
                 sig_out[key] = vals
         out["signals"][sig] = sig_out
     return html.Pre(json.dumps(out, indent=2))
+
+
+@app.callback(
+    Output('search-results', 'options'),
+    Output('search-results', 'value'),
+    Output('search-results', 'placeholder'),
+    Input('search-btn', 'n_clicks'),
+    Input('disagreements-btn', 'n_clicks'),
+    State('search-label', 'value'),
+    State('search-af-status', 'value'),
+    State('search-min-hr', 'value'),
+    State('search-max-hr', 'value'),
+    State('search-min-quality', 'value'),
+    State('search-has', 'value'),
+    prevent_initial_call=True
+)
+def run_search(n_clicks, disagreement_clicks, label, af_status, min_hr, max_hr, min_quality, has):
+    """
+    Query the cross-subject search index and list the matching windows, or the windows two annotators disagree on.
+
+    Parameters:
+        n_clicks (int)      : n_clicks of the "Search" button
+        disagreement_clicks (int): n_clicks of the "Disagreements" button (lists windows flagged by compare_annotators)
+        label (str)         : Label name, '' for unlabelled windows or 'any'
+        af_status (str)     : Required subject AF status, or None for any
+        min_hr, max_hr (float): Heart-rate bounds (bpm), None for open
+        min_quality (float) : Minimum window quality score (0..1)
+        has (list[str])     : Signals that must be present in the window
+
+    Returns:
+        tuple:
+            - search-results options (list) : One option per matching window, value "<subject>:<window>"
+            - search-results value (None)   : Clears the previous pick
+            - search-results placeholder    : Number of matches
+
+    Notes:
+        - Advantage     : Runs against the SQLite index only; no recording is opened.
+        - Shortcoming   : Results are capped at SEARCH_LIMIT rows.
+    """
+    trigger_id = dash.callback_context.triggered[0]['prop_id']
+    if trigger_id == 'disagreements-btn.n_clicks':
+        if not disagreement_clicks:
+            raise PreventUpdate
+        rows = disagreement_windows()
+        options = []
+        for r in rows:
+            labels = f" · {r['label_a'] or '-'}/{r['label_b'] or '-'}" if r['label_a'] != r['label_b'] else ''
+            options.append({'label': f"{r['subj_id']} · window {r['widx']} · F1 {r['min_f1']:.2f}{labels} "
+                                     f"· {r['annotator_a']} vs {r['annotator_b']}",
+                            'value': f"{r['subj_id']}:{r['widx']}"})
+        return options, None, f"{len(rows)} disagreement windows" if rows else "No disagreements stored"
+    if not n_clicks:
+        raise PreventUpdate
+    rows = search_windows(label=None if label == 'any' else label,
+                          min_hr=min_hr, max_hr=max_hr, min_quality=min_quality, has=has or (),
+                          meta=None if af_status is None else {'af_status': af_status})
+    options = []
+    for r in rows:
+        hr = 'no HR' if r['hr'] is None else f"{r['hr']:.0f} bpm"
+        quality = '' if r['quality'] is None else f" · q {r['quality']:.2f}"
+        options.append({'label': f"{r['subj_id']} · window {r['widx']} · {r['label'] or 'unlabeled'} · {hr}{quality}",
+                        'value': f"{r['subj_id']}:{r['widx']}"})
+    return options, None, f"{len(rows)} matching windows" if rows else "No matching windows"
+
+
+@app.callback(
+    Output('subject-dropdown', 'value'),
+    Output('load-subject-btn', 'n_clicks'),
+    Output('search-target', 'data'),
+    Output('current-window', 'data', allow_duplicate=True),
+    Input('search-results', 'value'),
+    State('current-subject-id', 'data'),
+    State('load-subject-btn', 'n_clicks'),
+    prevent_initial_call=True
+)
+def open_search_result(result, current_subj_id, load_clicks):
+    """
+    Show a picked search result: jump to its window, loading its subject first if another one is displayed.
+
+    Parameters:
+        result (str)          : "<subject>:<window>" value of the picked search result
+        current_subj_id (Any) : Subject currently displayed
+        load_clicks (int)     : n_clicks of the "Load" button
+
+    Returns:
+        tuple:
+            - subject-dropdown value (str)  : The result's subject (when it has to be loaded)
+            - load-subject-btn n_clicks     : Incremented to run the normal subject-load callbacks
+            - search-target (dict)          : Window the load callback should open instead of window 0
+            - current-window (int)          : The result's window (when its subject is already displayed)
+    """
+    if not result:
+        raise PreventUpdate
+    subj_id, widx = result.rsplit(':', 1)
+    return open_window(subj_id, int(widx), current_subj_id, load_clicks)
+
+
+def open_window(subj_id, widx, current_subj_id, load_clicks):
+    """Outputs of `open_search_result` that show window `widx` of `subj_id`, loading the subject if needed."""
+    if subj_id == current_subj_id:
+        return no_update, no_update, no_update, widx
+    clicks = (load_clicks or 0) + 1
+    return subj_id, clicks, {'subj_id': subj_id, 'widx': widx, 'clicks': clicks}, no_update
+
+
+@app.callback(
+    Output('subject-dropdown', 'value', allow_duplicate=True),
+    Output('load-subject-btn', 'n_clicks', allow_duplicate=True),
+    Output('search-target', 'data', allow_duplicate=True),
+    Output('current-window', 'data', allow_duplicate=True),
+    Output('current-task', 'data'),
+    Output('task-status', 'children'),
+    Input('next-task-btn', 'n_clicks'),
+    State('annotator-name', 'value'),
+    State('journal-id', 'data'),
+    State('current-task', 'data'),
+    State('current-subject-id', 'data'),
+    State('load-subject-btn', 'n_clicks'),
+    prevent_initial_call=True
+)
+def next_task(n_clicks, annotator, journal_id, task, current_subj_id, load_clicks):
+    """
+    Lease the next window from the shared work queue and open it.
+
+    Parameters:
+        n_clicks (int)        : n_clicks of the "Next Task" button
+        annotator (str)       : Annotator name (leases are held per name; this page's journal ID when empty)
+        journal_id (str)      : Identifier of this page's edit journal
+        task (dict)           : Task leased by the previous click ({'subj_id', 'widx', 'annotator'}), if any
+        current_subj_id (Any) : Subject currently displayed
+        load_clicks (int)     : n_clicks of the "Load" button
+
+    Returns:
+        tuple: The four outputs of `open_search_result` for the leased window, the task, and a status line
+
+    Notes:
+        - Advantage     : The previous task is returned to the queue unless it was labelled (labelling completes
+                          it), so skipped windows go to other annotators and nobody labels a window twice.
+        - Shortcoming   : Without a name, a page reload loses the lease until it expires (WORK_QUEUE_LEASE_S).
+    """
+    if not n_clicks:
+        raise PreventUpdate
+    annotator = (annotator or '').strip() or journal_id
+    if task:
+        release_task(task['subj_id'], task['widx'], task['annotator'])
+    leased = lease_task(annotator)
+    if leased is None:
+        return no_update, no_update, no_update, no_update, None, "Work queue is empty"
+    until = time.strftime('%H:%M', time.localtime(leased['lease_expires']))
+    status = f"Task: {leased['subj_id']} · window {leased['widx']} (leased until {until})"
+    return (*open_window(leased['subj_id'], leased['widx'], current_subj_id, load_clicks),
+            {'subj_id': leased['subj_id'], 'widx': leased['widx'], 'annotator': annotator}, status)
+
+
+@app.callback(
+    Output('export-download', 'data'),
+    Input('export-btn', 'n_clicks'),
+    State('annotations', 'data'),
+    State('current-subject-id', 'data'),
+    State('signal-select', 'value'),
+    prevent_initial_call=True
+)
+def export_annotations(n_clicks, ann, subj_id, enabled_signals):
+    """
+    Download the current annotation store as `<subject>.json`, with the sampling rate of its peak positions
+    under 'fs'.
+
+    Exports placed in one directory per annotator are the input of `python manage.py compare_annotators`.
+    """
+    if not n_clicks or subj_id is None or ann is None:
+        raise PreventUpdate
+    store = {**ann, 'fs': subject_fs(subj_id, enabled_signals)}
+    return dict(content=json.dumps(store), filename=f"{subj_id}.json", type='application/json')
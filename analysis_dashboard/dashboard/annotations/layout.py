@@ -1,14 +1,18 @@
+import uuid
+
 from dash import html, dcc
 import dash_bootstrap_components as dbc
+from django.conf import settings
 from .utils.generate_shared_axis_figure import generate_shared_xaxis_figure
 import numpy as np
 from .utils.get_data import WIN_SAMPLES,get_subject_ids
+from .utils.signals import SIGNALS, signal_options
+from .utils.window_labels import LABELS
+from .utils.search_index import INDEX_SIGNALS, meta_values
+from .utils.transforms import view_options
 
-subject_options = [{"label": sid, "value": sid} for sid in get_subject_ids()]
-initial_ann = {'window_label': "",
-    'ecg': {'sample_peak_positions': [],'time_peak_positions': []},
-    'ppg': {'sample_peak_positions': [],'time_peak_positions': []},
-    'abp': {'sample_peak_positions': [],'time_peak_positions': []}
+initial_ann = {'window_labels': [],   # one uint8 code per window (index into LABELS), sized on subject load
+    **{name: {'sample_peak_positions': [],'time_peak_positions': []} for name in SIGNALS}   # one entry per registered signal
     }
 
 title_row_style = {
@@ -37,16 +41,28 @@ plots_column_style = {
 }
 
 
+label_options = [{'label': name.capitalize(), 'value': name} for name in LABELS if name]
+label_filter_options = [{'label': 'Unlabeled', 'value': ''}] + label_options
+
+FIGURE_RENDER_MODE = getattr(settings, 'FIGURE_RENDER_MODE', 'svg')
+
 zeros = np.zeros(WIN_SAMPLES)
-initial_fig = generate_shared_xaxis_figure(zeros, zeros, zeros, zeros)
+initial_fig = generate_shared_xaxis_figure({name: zeros for name in SIGNALS}, zeros, render_mode=FIGURE_RENDER_MODE)
 def serve_layout():
+    # built per page load, so subjects ingested while the server runs show up without a restart
+    subject_options = [{"label": sid, "value": sid} for sid in get_subject_ids()]
+    af_status_options = [{'label': f"AF status {v}", 'value': v} for v in meta_values('af_status')]
     return dbc.Container([
         dcc.Store(id='annotations', data=initial_ann),
+        dcc.Store(id='journal-id', data=uuid.uuid4().hex),  # one undo/redo journal per page load
         dcc.Store(id="reset-annotations-trigger"),
         dcc.Store(id="subject-data-cache"),
         dcc.Store(id='subject-metadata-cache', data={}),
         dcc.Store(id='current-subject-id', data=None),
         dcc.Store(id='current-window', data=-1),
+        dcc.Store(id='num-windows', data=None),
+        dcc.Store(id='search-target', data=None),
+        dcc.Store(id='current-task', data=None),   # {'subj_id', 'widx', 'annotator'} leased from the work queue
 
         html.Div(id='signal-display-container'),
         dbc.Row([
@@ -89,6 +105,13 @@ def serve_layout():
                         ]),
                     dbc.Col([dbc.Button('Load', id='load-subject-btn',active=False, n_clicks=0)]),
                     ]),
+                dbc.Row([
+                    # tasks from the shared work queue (python manage.py build_work_queue), leased per annotator
+                    dbc.Col([dcc.Input(id='annotator-name', type='text', placeholder='Annotator', persistence=True,
+                                       style={'width': '100%'})],width=7),
+                    dbc.Col([dbc.Button("Next Task", id='next-task-btn', n_clicks=0, size='sm')],width=5),
+                    ], className='mt-2'),
+                html.Small("No task leased", id='task-status'),
 
                     html.Hr(),
                     html.Div([
@@ -109,6 +132,23 @@ def serve_layout():
                         ]),
                         dbc.Col([dbc.Button("Clear All Peaks", id="clear-all-btn", className="mt-2 btn-danger",n_clicks=0)]),
                     ]),
+                    dcc.RadioItems(id='render-mode',
+                        options=[
+                        {'label': 'SVG',   'value': 'svg'},
+                        {'label': 'WebGL', 'value': 'webgl'},],
+                    value=FIGURE_RENDER_MODE, inline=True, inputClassName='me-1', labelClassName='me-3', className='mt-2'),
+                    # only the checked signals are read from the store and plotted
+                    dcc.Checklist(id='signal-select', options=signal_options(), value=list(SIGNALS),
+                                  inline=True, inputClassName='ms-2', className='mt-2'),
+                    # filtered views are computed over the whole recording once, then sliced per window
+                    dcc.RadioItems(id='signal-view', options=view_options(), value='raw',
+                                   inline=True, inputClassName='me-1', labelClassName='me-3', className='mt-2'),
+                    dcc.Dropdown(id='spectrogram-signal', options=signal_options(), value=None,
+                                 placeholder='No spectrogram', className='mt-2'),
+                    html.Div([
+                        dbc.Button([html.I(className="fa fa-undo me-1"), "Undo"], id='undo-btn', n_clicks=0, className='me-2 mt-2'),
+                        dbc.Button([html.I(className="fa fa-redo me-1"), "Redo"], id='redo-btn', n_clicks=0, className='mt-2'),
+                    ]),
 
                     html.Hr(),
                     html.H5("Window Label"),
@@ -116,15 +156,17 @@ def serve_layout():
                         dbc.Col([
                             dcc.Dropdown(
                                 id='window-label-dropdown',
-                                options=[
-                                    {'label': 'Clean', 'value': 'clean'},
-                                    {'label': 'Noisy', 'value': 'noisy'},
-                                    {'label': 'Motion', 'value': 'motion'}
-                                ],
+                                options=label_options,
                                 value='clean'),
                         ],width=9),
                         dbc.Col([dbc.Button("Add", id='add-label-btn',active=False,n_clicks=0,n_clicks_timestamp=0, className='me-1')],width=3),
                     ]),
+                    dbc.Row([
+                        dbc.Col([
+                            dcc.Dropdown(id='label-filter', options=label_filter_options, value='', clearable=False),
+                        ],width=9),
+                        dbc.Col([dbc.Button("Next", id='next-match-btn',n_clicks=0,n_clicks_timestamp=0, className='me-1')],width=3),
+                    ], className='mt-2'),
 
                     html.Hr(),
                     html.H5("Jump to Time (s)"),
@@ -132,12 +174,40 @@ def serve_layout():
                         dbc.Col([dcc.Input(id='jump-to-input', type='number', value=0, min=0)],width=9),
                         dbc.Col([dbc.Button("Go", id='jump-go-btn', className='me-4')],width=3),
                     ]),
+
+                    html.Hr(),
+                    html.H5("Search Windows"),
+                    dbc.Row([
+                        dbc.Col([dcc.Dropdown(id='search-label', options=[{'label': 'Any label', 'value': 'any'}] + label_filter_options,
+                                              value='any', clearable=False)],width=6),
+                        dbc.Col([dcc.Dropdown(id='search-af-status', options=af_status_options, placeholder='Any AF status')],width=6),
+                    ]),
+                    dbc.Row([
+                        dbc.Col([dcc.Input(id='search-min-hr', type='number', placeholder='HR min', min=0, style={'width': '100%'})],width=4),
+                        dbc.Col([dcc.Input(id='search-max-hr', type='number', placeholder='HR max', min=0, style={'width': '100%'})],width=4),
+                        dbc.Col([dcc.Input(id='search-min-quality', type='number', placeholder='Quality min', min=0, max=1, step=0.05,
+                                           style={'width': '100%'})],width=4),
+                    ], className='mt-2'),
+                    dbc.Row([
+                        dbc.Col([dcc.Checklist(id='search-has',
+                                               options=[o for o in signal_options() if o['value'] in INDEX_SIGNALS],
+                                               value=[], inline=True, inputClassName='ms-2')],width=9),
+                        dbc.Col([dbc.Button("Search", id='search-btn', n_clicks=0, className='me-1')],width=3),
+                    ], className='mt-2'),
+                    dbc.Row([
+                        dbc.Col([html.Small("Windows flagged by compare_annotators")],width=7),
+                        dbc.Col([dbc.Button("Disagreements", id='disagreements-btn', n_clicks=0, size='sm',
+                                            color='secondary', className='float-end')],width=5),
+                    ], className='mt-2'),
+                    dcc.Dropdown(id='search-results', options=[], placeholder='Run a search to list matching windows',
+                                 className='mt-2'),
                     
                     html.Hr(),
                     dbc.Row([
                         dbc.Col([dbc.Button("Save", id='save-btn', className='float-end')],style={'gridGrow': 1,'gridShrink': 1,'margin': '0.5l'}),
                         dbc.Col([dbc.Button("Export", id='export-btn', className='float-end')],style={'gridGrow': 1,'gridShrink': 1,'margin': '-0.5l'}),
                     ]),
+                    dcc.Download(id='export-download'),   # the annotation store as <subject>.json
 
                     html.Hr(),
                     dbc.Row([html.Div(id='metadata-display', children="Metadata will appear here")]),
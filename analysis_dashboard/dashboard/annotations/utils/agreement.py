@@ -0,0 +1,270 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from . import get_data
+from .annotation_journal import SAMPLES
+from .get_data import FS, WIN_SAMPLES
+from .window_labels import LABELS, UNLABELED
+
+# Exported annotation stores, one directory per annotator holding `<subj_id>.json` (dashboard "Export" button)
+ANNOTATIONS_DIR = getattr(settings, 'ANNOTATIONS_DIR', None)
+# Two peaks match when they are at most this far apart
+AGREEMENT_TOLERANCE_S = getattr(settings, 'AGREEMENT_TOLERANCE_S', 0.15)
+# Windows where any signal's F1 falls below this (or the two labels differ) are flagged as disagreements
+AGREEMENT_MIN_F1 = getattr(settings, 'AGREEMENT_MIN_F1', 0.9)
+
+
+def _nearest(values, targets):
+    """Index of the nearest element of sorted `targets` for each of `values`, and its distance (ties go left)."""
+    right = np.searchsorted(targets, values)
+    left = np.clip(right - 1, 0, targets.size - 1)
+    right = np.clip(right, 0, targets.size - 1)
+    dist_left, dist_right = np.abs(values - targets[left]), np.abs(values - targets[right])
+    pick_right = dist_right < dist_left
+    return np.where(pick_right, right, left), np.where(pick_right, dist_right, dist_left)
+
+
+def match_peaks(ref, test, tolerance):
+    """
+    Match two sorted peak lists one-to-one, closest pairs first, within `tolerance` samples.
+
+    Each round finds the nearest unmatched reference of every unmatched test peak and vice versa (two
+    `searchsorted` calls) and keeps the mutual nearest pairs within the tolerance, which greedy closest-first
+    matching would also pick. Further rounds are only needed where peaks sit closer together than the
+    tolerance, so this is a couple of vectorized passes in practice.
+
+    Parameters:
+        ref (array-like)  : Sorted reference peak positions (samples)
+        test (array-like) : Sorted test peak positions (samples)
+        tolerance (float) : Largest matching distance (samples)
+
+    Returns:
+        tuple: (test indices, reference indices) of the matched pairs, as int arrays
+    """
+    ref, test = np.asarray(ref, dtype=np.int64), np.asarray(test, dtype=np.int64)
+    test_left, ref_left = np.arange(test.size), np.arange(ref.size)
+    matched_test, matched_ref = [], []
+    while test_left.size and ref_left.size:
+        tv, rv = test[test_left], ref[ref_left]
+        near_ref, dist = _nearest(tv, rv)
+        near_test, _ = _nearest(rv, tv)
+        ok = dist <= tolerance
+        if not ok.any():
+            break
+        keep = ok & (near_test[near_ref] == np.arange(tv.size))
+        if not keep.any():      # only possible with tied distances: take the single closest pair
+            keep[np.argmin(np.where(ok, dist, np.iinfo(np.int64).max))] = True
+        matched_test.append(test_left[keep])
+        matched_ref.append(ref_left[near_ref[keep]])
+        # test peaks without a reference in range never get one later (references only disappear)
+        ref_left = np.delete(ref_left, near_ref[keep])
+        test_left = test_left[ok & ~keep]
+    empty = np.empty(0, dtype=np.intp)
+    return (np.concatenate(matched_test) if matched_test else empty,
+            np.concatenate(matched_ref) if matched_ref else empty)
+
+
+def scores(tp, fp, fn):
+    """
+    Sensitivity, positive predictive value and F1 from match counts (scalars or arrays).
+
+    Where both annotators marked nothing (tp = fp = fn = 0) all three are 1: there is nothing to disagree on.
+    """
+    tp, fp, fn = (np.asarray(x, dtype=np.float64) for x in (tp, fp, fn))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        se = np.where(tp + fn > 0, tp / (tp + fn), 1.0)
+        ppv = np.where(tp + fp > 0, tp / (tp + fp), 1.0)
+        f1 = np.where(tp + fp + fn > 0, 2 * tp / (2 * tp + fp + fn), 1.0)
+    return se, ppv, f1
+
+
+def peak_agreement(ref, test, tolerance, n_windows, win_samples=WIN_SAMPLES):
+    """
+    Per-window true-positive, false-positive and false-negative counts of `test` peaks against `ref` peaks.
+
+    A match is counted in the window of its reference peak; unmatched peaks in their own window.
+
+    Returns:
+        dict: 'tp', 'fp', 'fn' as int arrays of length `n_windows`
+    """
+    ref, test = np.sort(np.asarray(ref, dtype=np.int64)), np.sort(np.asarray(test, dtype=np.int64))
+    t_idx, r_idx = match_peaks(ref, test, tolerance)
+    matched_ref = np.zeros(ref.size, dtype=bool)
+    matched_ref[r_idx] = True
+    matched_test = np.zeros(test.size, dtype=bool)
+    matched_test[t_idx] = True
+
+    def per_window(samples):
+        widx = np.clip(samples // win_samples, 0, max(n_windows - 1, 0))
+        return np.bincount(widx, minlength=n_windows)[:n_windows]
+
+    return {'tp': per_window(ref[matched_ref]), 'fp': per_window(test[~matched_test]),
+            'fn': per_window(ref[~matched_ref])}
+
+
+def cohen_kappa(a, b, n_classes=len(LABELS)):
+    """
+    Cohen's kappa of two label-code arrays over the windows both annotators labelled.
+
+    Returns:
+        tuple: (kappa or None when no window was labelled by both, number of windows compared)
+    """
+    a, b = np.asarray(a, dtype=np.int64), np.asarray(b, dtype=np.int64)
+    both = (a != UNLABELED) & (b != UNLABELED)
+    n = int(both.sum())
+    if n == 0:
+        return None, 0
+    confusion = np.bincount(a[both] * n_classes + b[both], minlength=n_classes ** 2).reshape(n_classes, n_classes)
+    observed = np.trace(confusion) / n
+    expected = (confusion.sum(axis=0) @ confusion.sum(axis=1)) / n ** 2
+    if expected == 1:
+        return 1.0, n
+    return float((observed - expected) / (1 - expected)), n
+
+
+def _labels(store, n_windows):
+    codes = np.zeros(n_windows, dtype=np.uint8)
+    labels = np.asarray(store.get('window_labels') or [], dtype=np.uint8)[:n_windows]
+    codes[:labels.size] = labels
+    return codes
+
+
+def _peaks(store, sig):
+    data = store.get(sig)
+    return np.asarray(data.get(SAMPLES, []) if isinstance(data, dict) else [], dtype=np.int64)
+
+
+def compare_stores(store_a, store_b, tolerance_s=AGREEMENT_TOLERANCE_S, fs=FS, win_samples=WIN_SAMPLES,
+                   min_f1=AGREEMENT_MIN_F1, n_windows=None):
+    """
+    Compare two annotators' stores of one subject (the dashboard's annotations format), taking `store_a` as
+    the reference.
+
+    Parameters:
+        store_a, store_b (dict): {'window_labels': [...], <signal>: {'sample_peak_positions': [...], ...}, ...}
+        tolerance_s (float)    : Peak matching tolerance in seconds
+        fs (float)             : Sampling rate of the peak positions
+        win_samples (int)      : Window length in samples
+        min_f1 (float)         : Windows with a signal below this F1 are flagged
+        n_windows (int)        : Number of windows (default: enough to cover every label and peak)
+
+    Returns:
+        dict: 'n_windows'; 'signals' {sig: subject totals 'tp', 'fp', 'fn', 'se', 'ppv', 'f1'}; 'labels' {'kappa',
+              'compared', 'agreement'}; 'windows': flagged windows as {'widx', 'min_f1', 'fp', 'fn', 'label_a',
+              'label_b'}, worst first
+
+    Notes:
+        - Advantage     : Counts, scores and flags are whole-array operations; a subject costs a few NumPy passes
+                          whatever its length.
+        - Shortcoming   : Label disagreement only counts windows labelled by both annotators.
+    """
+    sigs = sorted({k for s in (store_a, store_b) for k, v in s.items() if isinstance(v, dict)})
+    peaks = {sig: (_peaks(store_a, sig), _peaks(store_b, sig)) for sig in sigs}
+    if n_windows is None:
+        last = max((int(p.max()) for pair in peaks.values() for p in pair if p.size), default=-1)
+        n_windows = max(len(store_a.get('window_labels') or []), len(store_b.get('window_labels') or []),
+                        last // win_samples + 1)
+
+    signals, window_f1 = {}, np.ones(n_windows)
+    fp_total, fn_total = np.zeros(n_windows, dtype=np.int64), np.zeros(n_windows, dtype=np.int64)
+    for sig, (ref, test) in peaks.items():
+        counts = peak_agreement(ref, test, tolerance_s * fs, n_windows, win_samples)
+        window_f1 = np.minimum(window_f1, scores(counts['tp'], counts['fp'], counts['fn'])[2])
+        fp_total += counts['fp']
+        fn_total += counts['fn']
+        totals = {k: int(v.sum()) for k, v in counts.items()}
+        se, ppv, f1 = scores(totals['tp'], totals['fp'], totals['fn'])
+        signals[sig] = {**totals, 'se': float(se), 'ppv': float(ppv), 'f1': float(f1)}
+
+    labels_a, labels_b = _labels(store_a, n_windows), _labels(store_b, n_windows)
+    kappa, compared = cohen_kappa(labels_a, labels_b)
+    both = (labels_a != UNLABELED) & (labels_b != UNLABELED)
+    label_mismatch = both & (labels_a != labels_b)
+
+    flagged = np.flatnonzero((window_f1 < min_f1) | label_mismatch)
+    flagged = flagged[np.lexsort((flagged, ~label_mismatch[flagged], window_f1[flagged]))]
+    windows = [{'widx': int(w), 'min_f1': float(window_f1[w]), 'fp': int(fp_total[w]), 'fn': int(fn_total[w]),
+                'label_a': LABELS[labels_a[w]], 'label_b': LABELS[labels_b[w]]} for w in flagged]
+    return {
+        'n_windows': int(n_windows),
+        'signals': signals,
+        'labels': {'kappa': kappa, 'compared': compared,
+                   'agreement': float(1 - label_mismatch.sum() / compared) if compared else None},
+        'windows': windows,
+    }
+
+
+def load_store(path):
+    """Read an exported annotation store (JSON)."""
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def store_fs(subj_id, *stores):
+    """
+    Sampling rate of a subject's peak positions: the 'fs' of its exported stores (written by the dashboard's
+    Export button), else the subject's rate in the catalogue, else FS for subjects no longer in the store.
+    """
+    for store in stores:
+        if store.get('fs'):
+            return float(store['fs'])
+    try:
+        return get_data.subject_fs(subj_id)
+    except (KeyError, OSError):
+        return float(FS)
+
+
+def _compare_files(args):
+    subj_id, path_a, path_b, kwargs = args
+    store_a, store_b = load_store(path_a), load_store(path_b)
+    kwargs = {'fs': store_fs(subj_id, store_a, store_b), **kwargs}
+    return {'subj_id': subj_id, **compare_stores(store_a, store_b, **kwargs)}
+
+
+def compare_annotators(dir_a, dir_b, subj_ids=None, workers=None, **kwargs):
+    """
+    Compare two annotators across every subject both have exported, in parallel processes.
+
+    Parameters:
+        dir_a, dir_b (str or Path): Annotator directories of `<subj_id>.json` stores; `dir_a` is the reference
+        subj_ids (list[str])      : Only these subjects (default: every subject found in both directories)
+        workers (int)             : Worker processes (default: one per CPU; 1 runs in this process)
+        **kwargs                  : Passed to `compare_stores` (tolerance_s, win_samples, min_f1; fs overrides
+                                    each subject's own rate, see `store_fs`)
+
+    Returns:
+        list[dict]: One `compare_stores` result per subject, with its 'subj_id', in subject order
+    """
+    dir_a, dir_b = Path(dir_a), Path(dir_b)
+    found = sorted({p.stem for p in dir_a.glob('*.json')} & {p.stem for p in dir_b.glob('*.json')})
+    if subj_ids is not None:
+        found = [s for s in found if s in set(subj_ids)]
+    tasks = [(s, dir_a / f"{s}.json", dir_b / f"{s}.json", kwargs) for s in found]
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    if workers <= 1:
+        return [_compare_files(t) for t in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_compare_files, tasks, chunksize=max(1, len(tasks) // (4 * workers))))
+
+
+def summarize(results):
+    """Totals over several subjects' results: per-signal counts and scores, and pooled label agreement."""
+    signals = {}
+    for r in results:
+        for sig, s in r['signals'].items():
+            t = signals.setdefault(sig, {'tp': 0, 'fp': 0, 'fn': 0})
+            for k in t:
+                t[k] += s[k]
+    for t in signals.values():
+        se, ppv, f1 = scores(t['tp'], t['fp'], t['fn'])
+        t.update(se=float(se), ppv=float(ppv), f1=float(f1))
+    compared = sum(r['labels']['compared'] for r in results)
+    agreeing = sum(r['labels']['agreement'] * r['labels']['compared'] for r in results if r['labels']['compared'])
+    return {'subjects': len(results), 'signals': signals, 'labels_compared': compared,
+            'label_agreement': agreeing / compared if compared else None,
+            'flagged_windows': sum(len(r['windows']) for r in results)}
@@ -0,0 +1,272 @@
+import contextlib
+import copy
+import threading
+import uuid
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+import numpy as np
+
+from .window_labels import WindowLabels, label_code
+
+SNAPSHOT_EVERY = 200   # full copy of the store every N operations, so replay never walks more than N deltas
+MAX_JOURNALS = 64      # journals kept per worker process (one per open dashboard page)
+
+SAMPLES, TIMES = 'sample_peak_positions', 'time_peak_positions'
+REVISION = 'revision'  # store key: token of the journal state the store was produced from
+
+
+def new_revision():
+    return uuid.uuid4().hex
+
+
+def _peaks(state, sig):
+    sd = state.setdefault(sig, {})
+    return sd.setdefault(SAMPLES, []), sd.setdefault(TIMES, [])
+
+
+def _insert(state, sig, pairs):
+    sp, tp = _peaks(state, sig)
+    for s, t in pairs:
+        i = bisect_left(sp, s)
+        sp.insert(i, s)
+        tp.insert(i, t)
+
+
+def _delete(state, sig, lo_sample, hi_sample):
+    """Remove and return the (sample, time) pairs with lo_sample <= sample <= hi_sample."""
+    sp, tp = _peaks(state, sig)
+    lo, hi = bisect_left(sp, lo_sample), bisect_right(sp, hi_sample)
+    removed = tuple(zip(sp[lo:hi], tp[lo:hi]))
+    del sp[lo:hi], tp[lo:hi]
+    return removed
+
+
+def _apply(state, op):
+    kind = op[0]
+    if kind == 'add':
+        _, sig, s, t = op
+        _insert(state, sig, ((s, t),))
+    elif kind == 'remove':
+        _, sig, removed = op
+        for s, _t in removed:
+            _delete(state, sig, s, s)
+    elif kind == 'clear':
+        _, start, end, removed = op
+        for sig, _pairs in removed:
+            _delete(state, sig, start, end - 1)
+    elif kind == 'label':
+        _, widx, _old, new = op
+        state['window_labels'][widx] = new
+
+
+def _invert(state, op):
+    kind = op[0]
+    if kind == 'add':
+        _, sig, s, _t = op
+        _delete(state, sig, s, s)
+    elif kind == 'remove':
+        _, sig, removed = op
+        _insert(state, sig, removed)
+    elif kind == 'clear':
+        for sig, pairs in op[3]:
+            _insert(state, sig, pairs)
+    elif kind == 'label':
+        _, widx, old, _new = op
+        state['window_labels'][widx] = old
+
+
+def _normalized(state):
+    """Deep-copy a store, make every signal's peak lists sorted and aligned, and hold labels as uint8 codes."""
+    state = copy.deepcopy(state or {})
+    state['window_labels'] = np.asarray(state.get('window_labels', []), dtype=np.uint8)
+    for sig, data in state.items():
+        if isinstance(data, dict):
+            pairs = sorted(zip(data.get(SAMPLES, []), data.get(TIMES, [])))
+            data[SAMPLES] = [s for s, _ in pairs]
+            data[TIMES] = [t for _, t in pairs]
+    return state
+
+
+class AnnotationJournal:
+    """
+    Operation journal over an annotation store, supporting undo, redo and replay to any point.
+
+    Each edit is kept as a compact delta tuple - ('add', sig, sample, time), ('remove', sig, pairs),
+    ('clear', start, end, ((sig, pairs), ...)) or ('label', window, old, new) - holding just enough to apply and
+    invert it. The live store is updated in place, and a full snapshot is taken every `snapshot_every` edits
+    so that replay starts from the nearest snapshot instead of the beginning.
+
+    Notes:
+        - Advantage     : Memory grows with the number of edits (plus one snapshot per `snapshot_every` edits),
+                          not edits x store size; no copy of the store is made per edit.
+        - Advantage     : Peak lists stay sorted through bisection, O(log n) search per click instead of a full sort.
+        - Shortcoming   : `state` is the live dict; callers must not mutate it outside the journal.
+
+    Every change gives the store a new REVISION token, so `get_journal` can tell whether the store a client
+    sends is the one this journal holds. `lock` serializes requests of the same page.
+    """
+
+    def __init__(self, state, snapshot_every=SNAPSHOT_EVERY, revision=None):
+        self.snapshot_every = snapshot_every
+        self.lock = threading.RLock()
+        self.reset(state, revision)
+
+    @property
+    def revision(self):
+        return self._state[REVISION]
+
+    def reset(self, state, revision=None):
+        """Start a new history from `state` (copied), tagged `revision` (a new token by default)."""
+        self._state = _normalized(state)
+        self._state[REVISION] = revision or new_revision()
+        self.labels = WindowLabels(self._state['window_labels'])
+        self.ops = []
+        self.cursor = 0
+        self.snapshots = {0: copy.deepcopy(self._state)}
+
+    @property
+    def state(self):
+        """The current annotation store (live, not a copy)."""
+        return self._state
+
+    @property
+    def can_undo(self):
+        return self.cursor > 0
+
+    @property
+    def can_redo(self):
+        return self.cursor < len(self.ops)
+
+    def _record(self, op):
+        if self.can_redo:
+            # a new edit after undo discards the redo branch
+            del self.ops[self.cursor:]
+            self.snapshots = {k: v for k, v in self.snapshots.items() if k <= self.cursor}
+        _apply(self._state, op)
+        self._sync_labels(op, undo=False)
+        self.ops.append(op)
+        self.cursor += 1
+        self._state[REVISION] = new_revision()
+        if self.cursor % self.snapshot_every == 0:
+            self.snapshots[self.cursor] = copy.deepcopy(self._state)
+        return True
+
+    def add_peak(self, sig, sample, time):
+        """Add a peak unless one already exists at `sample`. Returns True if the store changed."""
+        sp, _tp = _peaks(self._state, sig)
+        i = bisect_left(sp, sample)
+        if i < len(sp) and sp[i] == sample:
+            return False
+        return self._record(('add', sig, sample, time))
+
+    def remove_peaks(self, sig, sample, tolerance=1):
+        """Remove every peak within ±`tolerance` samples of `sample`. Returns True if the store changed."""
+        sp, tp = _peaks(self._state, sig)
+        lo, hi = bisect_left(sp, sample - tolerance), bisect_right(sp, sample + tolerance)
+        if lo == hi:
+            return False
+        return self._record(('remove', sig, tuple(zip(sp[lo:hi], tp[lo:hi]))))
+
+    def clear_range(self, start, end):
+        """Remove all peaks of every signal with start <= sample < end. Returns True if the store changed."""
+        removed = []
+        for sig, data in self._state.items():
+            if not isinstance(data, dict):
+                continue
+            sp, tp = _peaks(self._state, sig)
+            lo, hi = bisect_left(sp, start), bisect_left(sp, end)
+            if lo < hi:
+                removed.append((sig, tuple(zip(sp[lo:hi], tp[lo:hi]))))
+        if not removed:
+            return False
+        return self._record(('clear', start, end, tuple(removed)))
+
+    def _sync_labels(self, op, undo):
+        if op[0] == 'label':
+            _, widx, old, new = op
+            self.labels.changed(widx, new, old) if undo else self.labels.changed(widx, old, new)
+
+    def set_label(self, widx, value):
+        """Set the label of window `widx` (a name from LABELS). Returns True if the store changed."""
+        if not 0 <= widx < len(self.labels):
+            return False
+        old, new = int(self.labels.codes[widx]), label_code(value)
+        if old == new:
+            return False
+        return self._record(('label', widx, old, new))
+
+    def undo(self):
+        """Revert the most recent edit. Returns False when there is nothing to undo."""
+        if not self.can_undo:
+            return False
+        self.cursor -= 1
+        _invert(self._state, self.ops[self.cursor])
+        self._sync_labels(self.ops[self.cursor], undo=True)
+        self._state[REVISION] = new_revision()
+        return True
+
+    def redo(self):
+        """Re-apply the most recently undone edit. Returns False when there is nothing to redo."""
+        if not self.can_redo:
+            return False
+        _apply(self._state, self.ops[self.cursor])
+        self._sync_labels(self.ops[self.cursor], undo=False)
+        self.cursor += 1
+        self._state[REVISION] = new_revision()
+        return True
+
+    def state_at(self, n):
+        """Return a new store equal to the state after the first `n` edits (0 = initial state)."""
+        if not 0 <= n <= len(self.ops):
+            raise IndexError(f"Journal has {len(self.ops)} edits, cannot replay to {n}")
+        base = max(k for k in self.snapshots if k <= n)
+        state = copy.deepcopy(self.snapshots[base])
+        for op in self.ops[base:n]:
+            _apply(state, op)
+        return state
+
+    def replay_to(self, n):
+        """Move the live store to the state after `n` edits, keeping later edits available for redo."""
+        self._state = self.state_at(n)
+        self._state[REVISION] = new_revision()
+        self.labels = WindowLabels(self._state['window_labels'])
+        self.cursor = n
+
+
+_journals = OrderedDict()
+_journals_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def get_journal(journal_id, state):
+    """
+    Hold the journal of one dashboard page, locked and in sync with the client's store.
+
+    Parameters:
+        journal_id (str): Per-page identifier (the 'journal-id' store)
+        state (dict)    : The client's current annotation store
+
+    Yields:
+        AnnotationJournal: The page's journal; it is reseeded from `state` when this process has none or holds
+                           a different revision (the store was last changed by another worker, or by a
+                           concurrent request), so edits are never applied to a stale copy
+
+    Notes:
+        - Advantage     : With several workers, each one follows the store the client actually holds.
+        - Shortcoming   : Reseeding starts a new history, so undo does not reach edits made before the request
+                          moved to this worker.
+    """
+    state = state or {}
+    with _journals_lock:
+        journal = _journals.get(journal_id)
+        if journal is None:
+            journal = _journals[journal_id] = AnnotationJournal(state, revision=state.get(REVISION))
+            while len(_journals) > MAX_JOURNALS:
+                _journals.popitem(last=False)
+        else:
+            _journals.move_to_end(journal_id)
+    with journal.lock:
+        if journal.revision != state.get(REVISION):
+            journal.reset(state, revision=state.get(REVISION))
+        yield journal
@@ -0,0 +1,545 @@
+import contextlib
+import itertools
+import json
+import platform
+import subprocess
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+
+import numpy as np
+import h5py
+import plotly
+from django.conf import settings
+
+from . import agreement, get_data, payload_cache, search_index, transforms, work_queue
+from .generate_shared_axis_figure import RENDER_MODES, build_shared_xaxis_figure, generate_shared_xaxis_figure
+from .get_data import FS, WIN_SAMPLES, load_window_arrays, load_window_slice, load_subject_metadata, overlay_annotations
+from .signals import SIGNALS
+
+SCHEMA_VERSION = 1
+
+
+def summarize(samples):
+    """
+    Reduce a list of wall-clock durations to the statistics stored in benchmark results.
+
+    Parameters:
+        samples (list[float]): Durations in seconds
+
+    Returns:
+        dict: n, min_s, median_s, mean_s, p95_s, max_s
+    """
+    arr = np.asarray(samples, dtype=float)
+    return {
+        'n': int(arr.size),
+        'min_s': float(arr.min()),
+        'median_s': float(np.median(arr)),
+        'mean_s': float(arr.mean()),
+        'p95_s': float(np.percentile(arr, 95)),
+        'max_s': float(arr.max()),
+    }
+
+
+def time_call(fn, repeat=20, warmup=2, setup=None):
+    """
+    Time repeated calls of `fn`, optionally feeding it an untimed per-call setup value.
+
+    Parameters:
+        fn (callable)       : Function under test; called as fn() or fn(setup())
+        repeat (int)        : Number of timed calls
+        warmup (int)        : Number of untimed calls made first
+        setup (callable)    : Optional factory whose result is passed to `fn` (not timed)
+
+    Returns:
+        dict: Statistics from `summarize`
+    """
+    def once():
+        args = (setup(),) if setup is not None else ()
+        t0 = time.perf_counter()
+        fn(*args)
+        return time.perf_counter() - t0
+
+    for _ in range(warmup):
+        once()
+    return summarize([once() for _ in range(repeat)])
+
+
+def synthetic_annotations(n_peaks, n_samples, fs, rng):
+    """
+    Build an annotation store (same shape as `initial_ann`) holding `n_peaks` peaks per signal.
+
+    Parameters:
+        n_peaks (int)               : Peaks per signal, spread uniformly over the recording
+        n_samples (int)             : Recording length in samples
+        fs (float)                  : Sampling frequency (Hz)
+        rng (np.random.Generator)   : Random generator
+
+    Returns:
+        dict: Annotation store with sorted sample/time peak positions and every window unlabelled
+    """
+    ann = {'window_labels': [0] * -(-n_samples // WIN_SAMPLES)}
+    for sig in SIGNALS:
+        samples = np.sort(rng.choice(n_samples, size=min(n_peaks, n_samples), replace=False))
+        ann[sig] = {
+            'sample_peak_positions': samples.tolist(),
+            'time_peak_positions': (samples / fs).tolist(),
+        }
+    return ann
+
+
+@contextlib.contextmanager
+def use_h5_path(h5_path):
+    """Temporarily point the loaders in `get_data` (and so the Dash callbacks) at `h5_path`."""
+    previous = get_data.H5_PATH
+    get_data.H5_PATH = h5_path
+    try:
+        yield
+    finally:
+        get_data.H5_PATH = previous
+
+
+@contextlib.contextmanager
+def use_search_index(index_path):
+    """Temporarily point the search index (and the label writes made by callbacks) at `index_path`."""
+    previous = search_index.SEARCH_INDEX_PATH
+    search_index.SEARCH_INDEX_PATH = index_path
+    try:
+        yield
+    finally:
+        search_index.SEARCH_INDEX_PATH = previous
+
+
+@contextlib.contextmanager
+def use_payload_cache(root):
+    """Temporarily point the on-disk payload cache at `root` (None disables it)."""
+    previous = payload_cache.PAYLOAD_CACHE_DIR
+    payload_cache.PAYLOAD_CACHE_DIR = root
+    try:
+        yield
+    finally:
+        payload_cache.PAYLOAD_CACHE_DIR = previous
+
+
+@contextlib.contextmanager
+def without_window_cache():
+    """Temporarily disable the shared window cache so every read goes to HDF5."""
+    previous = get_data.WINDOW_CACHE_PATH
+    get_data.WINDOW_CACHE_PATH = None
+    try:
+        yield
+    finally:
+        get_data.WINDOW_CACHE_PATH = previous
+
+
+@contextlib.contextmanager
+def django_test_environment():
+    """Create a throwaway test database so callback round-trips can store their session."""
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+class DashCallbackClient:
+    """
+    Post Dash callback requests through Django's test client, exactly as the browser would.
+
+    Request bodies are built from the app's registered callbacks, so scenarios only name the
+    callback function and the property values they care about; anything else is sent as None.
+    """
+
+    def __init__(self, dash_app):
+        from django.test import Client
+        from django.urls import reverse
+
+        self.client = Client()
+        self.instance = dash_app.as_dash_instance()
+        self.url = reverse('the_django_plotly_dash:app-update-component', kwargs={'ident': dash_app._uid})
+        self.callbacks = {info['callback'].__name__: (output, info)
+                          for output, info in self.instance.callback_map.items()}
+
+    def payload(self, callback_name, values, changed):
+        output, info = self.callbacks[callback_name]
+        if output.startswith('..') and output.endswith('..'):
+            outputs = [dict(zip(('id', 'property'), o.split('.', 1))) for o in output[2:-2].split('...')]
+        else:
+            outputs = dict(zip(('id', 'property'), output.split('.', 1)))
+
+        def fill(items):
+            return [{'id': i['id'], 'property': i['property'],
+                     'value': values.get(f"{i['id']}.{i['property']}")} for i in items]
+
+        return {
+            'output': output,
+            'outputs': outputs,
+            'inputs': fill(info['inputs']),
+            'state': fill(info['state']),
+            'changedPropIds': list(changed),
+        }
+
+    def post(self, body, accept_encoding=None):
+        headers = {'Accept-Encoding': accept_encoding} if accept_encoding else {}
+        return self.client.post(self.url, data=body, content_type='application/json', headers=headers)
+
+
+def git_revision(cwd):
+    """Return (commit hash, dirty flag) for the working tree, or (None, None) outside git."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=cwd, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain'], cwd=cwd, capture_output=True,
+                                    text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def bench_loaders(h5_path, subj_ids, n_windows, repeat, warmup):
+    """
+    Time `load_window_slice` across windows/subjects (every signal, then a single one) and
+    `load_subject_metadata` per subject (read from the file, then from the metadata cache).
+    """
+    windows = itertools.cycle([(s, w) for s in subj_ids for w in range(n_windows)])
+    subjects = itertools.cycle(subj_ids)
+    single = [next(iter(SIGNALS))]
+    with without_window_cache():
+        cold = time_call(lambda: load_window_slice(*next(windows), h5_path=h5_path), repeat, warmup)
+        cold_single = time_call(lambda: load_window_slice(*next(windows), h5_path=h5_path, signals=single),
+                                repeat, warmup)
+    results = [{'name': 'load_window_slice', 'params': {'win_samples': WIN_SAMPLES, 'window_cache': False},
+                'stats': cold},
+               {'name': 'load_window_slice', 'params': {'win_samples': WIN_SAMPLES, 'window_cache': False,
+                                                        'signals': single[0]},
+                'stats': cold_single}]
+    if get_data.window_cache() is not None:
+        hot = [(s, w) for s in subj_ids for w in range(min(n_windows, repeat + warmup))]
+        for s, w in hot:
+            load_window_slice(s, w, h5_path=h5_path)
+        hot = itertools.cycle(hot)
+        results.append({'name': 'load_window_slice', 'params': {'win_samples': WIN_SAMPLES, 'window_cache': True},
+                        'stats': time_call(lambda: load_window_slice(*next(hot), h5_path=h5_path), repeat, warmup)})
+    for s in subj_ids:
+        get_data.preload_subject(s, h5_path=h5_path, max_bytes=np.inf)
+    results.append({'name': 'load_window_slice', 'params': {'win_samples': WIN_SAMPLES, 'preloaded': True},
+                    'stats': time_call(lambda: load_window_slice(*next(windows), h5_path=h5_path), repeat, warmup)})
+    get_data.release_subjects()
+    for cached in (False, True):
+        results.append({'name': 'load_subject_metadata', 'params': {'cached': cached},
+                        'stats': time_call(lambda: load_subject_metadata(next(subjects), h5_path=h5_path, cache=cached),
+                                           repeat, warmup)})
+    return results
+
+
+def bench_figure(h5_path, subj_id, repeat, warmup, sizes=(WIN_SAMPLES, 100_000)):
+    """
+    Time building the base figure (one row per registered signal) per render mode and record its JSON payload size, both with
+    `generate_shared_xaxis_figure` (make_subplots + validated updates) and from the cached template.
+
+    `sizes` are points per trace; the window length uses real data, larger sizes tile it. No browser is
+    involved, so this measures server build time and transfer size, not client render time.
+    """
+    w = load_window_arrays(subj_id, 0, h5_path=h5_path)
+    results = []
+    for n_points in sizes:
+        reps = -(-n_points // w['t'].size)
+        signals = {k: np.tile(w[k], reps)[:n_points] for k in SIGNALS}
+        t = np.arange(n_points, dtype=np.float32) / w['fs']
+        for mode in RENDER_MODES:
+            for build in (generate_shared_xaxis_figure, build_shared_xaxis_figure):
+                fig = build(signals, t, render_mode=mode)
+                results.append({
+                    'name': build.__name__,
+                    'params': {'render_mode': mode, 'n_points': int(n_points)},
+                    'stats': time_call(lambda: build(signals, t, render_mode=mode), repeat, warmup),
+                    'payload_bytes': len(plotly.io.to_json(fig, validate=False)),
+                })
+    return results
+
+
+def bench_overlay(h5_path, subj_id, n_samples, fs, peak_counts, repeat, warmup, rng):
+    """
+    Time `overlay_annotations` on a middle window for stores of increasing peak counts, applied to the
+    figure dict `build_shared_xaxis_figure` returns, as `update_plots` does (the dict is built untimed).
+    """
+    widx = max(n_samples // WIN_SAMPLES // 2, 0)
+    w = load_window_arrays(subj_id, widx, h5_path=h5_path)
+    signals = {k: w[k] for k in SIGNALS}
+    results = []
+    for n_peaks in peak_counts:
+        ann = synthetic_annotations(n_peaks, n_samples, fs, rng)
+        results.append({
+            'name': 'overlay_annotations',
+            'params': {'n_peaks_per_signal': int(n_peaks)},
+            'stats': time_call(lambda fig: overlay_annotations(fig, ann, subj_id, widx, FS, WIN_SAMPLES),
+                               repeat, warmup, setup=lambda: build_shared_xaxis_figure(signals, w['t'])),
+        })
+    return results
+
+
+def bench_agreement(n_samples, fs, peak_counts, repeat, warmup, rng):
+    """
+    Time `compare_stores` on two annotators' stores of increasing peak counts: the second is the first with
+    every peak jittered by up to 3 samples, 3% of peaks dropped and 1% spurious ones added.
+    """
+    results = []
+    for n_peaks in peak_counts:
+        ann_a = synthetic_annotations(n_peaks, n_samples, fs, rng)
+        ann_b = {'window_labels': ann_a['window_labels']}
+        for sig in SIGNALS:
+            peaks = np.asarray(ann_a[sig]['sample_peak_positions'])
+            kept = peaks[rng.random(peaks.size) > 0.03]
+            spurious = rng.integers(0, n_samples, peaks.size // 100)
+            ann_b[sig] = {'sample_peak_positions': np.sort(np.concatenate([
+                np.clip(kept + rng.integers(-3, 4, kept.size), 0, n_samples - 1), spurious])).tolist()}
+        results.append({'name': 'compare_stores', 'params': {'n_peaks_per_signal': int(n_peaks)},
+                        'stats': time_call(lambda: agreement.compare_stores(ann_a, ann_b, fs=fs), repeat, warmup)})
+    return results
+
+
+def bench_payload_cache(h5_path, subj_ids, n_windows, repeat, warmup, root):
+    """
+    Time `load_window_payload` on a cold start (no payload or window cache: HDF5 read plus encoding) against
+    a payload cache filled by `warm_subject`, read through a fresh cache object as a restarted worker would.
+    """
+    windows = itertools.cycle([(s, w) for s in subj_ids for w in range(n_windows)])
+    with use_payload_cache(None), without_window_cache():
+        cold = time_call(lambda: payload_cache.load_window_payload(*next(windows), h5_path=h5_path), repeat, warmup)
+    results = [{'name': 'load_window_payload', 'params': {'payload_cache': False}, 'stats': cold}]
+    with use_payload_cache(root), without_window_cache():
+        t0 = time.perf_counter()
+        for s in subj_ids:
+            payload_cache.warm_subject(s, h5_path=h5_path)
+        results.append({'name': 'warm_payload_cache', 'params': {'n_subjects': len(subj_ids)},
+                        'stats': summarize([time.perf_counter() - t0])})
+        payload_cache._caches.clear()
+        results.append({'name': 'load_window_payload', 'params': {'payload_cache': True},
+                        'stats': time_call(lambda: payload_cache.load_window_payload(*next(windows), h5_path=h5_path),
+                                           repeat, warmup)})
+    return results
+
+
+def bench_transforms(h5_path, subj_id, n_windows, repeat, warmup):
+    """
+    Time each filtered view of one subject cold (whole-recording transform) and warm (one window sliced from
+    it), and the spectrogram columns of one window cold (band-pass and STFT of the recording) and warm.
+    """
+    windows = itertools.cycle(range(n_windows))
+    sig = next(iter(SIGNALS))
+    calls = [('load_view_window', {'view': view}, lambda w, view=view: transforms.load_view_window(
+                  subj_id, w, view, h5_path=h5_path)) for view in list(transforms.VIEWS)[1:]]
+    calls.append(('spectrogram_window', {'signal': sig},
+                  lambda w: transforms.spectrogram_window(subj_id, w, sig, h5_path=h5_path)))
+    results = []
+    with without_window_cache():
+        for name, params, fn in calls:
+            samples = []
+            for _ in range(max(repeat // 5, 1)):
+                transforms.release_transforms()
+                t0 = time.perf_counter()
+                fn(0)
+                samples.append(time.perf_counter() - t0)
+            results.append({'name': name, 'params': {**params, 'cached': False}, 'stats': summarize(samples)})
+            results.append({'name': name, 'params': {**params, 'cached': True},
+                            'stats': time_call(lambda: fn(next(windows)), repeat, warmup)})
+        transforms.release_transforms()
+    return results
+
+
+def bench_search(h5_path, subj_ids, repeat, warmup):
+    """Time building the search index over every subject, then a few filtered cross-subject queries."""
+    t0 = time.perf_counter()
+    stats = search_index.build_index(h5_path, force=True)
+    results = [{'name': 'build_search_index', 'params': {'n_subjects': len(subj_ids)},
+                'stats': summarize([time.perf_counter() - t0]), 'windows': stats['windows']}]
+    queries = {
+        'hr': {'min_hr': 120},
+        'label_abp_hr': {'label': 'motion', 'has': ('abp',), 'min_hr': 120},
+        'quality_meta': {'min_quality': 0.9, 'meta': {'af_status': 0}},
+    }
+    for name, query in queries.items():
+        results.append({'name': 'search_windows', 'params': {'query': name},
+                        'stats': time_call(lambda: search_index.search_windows(**query), repeat, warmup)})
+    return results
+
+
+def bench_work_queue(n_windows, repeat, warmup):
+    """Time building the work queue from the search index (see `bench_search`), then leasing and completing tasks."""
+    t0 = time.perf_counter()
+    work_queue.build_work_queue()
+    results = [{'name': 'build_work_queue', 'params': {'n_tasks': n_windows},
+                'stats': summarize([time.perf_counter() - t0])}]
+    annotators = itertools.count()
+    leased = []
+    results.append({'name': 'lease_task', 'params': {},
+                    'stats': time_call(lambda: leased.append(work_queue.lease_task(f"bench-{next(annotators)}")),
+                                       repeat, warmup)})
+    tasks = [t for t in leased if t is not None]      # leases run out when the queue is smaller than repeat
+    if tasks:
+        tasks = itertools.cycle(tasks)
+        results.append({'name': 'complete_task', 'params': {},
+                        'stats': time_call(lambda t: work_queue.complete_task(t['subj_id'], t['widx']),
+                                           repeat, warmup, setup=lambda: next(tasks))})
+    return results
+
+
+def bench_callbacks(h5_path, subj_id, n_samples, fs, peak_counts, repeat, warmup, rng):
+    """
+    Time full Dash callback round-trips (request encode, dispatch, response encode) via Django.
+
+    Edits are posted on a new journal each call, so every timed request changes the store; an undo is
+    preceded by an untimed peak addition on its journal, so there is an edit to revert.
+    """
+    from ..app import app
+
+    client = DashCallbackClient(app)
+    n_windows = max(n_samples // WIN_SAMPLES, 1)
+    ann_empty = synthetic_annotations(0, n_samples, fs, rng)
+    add_peak = {'signal-plots.clickData': {'points': [{'x': 1.0, 'y': 0.5, 'pointIndex': int(fs), 'curveNumber': 0}]},
+                'mode-selector.value': 'add', 'annotations.data': ann_empty, 'current-window.data': 0,
+                'current-subject-id.data': subj_id, 'signal-select.value': list(SIGNALS)}
+
+    def edit_body(values, changed, before=()):
+        """Body of a modify_annotations request on a new journal, after the `before` edits are applied to it."""
+        journal = {'journal-id.data': uuid.uuid4().hex}
+        for prior_values, prior_changed in before:
+            response = client.post(json.dumps(client.payload('modify_annotations', {**prior_values, **journal},
+                                                             prior_changed)))
+            journal['annotations.data'] = json.loads(response.content)['response']['annotations']['data']
+        return json.dumps(client.payload('modify_annotations', {**values, **journal}, changed))
+    scenarios = [
+        ('load_subject', 'load_subject_metadata_callback',
+         {'load-subject-btn.n_clicks': 1, 'subject-dropdown.value': subj_id,
+          'subject-metadata-cache.data': {}, 'signal-select.value': list(SIGNALS)},
+         ['load-subject-btn.n_clicks'], {}),
+        ('navigate_next', 'navigate',
+         {'next-window-btn.n_clicks_timestamp': 1, 'current-window.data': 0},
+         ['next-window-btn.n_clicks_timestamp'], {}),
+        ('add_peak', 'modify_annotations', add_peak, ['signal-plots.clickData'], {}),
+        ('undo', 'modify_annotations',
+         {'undo-btn.n_clicks': 1, 'annotations.data': ann_empty},
+         ['undo-btn.n_clicks'], {}, [(add_peak, ['signal-plots.clickData'])]),
+        ('set_label', 'modify_annotations',
+         {'add-label-btn.n_clicks': 1, 'window-label-dropdown.value': 'noisy', 'annotations.data': ann_empty,
+          'current-window.data': 0},
+         ['add-label-btn.n_clicks'], {}),
+        ('next_unlabeled', 'navigate',
+         {'next-match-btn.n_clicks_timestamp': 1, 'current-window.data': 0, 'label-filter.value': '',
+          'num-windows.data': n_windows, 'journal-id.data': 'benchmark', 'annotations.data': ann_empty},
+         ['next-match-btn.n_clicks_timestamp'], {}),
+    ]
+    for n_peaks in peak_counts:
+        ann = synthetic_annotations(n_peaks, n_samples, fs, rng)
+        for mode in RENDER_MODES:
+            scenarios.append(
+                ('update_plots', 'update_plots',
+                 {'current-window.data': n_windows // 2, 'annotations.data': ann,
+                  'current-subject-id.data': subj_id, 'render-mode.value': mode, 'signal-select.value': list(SIGNALS)},
+                 ['current-window.data'], {'n_peaks_per_signal': int(n_peaks), 'render_mode': mode}))
+    single = next(iter(SIGNALS))
+    scenarios.append(
+        ('update_plots', 'update_plots',
+         {'current-window.data': n_windows // 2, 'annotations.data': ann_empty,
+          'current-subject-id.data': subj_id, 'render-mode.value': 'webgl', 'signal-select.value': [single]},
+         ['current-window.data'], {'n_peaks_per_signal': 0, 'render_mode': 'webgl', 'signals': single}))
+    scenarios.append(
+        ('update_plots', 'update_plots',
+         {'current-window.data': n_windows // 2, 'annotations.data': ann_empty,
+          'current-subject-id.data': subj_id, 'render-mode.value': 'webgl', 'signal-select.value': list(SIGNALS),
+          'signal-view.value': 'bandpass', 'spectrogram-signal.value': single},
+         ['current-window.data'], {'n_peaks_per_signal': 0, 'render_mode': 'webgl', 'view': 'bandpass',
+                                   'spectrogram': single}))
+
+    results = []
+    with use_h5_path(h5_path):
+        for name, callback_name, values, changed, params, *before in scenarios:
+            if callback_name == 'modify_annotations':
+                make_body = lambda: edit_body(values, changed, *before)
+            else:
+                make_body = lambda body=json.dumps(client.payload(callback_name, values, changed)): body
+            body = make_body()
+            response = client.post(body)
+            record = {'name': f'callback.{name}', 'params': params, 'request_bytes': len(body)}
+            if response.status_code != 200:
+                # e.g. Django's DATA_UPLOAD_MAX_MEMORY_SIZE rejecting a very large annotation store
+                record['error'] = f"HTTP {response.status_code}"
+            else:
+                record['stats'] = time_call(client.post, repeat, warmup, setup=make_body)
+                record['response_bytes'] = len(response.content)
+                for coding in ('gzip', 'br'):
+                    encoded = client.post(body, accept_encoding=coding)
+                    if encoded.get('Content-Encoding') == coding:
+                        record[f'{coding}_bytes'] = len(encoded.content)
+            results.append(record)
+    return results
+
+
+def run_benchmarks(h5_path, subj_ids, n_samples, fs, peak_counts=(100, 1000, 10000, 100000),
+                   repeat=20, warmup=2, seed=0, callbacks=True):
+    """
+    Run the full suite against an existing HDF5 file and return a JSON-serializable report.
+
+    Parameters:
+        h5_path (str or Path)   : File to benchmark (usually from `write_synthetic_h5`)
+        subj_ids (list[str])    : Subjects present in the file
+        n_samples (int)         : Samples per signal per subject
+        fs (float)              : Sampling frequency (Hz)
+        peak_counts (list[int]) : Annotation sizes (peaks per signal) for overlay and redraw runs
+        repeat (int)            : Timed repetitions per benchmark
+        warmup (int)            : Untimed repetitions per benchmark
+        seed (int)              : Seed for synthetic annotations
+        callbacks (bool)        : Include Dash callback round-trips (needs a test database)
+
+    Returns:
+        dict: {'schema', 'meta', 'config', 'results'}; stable keys so runs can be diffed across commits
+    """
+    rng = np.random.default_rng(seed)
+    n_windows = max(n_samples // WIN_SAMPLES, 1)
+    commit, dirty = git_revision(settings.BASE_DIR)
+
+    results = []
+    results += bench_loaders(h5_path, subj_ids, n_windows, repeat, warmup)
+    results += bench_figure(h5_path, subj_ids[0], repeat, warmup)
+    results += bench_overlay(h5_path, subj_ids[0], n_samples, fs, peak_counts, repeat, warmup, rng)
+    results += bench_transforms(h5_path, subj_ids[0], n_windows, repeat, warmup)
+    results += bench_agreement(n_samples, fs, peak_counts, repeat, warmup, rng)
+    with tempfile.TemporaryDirectory() as tmp, use_search_index(f"{tmp}/search_index.sqlite3"), \
+            use_payload_cache(f"{tmp}/payload_cache"):
+        results += bench_payload_cache(h5_path, subj_ids, n_windows, repeat, warmup, f"{tmp}/payload_cache")
+        results += bench_search(h5_path, subj_ids, repeat, warmup)
+        results += bench_work_queue(len(subj_ids) * n_windows, repeat, warmup)
+        if callbacks:
+            with django_test_environment():
+                results += bench_callbacks(h5_path, subj_ids[0], n_samples, fs, peak_counts, repeat, warmup, rng)
+
+    return {
+        'schema': SCHEMA_VERSION,
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'git_commit': commit,
+            'git_dirty': dirty,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'h5py': h5py.__version__,
+            'plotly': plotly.__version__,
+        },
+        'config': {
+            'n_subjects': len(subj_ids),
+            'n_samples': int(n_samples),
+            'fs': fs,
+            'win_samples': WIN_SAMPLES,
+            'peak_counts': [int(p) for p in peak_counts],
+            'repeat': repeat,
+            'warmup': warmup,
+            'seed': seed,
+        },
+        'results': results,
+    }
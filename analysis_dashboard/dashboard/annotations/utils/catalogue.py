@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+
+import h5py
+
+SHARD_SUFFIX = '.h5'
+REFRESH_INTERVAL_SEC = 2.0   # unforced refreshes (subject list requests) stat the shard directory at most this often
+
+
+class SubjectCatalogue:
+    """
+    Subject id -> HDF5 file, across the main store and every shard file in a directory.
+
+    New shards are published by renaming a finished file into the shard directory (see `ingest.write_shard`),
+    so a refresh only ever sees complete files. Refreshing stats every candidate file and opens only those
+    whose (mtime, size) changed since the last look, so the cost does not grow with the number of subjects.
+
+    Notes:
+        - Advantage     : Running servers pick up new subjects on the next page load (or on the first lookup of
+                          an unknown subject) without a restart or a rescan of unchanged files.
+        - Shortcoming   : A subject id present in several files resolves to the main store first, then to the
+                          shard that sorts first; later copies are ignored.
+    """
+
+    def __init__(self, main_path, shard_dir=None, refresh_interval=REFRESH_INTERVAL_SEC):
+        self.main_path = str(main_path)
+        self.shard_dir = str(shard_dir) if shard_dir else None
+        self.refresh_interval = refresh_interval
+        self._files = {}      # path -> (mtime_ns, size, subject ids)
+        self._subjects = {}   # subject id -> path
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def _candidates(self):
+        paths = [self.main_path]
+        if self.shard_dir and os.path.isdir(self.shard_dir):
+            paths += sorted(e.path for e in os.scandir(self.shard_dir)
+                            if e.name.endswith(SHARD_SUFFIX) and not e.name.startswith('.') and e.is_file())
+        return paths
+
+    def refresh(self, force=False):
+        """
+        Pick up new, changed and removed files.
+
+        Returns:
+            bool: True if the catalogue changed
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._checked is not None and now - self._checked < self.refresh_interval:
+                return False
+            self._checked = now
+
+            changed = False
+            seen = []
+            for path in self._candidates():
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                seen.append(path)
+                known = self._files.get(path)
+                if known is not None and known[:2] == (st.st_mtime_ns, st.st_size):
+                    continue
+                with h5py.File(path, 'r') as f:
+                    ids = tuple(f['subjects'].keys()) if 'subjects' in f else ()
+                self._files[path] = (st.st_mtime_ns, st.st_size, ids)
+                changed = True
+            for path in set(self._files) - set(seen):
+                del self._files[path]
+                changed = True
+
+            if changed:
+                subjects = {}
+                for path in seen:
+                    for subj_id in self._files[path][2]:
+                        subjects.setdefault(subj_id, path)
+                self._subjects = subjects
+            return changed
+
+    def subject_ids(self):
+        """Every known subject id, main store first, then shards in file-name order."""
+        self.refresh()
+        return list(self._subjects)
+
+    def path_for(self, subj_id):
+        """
+        HDF5 file holding `subj_id`; an unknown id forces one refresh before giving up.
+
+        Raises:
+            KeyError: The subject is in none of the files
+        """
+        path = self._subjects.get(subj_id)
+        if path is None and self.refresh(force=True):
+            path = self._subjects.get(subj_id)
+        if path is None:
+            raise KeyError(subj_id)
+        return path
+
+    def by_file(self, subj_ids=None):
+        """{path: [subject ids]} for `subj_ids` (default: every subject)."""
+        self.refresh(force=True)
+        out = {}
+        for subj_id in (self._subjects if subj_ids is None else subj_ids):
+            out.setdefault(self.path_for(subj_id), []).append(subj_id)
+        return out
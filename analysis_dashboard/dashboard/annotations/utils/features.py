@@ -0,0 +1,131 @@
+import warnings
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+MIN_RR_SEC = 0.3          # refractory period for peak detection (caps detected HR at 200 bpm)
+FLAT_EPS = 1e-6           # sample-to-sample change below this counts as a flat line
+
+
+def window_view(signal, win_samples, n_windows):
+    """
+    Reshape a 1-D signal into an (n_windows, win_samples) float32 array, NaN-padding the last partial window.
+    """
+    out = np.full(n_windows * win_samples, np.nan, dtype=np.float32)
+    n = min(signal.size, out.size)
+    out[:n] = signal[:n]
+    return out.reshape(n_windows, win_samples)
+
+
+def detect_peaks(signal, fs, min_rr_sec=MIN_RR_SEC):
+    """
+    Vectorized local-maximum peak detector.
+
+    A sample is a peak when it is the maximum of its ±min_rr_sec neighbourhood and lies above the
+    median + 0.5 * (p98 - median) of its surroundings (computed per 10-s block, so baseline drift does not
+    hide peaks).
+
+    Parameters:
+        signal (np.ndarray): 1-D waveform (NaNs allowed, never reported as peaks)
+        fs (float)         : Sampling frequency (Hz)
+        min_rr_sec (float) : Minimum spacing between peaks in seconds
+
+    Returns:
+        np.ndarray: Sorted sample indices of detected peaks
+
+    Notes:
+        - Advantage     : A sliding-window max over a strided view; no Python loop over samples or beats.
+        - Shortcoming   : Meant for indexing and search (HR, peak counts), not as a clinical-grade detector.
+    """
+    x = np.asarray(signal, dtype=np.float32)
+    if x.size < 3:
+        return np.empty(0, dtype=np.int64)
+    half = max(int(min_rr_sec * fs), 1)
+    filled = np.where(np.isfinite(x), x, -np.inf)
+    padded = np.pad(filled, half, constant_values=-np.inf)
+    local_max = sliding_window_view(padded, 2 * half + 1).max(axis=1)
+    left_max = sliding_window_view(padded, half).max(axis=1)[:x.size]  # the `half` samples before each sample
+
+    block = max(int(10 * fs), 1)
+    n_blocks = -(-x.size // block)
+    blocks = window_view(x, block, n_blocks)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN blocks
+        med = np.nanmedian(blocks, axis=1)
+        top = np.nanpercentile(blocks, 98, axis=1)
+    threshold = np.repeat(med + 0.5 * (top - med), block)[:x.size]
+
+    # strictly above everything to the left keeps one peak per plateau (its first sample)
+    is_peak = (filled == local_max) & (filled > left_max) & (filled > threshold) & np.isfinite(x)
+    return np.flatnonzero(is_peak)
+
+
+# detector name (SignalSpec.detector) -> callable(signal, fs) returning sorted peak sample indices
+PEAK_DETECTORS = {'local_max': detect_peaks}
+
+
+def window_features(signals, fs, win_samples, detectors=None):
+    """
+    Per-window quality, presence, peak counts and heart rate for one subject.
+
+    Parameters:
+        signals (dict)   : signal name ('ecg', 'ppg', 'abp') -> 1-D array (missing/empty signals allowed)
+        fs (float)       : Sampling frequency shared by the signals (Hz)
+        win_samples (int): Samples per window
+        detectors (dict) : signal name -> peak detector (default: `detect_peaks` for every signal)
+
+    Returns:
+        dict: column name -> array of length n_windows:
+            - 'has_<sig>' (bool)       : the window holds usable (finite, non-flat) data for the signal
+            - '<sig>_peaks' (int)      : peaks detected in the window
+            - 'quality' (float)        : mean usable-sample fraction over the present signals (0..1)
+            - 'hr' (float)             : heart rate in bpm from the median RR of ECG peaks (PPG, then ABP as
+                                         fallback), NaN when fewer than two peaks
+
+    Notes:
+        - Advantage     : Every column is computed with whole-array NumPy operations on an (n_windows, win) view.
+        - Shortcoming   : Peaks are counted per window, so a beat straddling a window edge may count in neither.
+    """
+    n_samples = max((np.asarray(v).size for v in signals.values()), default=0)
+    n_windows = -(-n_samples // win_samples)
+    cols = {}
+    usable_fractions = []
+    hr = np.full(n_windows, np.nan)
+
+    for sig, values in signals.items():
+        values = np.asarray(values, dtype=np.float32)
+        w = window_view(values, win_samples, n_windows)
+        finite = np.isfinite(w)
+        moving = np.zeros_like(finite)
+        moving[:, 1:] = np.abs(np.diff(w, axis=1)) > FLAT_EPS
+        moving[:, 0] = moving[:, 1] if win_samples > 1 else finite[:, 0]
+        usable = (finite & moving).mean(axis=1)
+        cols[f'has_{sig}'] = usable > 0.5
+        usable_fractions.append(np.where(cols[f'has_{sig}'], usable, np.nan))
+
+        peaks = (detectors or {}).get(sig, detect_peaks)(values, fs)
+        widx = peaks // win_samples
+        cols[f'{sig}_peaks'] = np.bincount(widx, minlength=n_windows)[:n_windows]
+
+        # median RR per window: RR intervals whose both ends fall in the same window
+        if peaks.size > 1:
+            rr = np.diff(peaks).astype(np.float64)
+            same = widx[1:] == widx[:-1]
+            rr, rr_w = rr[same], widx[1:][same]
+            order = np.lexsort((rr, rr_w))
+            rr, rr_w = rr[order], rr_w[order]
+            starts = np.searchsorted(rr_w, np.arange(n_windows), side='left')
+            counts = np.bincount(rr_w, minlength=n_windows)[:n_windows]
+            has_rr = (counts > 0) & np.isnan(hr) & cols[f'has_{sig}']
+            mid_lo = np.minimum(starts + (counts - 1) // 2, max(rr.size - 1, 0))
+            mid_hi = np.minimum(starts + counts // 2, max(rr.size - 1, 0))
+            if rr.size:
+                median_rr = (rr[mid_lo] + rr[mid_hi]) / 2
+                hr[has_rr] = 60.0 * fs / median_rr[has_rr]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # windows with no usable signal
+        quality = np.nanmean(np.vstack(usable_fractions), axis=0) if usable_fractions else np.zeros(n_windows)
+    cols['quality'] = np.nan_to_num(quality, nan=0.0)
+    cols['hr'] = hr
+    return cols
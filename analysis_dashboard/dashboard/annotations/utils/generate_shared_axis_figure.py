@@ -1,60 +1,207 @@
+import base64
+import warnings
+from collections.abc import Mapping
+
 import numpy as np
 import plotly.graph_objs as go
 from plotly.subplots import make_subplots
 
+from .signals import resolve, selected
+
+# 'svg': go.Scatter with invisible per-sample markers (legacy); 'webgl': go.Scattergl lines only
+RENDER_MODES = ('svg', 'webgl')
+
+
+def row_axes(row):
+    """(xaxis ref, yaxis ref, x-axis layout key, y-axis layout key) of subplot row `row` (1-based), as make_subplots names them."""
+    suffix = '' if row == 1 else str(row)
+    return f'x{suffix}', f'y{suffix}', f'xaxis{suffix}', f'yaxis{suffix}'
+
+
+def time_range(t):
+    """
+    x-axis range of a window: its first sample to one sample step past the last. With fewer than two samples there
+    is no step, so the range is one second from the first sample (from 0 when `t` is empty).
+    """
+    if len(t) < 2:
+        t0 = float(t[0]) if len(t) else 0.0
+        return [t0, t0 + 1.0]
+    return [float(t[0]), float(t[-1] + (t[1] - t[0]))]
 
 
-def generate_shared_xaxis_figure(y_ecg, y_ppg, y_abp, t):
+def generate_shared_xaxis_figure(signals, t, *legacy, render_mode='svg', spectrogram=None):
     """
-    Generate a three-row Plotly figure with a shared time axis for ECG, PPG, and ABP signals.
+    Generate a Plotly figure with one row per signal and a shared time axis.
 
     Parameters:
-        y_ecg (list[float]) : Voltage values for the ECG trace
-        y_ppg (list[float]) : Values for the PPG trace
-        y_abp (list[float]) : Values for the ABP trace
-        t (list[float])     :   Common time axis in seconds for all signals
+        signals (dict)      : Signal name -> values; rows follow the registry's display order (see signals.SIGNALS)
+        t (list[float])     : Common time axis in seconds for all signals
+        render_mode (str)   : 'svg' or 'webgl' (see RENDER_MODES)
+        spectrogram (dict)  : Optional extra bottom row: {'signal', 'times', 'freqs', 'power'} (see
+                              `transforms.spectrogram_window`), drawn as a heatmap after the signal traces
+
+    The signature before the signal registry, (y_ecg, y_ppg, y_abp, t, render_mode='svg'), is still accepted
+    with a DeprecationWarning.
 
     Returns:
-        plotly.graph_objs.Figure: A figure with three aligned subplots showing ECG, PPG, and ABP.
+        plotly.graph_objs.Figure: A figure with aligned subplots; base trace i belongs to the i-th displayed signal
+
+    Notes:
+        - Advantage     : In 'webgl' mode the browser draws the lines on the GPU and no marker is created per sample,
+                          so windows of 10^5+ samples stay interactive.
+        - Advantage     : Traces carry no per-sample customdata; a click is resolved from its curveNumber and x
+                          coordinate (see `modify_peak_logic`), which keeps the figure JSON small in both modes.
+        - Advantage     : Titles, units and axis styling come from each signal's SignalSpec, so a new signal
+                          type needs a registry entry only.
     """
+    if not isinstance(signals, Mapping):
+        if len(legacy) not in (2, 3):
+            raise TypeError("expected generate_shared_xaxis_figure(signals, t, render_mode=..., spectrogram=...)")
+        warnings.warn("generate_shared_xaxis_figure(y_ecg, y_ppg, y_abp, t) is deprecated, pass "
+                      "{'ecg': y_ecg, 'ppg': y_ppg, 'abp': y_abp} and t", DeprecationWarning, stacklevel=2)
+        signals, t, legacy = {'ecg': signals, 'ppg': t, 'abp': legacy[0]}, legacy[1], legacy[2:]
+        render_mode = legacy[0] if legacy else render_mode
+    elif legacy:
+        raise TypeError("render_mode and spectrogram are keyword arguments")
+    if render_mode not in RENDER_MODES:
+        raise ValueError(f"render_mode must be one of {RENDER_MODES}, got {render_mode!r}")
+    specs = selected(signals)
+    if not specs:
+        raise ValueError("At least one signal is needed to build a figure")
+    n_rows = len(specs) + (spectrogram is not None)
     X_AXES_FONT_SIZE = Y_AXES_FONT_SIZE = 12
-    X_AXIS_RANGE = [t[0],t[-1]+(t[1]-t[0])]
+    X_AXIS_RANGE = time_range(t)
+    titles = [spec.title for spec in specs]
+    if spectrogram is not None:
+        titles.append(f"Spectrogram ({resolve(spectrogram['signal']).label})")
     fig = make_subplots(
-        rows=3,
+        rows=n_rows,
         cols=1,
         shared_xaxes=True,
-        vertical_spacing=0.1,  # Adjust vertical spacing between subplots
-        subplot_titles=("Electro-Cardiogram (ECG)", "Photo-Plethysmography (PPG)", "Arterial Blood Pressure (ABP)")
+        vertical_spacing=min(0.1, 1 / max(n_rows - 1, 1)),  # Adjust vertical spacing between subplots
+        subplot_titles=titles
     )
     
-    fig.add_trace(go.Scatter(x=t, y=y_ecg,mode='lines+markers', marker=dict(size=6, opacity=0), meta={'signal': 'ecg'},customdata=[{'signal':'ecg'}]*len(t), name='ecg-base',hovertemplate='Time: %{x:.3f}s<br>Value: %{y:.3f}<extra></extra>',
-                             ), row=1, col=1)
-    fig.add_trace(go.Scatter(x=t, y=y_ppg,mode='lines+markers', marker=dict(size=6, opacity=0), meta={'signal': 'ppg'},customdata=[{'signal':'ppg'}]*len(t), name='ppg-base',hovertemplate='Time: %{x:.3f}s<br>Value: %{y:.3f}<extra></extra>',
-                             ), row=2, col=1)
-    fig.add_trace(go.Scatter(x=t, y=y_abp,mode='lines+markers', marker=dict(size=6, opacity=0), meta={'signal': 'abp'},customdata=[{'signal':'abp'}]*len(t), name='abp-base',hovertemplate='Time: %{x:.3f}s<br>Value: %{y:.3f}<extra></extra>',
-                             ), row=3, col=1) # , mode="lines+markers",marker=dict(opacity=1),line=dict(width=1)
+    if render_mode == 'webgl':
+        trace_cls, trace_style = go.Scattergl, dict(mode='lines')
+    else:
+        trace_cls, trace_style = go.Scatter, dict(mode='lines+markers', marker=dict(size=6, opacity=0))
+    for row, spec in enumerate(specs, start=1):
+        fig.add_trace(trace_cls(x=t, y=signals[spec.name], meta={'signal': spec.name}, name=f'{spec.name}-base',
+                                hovertemplate='Time: %{x:.3f}s<br>Value: %{y:.3f}<extra></extra>', **trace_style),
+                      row=row, col=1)
+    if spectrogram is not None:
+        fig.add_trace(go.Heatmap(x=spectrogram['times'], y=spectrogram['freqs'], z=spectrogram['power'],
+                                 colorscale='Viridis', showscale=False, name=f"{spectrogram['signal']}-spectrogram",
+                                 meta={'signal': spectrogram['signal'], 'spectrogram': True},
+                                 hovertemplate='Time: %{x:.2f}s<br>%{y:.1f} Hz<br>%{z:.1f} dB<extra></extra>'),
+                      row=n_rows, col=1)
 
-
-    for i, title in enumerate(["Electro-Cardiogram (ECG)", "Photo-Plethysmography (PPG)", "Arterial Blood Pressure (ABP)"]):
+    for i in range(n_rows):
         fig.layout.annotations[i].update(x=0.01, xanchor='left', font_size=12)
 
-    fig.update_xaxes(dtick=0.4, row=1, col=1,range=X_AXIS_RANGE,
-                     minor = dict(dtick=0.04,showgrid=True, gridcolor='lightgrey', gridwidth=0.5),
-                     showticklabels=False,showgrid=True,gridcolor='grey',gridwidth=1)
-    fig.update_xaxes(showticklabels=False, row=2, col=1,range=X_AXIS_RANGE)
-    fig.update_xaxes(title_text="Time (s)", row=3, col=1,range=X_AXIS_RANGE) 
-
-    fig.update_yaxes(title_text="mV", row=1, col=1, title_font_size=Y_AXES_FONT_SIZE, tickfont_size=Y_AXES_FONT_SIZE, 
-                    dtick=0.1, showgrid=True, gridcolor='lightgrey', gridwidth=1, zeroline=False,automargin=True, tickmode='array',
-    tickvals=np.arange(-1,1,0.25))
-    fig.update_yaxes(title_text="test", row=2, col=1, title_font_size=Y_AXES_FONT_SIZE, tickfont_size=Y_AXES_FONT_SIZE,automargin=True)
-    fig.update_yaxes(title_text="mmHg", row=3, col=1, title_font_size=Y_AXES_FONT_SIZE, tickfont_size=Y_AXES_FONT_SIZE,automargin=True)
+    for row in range(1, n_rows + 1):
+        xaxis = dict(range=X_AXIS_RANGE)
+        if row == 1:
+            xaxis.update(dtick=0.4, minor=dict(dtick=0.04,showgrid=True, gridcolor='lightgrey', gridwidth=0.5),
+                         showgrid=True,gridcolor='grey',gridwidth=1)
+        if row == n_rows:
+            xaxis.update(title_text="Time (s)")
+        else:
+            xaxis.update(showticklabels=False)
+        fig.update_xaxes(row=row, col=1, **xaxis)
+    for row, spec in enumerate(specs, start=1):
+        fig.update_yaxes(title_text=spec.units, row=row, col=1, title_font_size=Y_AXES_FONT_SIZE,
+                         tickfont_size=Y_AXES_FONT_SIZE, automargin=True, **spec.yaxis)
+    if spectrogram is not None:
+        fig.update_yaxes(title_text='Hz', row=n_rows, col=1, title_font_size=Y_AXES_FONT_SIZE,
+                         tickfont_size=Y_AXES_FONT_SIZE, automargin=True)
 
     fig.update_layout(
         clickmode='event+select',
-        height=800, 
+        height=max(320, round(800 * n_rows / 3)), 
         showlegend=False, 
         margin=dict(l=None,r=10,t=30,b=None), 
     )
 
-    return fig
\ No newline at end of file
+    return fig
+
+
+# NumPy dtype -> plotly.js typed-array code (the encoding plotly applies to NumPy arrays in go.Figure)
+TYPED_ARRAY_CODES = {'float32': 'f4', 'float64': 'f8'}
+# (signal names, render_mode, spectrogram signal) -> {'data': [trace skeletons without x/y/z], 'layout': layout dict}
+_FIGURE_TEMPLATES = {}
+
+
+def typed_array(values):
+    """Encode a float NumPy array as a plotly.js typed array ({'dtype', 'bdata'}); other values are returned as is."""
+    if isinstance(values, np.ndarray) and values.ndim == 1 and values.size and str(values.dtype) in TYPED_ARRAY_CODES:
+        return {'dtype': TYPED_ARRAY_CODES[str(values.dtype)],
+                'bdata': base64.b64encode(np.ascontiguousarray(values)).decode('ascii')}
+    return values
+
+
+def array_values(values):
+    """Inverse of `typed_array`: trace data as a NumPy array or sequence that can be indexed by sample."""
+    if isinstance(values, dict) and 'bdata' in values:
+        dtype = next(k for k, code in TYPED_ARRAY_CODES.items() if code == values['dtype'])
+        return np.frombuffer(base64.b64decode(values['bdata']), dtype=dtype)
+    return values
+
+
+def figure_template(names, render_mode='svg', spectrogram_signal=None):
+    """
+    Layout and trace skeleton of the shared-axis figure for one signal set, render mode and spectrogram row,
+    built once and reused.
+
+    The template is produced by `generate_shared_xaxis_figure` itself (on two placeholder samples), so both
+    paths always draw the same figure. The returned dicts are shared: callers must copy before mutating.
+    """
+    key = (tuple(names), render_mode, spectrogram_signal)
+    template = _FIGURE_TEMPLATES.get(key)
+    if template is None:
+        placeholder = np.zeros(2)
+        spectrogram = None if spectrogram_signal is None else \
+            {'signal': spectrogram_signal, 'times': placeholder, 'freqs': placeholder, 'power': np.zeros((2, 2))}
+        fig = generate_shared_xaxis_figure({name: placeholder for name in names}, np.arange(2.0),
+                                           render_mode=render_mode, spectrogram=spectrogram).to_plotly_json()
+        data = [{k: v for k, v in trace.items() if k not in ('x', 'y', 'z')} for trace in fig['data']]
+        template = _FIGURE_TEMPLATES[key] = {'data': data, 'layout': fig['layout']}
+    return template
+
+
+def build_shared_xaxis_figure(signals, t, render_mode='svg', spectrogram=None):
+    """
+    Same figure as `generate_shared_xaxis_figure`, returned as a plain figure dict filled from a cached template.
+
+    Parameters:
+        signals (dict)      : Signal name -> values (array-like or already-encoded typed arrays, see `typed_array`)
+        t (array-like)      : Common time axis in seconds for all signals (may also be a typed array)
+        render_mode (str)   : 'svg' or 'webgl' (see RENDER_MODES)
+        spectrogram (dict)  : Optional spectrogram row, as for `generate_shared_xaxis_figure`
+
+    Returns:
+        dict: {'data': [...], 'layout': {...}}, accepted by dcc.Graph and by `overlay_annotations`
+
+    Notes:
+        - Advantage     : Only the data arrays and x-axis ranges are set per call; make_subplots and plotly's
+                          property validators run once per signal set and render mode instead of on every navigation.
+        - Advantage     : Float NumPy arrays are sent base64-encoded, as go.Figure would send them.
+        - Shortcoming   : Nothing is validated in the hot path, so the arrays must already be plain
+                          lists or NumPy arrays of equal length.
+    """
+    if render_mode not in RENDER_MODES:
+        raise ValueError(f"render_mode must be one of {RENDER_MODES}, got {render_mode!r}")
+    names = [spec.name for spec in selected(signals)]
+    template = figure_template(names, render_mode, spectrogram and spectrogram['signal'])
+    x_range = time_range(array_values(t))
+    x = typed_array(t)
+    data = [{**trace, 'x': x, 'y': typed_array(signals[name])} for trace, name in zip(template['data'], names)]
+    if spectrogram is not None:
+        data.append({**template['data'][len(names)], 'x': typed_array(spectrogram['times']),
+                     'y': typed_array(spectrogram['freqs']), 'z': np.asarray(spectrogram['power']).round(1).tolist()})
+    layout = dict(template['layout'])
+    for row in range(1, len(data) + 1):
+        xaxis = row_axes(row)[2]
+        layout[xaxis] = {**layout[xaxis], 'range': x_range}
+    return {'data': data, 'layout': layout}
@@ -1,11 +1,35 @@
 
+import copy
+import os
+import threading
+from collections import OrderedDict
+
 import numpy as np
 from types import SimpleNamespace
 import h5py
 import plotly.graph_objects as go
 from django.conf import settings
 
+from .catalogue import SubjectCatalogue
+from .generate_shared_axis_figure import array_values, row_axes
+from .shared_cache import cache_key, get_window_cache
+from .signals import SIGNALS, SIGNAL_ALIASES, SignalDict, selected
+
 H5_PATH = settings.H5_PATH
+# Directory of extra HDF5 files with the same layout, written by `python manage.py ingest_recordings`
+H5_SHARD_DIR = getattr(settings, 'H5_SHARD_DIR', None)
+# HDF5 raw-chunk cache used whenever the store is opened (see `python manage.py repack_h5`)
+H5_RDCC_NBYTES = getattr(settings, 'H5_RDCC_NBYTES', 4 * 1024 * 1024)
+H5_RDCC_NSLOTS = getattr(settings, 'H5_RDCC_NSLOTS', 10007)
+# Host-wide decoded-window cache shared by all worker processes (None disables it)
+WINDOW_CACHE_PATH = getattr(settings, 'WINDOW_CACHE_PATH', None)
+WINDOW_CACHE_BYTES = getattr(settings, 'WINDOW_CACHE_BYTES', 0)
+# Recordings at most this large (all signals, float32) are read whole on subject load and sliced in memory
+SUBJECT_PRELOAD_MAX_BYTES = getattr(settings, 'SUBJECT_PRELOAD_MAX_BYTES', 0)
+SUBJECT_PRELOAD_MAX_SUBJECTS = getattr(settings, 'SUBJECT_PRELOAD_MAX_SUBJECTS', 8)
+# Metadata datasets with more elements than this (the waveforms `v`) are described by shape/dtype, not read
+METADATA_MAX_ELEMENTS = getattr(settings, 'METADATA_MAX_ELEMENTS', 256)
+METADATA_CACHE_SUBJECTS = getattr(settings, 'METADATA_CACHE_SUBJECTS', 1024)   # per worker process
 # --- Dummy session generation -----------------------------------------------
 
 FS = 125                    # sampling rate
@@ -17,119 +41,497 @@ WIN_LEN_SEC = 10          # seconds per window
 WIN_SAMPLES = WIN_LEN_SEC * FS
 NUM_WINDOWS = 180         # total windows (adjust based on data length
 
+# ranges up to this many windows are assembled from the shared window cache; longer ones are read directly
+RANGE_CACHE_MAX_WINDOWS = 32
+# window contents of a signal the subject does not have
+EMPTY_SIGNAL = np.empty(0, dtype=np.float32)
+
+
+def open_h5(h5_path=None, mode='r', rdcc_nbytes=None):
+    """
+    Open the HDF5 store with the configured chunk cache.
+
+    Parameters:
+        h5_path (str or Path): Path to the HDF5 file (defaults to settings.H5_PATH)
+        mode (str)           : h5py file mode
+        rdcc_nbytes (int)    : Override for the raw-chunk cache size in bytes (defaults to settings.H5_RDCC_NBYTES)
+
+    Returns:
+        h5py.File: Open file handle; use as a context manager
+    """
+    return h5py.File(h5_path or H5_PATH, mode,
+                     rdcc_nbytes=H5_RDCC_NBYTES if rdcc_nbytes is None else rdcc_nbytes,
+                     rdcc_nslots=H5_RDCC_NSLOTS)
+
+_catalogues = {}
+
+def subject_catalogue():
+    """The catalogue of the configured main store plus shard directory (one per process)."""
+    key = (str(H5_PATH), str(H5_SHARD_DIR))
+    catalogue = _catalogues.get(key)
+    if catalogue is None:
+        catalogue = _catalogues.setdefault(key, SubjectCatalogue(H5_PATH, H5_SHARD_DIR))
+    return catalogue
 
-def get_subject_ids(h5_path=H5_PATH):
+def subject_path(subj_id, h5_path=None):
+    """
+    HDF5 file to read `subj_id` from: `h5_path` when given, otherwise the file the catalogue maps it to.
+
+    Raises:
+        KeyError: No file holds the subject
+    """
+    if h5_path:
+        return str(h5_path)
+    return subject_catalogue().path_for(subj_id)
+
+def get_subject_ids(h5_path=None):
     """
     Retrieve the list of all subject identifiers stored in the HDF5 dataset.
 
     Parameters:
-        h5_path (str or Path): Path to the HDF5 file containing subject data
+        h5_path (str or Path): Path to one HDF5 file; by default every subject of the main store and its shards
 
     Returns:
         list[str]: Ordered list of subject IDs as strings
+
+    Notes:
+        - Advantage     : The default path asks the catalogue, which only opens files that are new or changed.
     """
-    with h5py.File(h5_path, 'r') as f:
+    if h5_path is None:
+        return subject_catalogue().subject_ids()
+    with open_h5(h5_path) as f:
         return list(f['subjects'].keys())
 
-def load_subject_metadata(subj_id, h5_path=H5_PATH):
+def decode_bytes(val):
+    if isinstance(val, (bytes, np.bytes_)):
+        return val.decode('utf-8', errors='ignore')
+    return val
+
+def describe_dataset(ds):
+    """Shape, dtype and size in bytes of an HDF5 dataset, from its header only (no data is read)."""
+    return {'shape': list(ds.shape), 'dtype': str(ds.dtype), 'nbytes': int(ds.size) * ds.dtype.itemsize}
+
+def load_group(g, max_elements=None):
+    """
+    Read the datasets of an HDF5 group into a dict, decoding byte strings.
+
+    Parameters:
+        g (h5py.Group)      : Group to read
+        max_elements (int)  : Datasets with more elements are not read; they are listed under 'arrays' as
+                              `describe_dataset` dicts instead (None reads everything)
+
+    Returns:
+        dict: dataset name -> value, plus 'arrays' (skipped datasets) and 'attrs' (group attributes) when not empty
+    """
+    out, arrays = {}, {}
+    for k, ds in g.items():
+        if not isinstance(ds, h5py.Dataset):
+            continue
+        if max_elements is not None and ds.size > max_elements:
+            arrays[k] = describe_dataset(ds)
+            continue
+        val = ds[()]
+        # Fix for subject_notes: single-object array with bytes
+        if isinstance(val, np.ndarray) and val.dtype == object and val.size == 1:
+            val = decode_bytes(val[0])
+        elif isinstance(val, (bytes, np.bytes_)):
+            val = decode_bytes(val)
+        out[k] = val
+    if arrays:
+        out['arrays'] = arrays
+    if g.attrs:
+        out['attrs'] = {k: decode_bytes(v) if isinstance(v, (bytes, np.bytes_)) else v for k, v in g.attrs.items()}
+    return out
+
+# (h5_path, subj_id) -> (source_fingerprint, metadata), most recently used last
+_metadata = OrderedDict()
+_metadata_lock = threading.Lock()
+
+def load_subject_metadata(subj_id, h5_path=None, cache=True):
     """
     Load static metadata and signal information for a given subject, excluding raw waveform data.
 
     Parameters:
         subj_id (str)           : Identifier of the subject to load
-        h5_path (str or Path)   : Path to the HDF5 file containing subject data
+        h5_path (str or Path)   : Path to the HDF5 file containing subject data (defaults to the subject's catalogued file)
+        cache (bool)            : Serve repeated lookups from this process's metadata cache
 
     Returns:
-        dict: Dictionary with keys 'fix', 'ppg', 'ecg', 'bp', each mapping to a metadata dict∂
-    """
-    def decode_bytes(val):
-        if isinstance(val, (bytes, np.bytes_)):
-            return val.decode('utf-8', errors='ignore')
-        return val
-
-    def load_group(g):
-        out = {}
-        for k in g.keys():
-            val = g[k][()]
-            # Fix for subject_notes: single-object array with bytes
-            if isinstance(val, np.ndarray) and val.dtype == object and val.size == 1:
-                val = decode_bytes(val[0])
-            elif isinstance(val, (bytes, np.bytes_)):
-                val = decode_bytes(val)
-            out[k] = val
-        return out
+        dict: Dictionary with key 'fix' plus one key per registered signal the subject has ('ecg', 'ppg', 'abp'),
+              each mapping to a metadata dict (see `load_group`); the waveform of a signal is only described,
+              e.g. out['ecg']['arrays']['v'] == {'shape': [n], 'dtype': 'float32', 'nbytes': 4 * n}
 
-    with h5py.File(h5_path, 'r') as f:
+    Notes:
+        - Advantage     : Datasets above METADATA_MAX_ELEMENTS are never read, so the cost does not grow with the
+                          recording length; cached entries are checked against the file's `source_fingerprint`.
+        - Shortcoming   : Small arrays (up to METADATA_MAX_ELEMENTS elements) are still read in full.
+    """
+    h5_path = subject_path(subj_id, h5_path)
+    key = (h5_path, subj_id)
+    source = source_fingerprint(h5_path)
+    if cache:
+        with _metadata_lock:
+            entry = _metadata.get(key)
+            if entry is not None and entry[0] == source:
+                _metadata.move_to_end(key)
+                return copy.deepcopy(entry[1])
+
+    with open_h5(h5_path) as f:
         subject_group = f['subjects'][subj_id]
-        return {
-            'fix': load_group(subject_group['fix']),
-            'ppg': load_group(subject_group['ppg']),
-            'ecg': load_group(subject_group['ekg']),
-            'bp':  load_group(subject_group['bp']),
-        }
+        out = SignalDict(fix=load_group(subject_group['fix'], METADATA_MAX_ELEMENTS))
+        for spec in SIGNALS.values():
+            if spec.group in subject_group:
+                out[spec.name] = load_group(subject_group[spec.group], METADATA_MAX_ELEMENTS)
+
+    if cache:
+        with _metadata_lock:
+            _metadata[key] = (source, copy.deepcopy(out))
+            while len(_metadata) > METADATA_CACHE_SUBJECTS:
+                _metadata.popitem(last=False)
+    return out
+
+def subject_fs(subj_id, signals=None, h5_path=None):
+    """
+    Sampling rate of a subject's windows (the rate their time axis `t` is built from), from the metadata cache.
 
-def load_window_slice(subj_id, widx, h5_path=H5_PATH):
+    Parameters:
+        subj_id (str)        : Identifier of the subject
+        signals (list[str])  : Displayed signals; the first one the subject has sets the rate (default: all)
+        h5_path (str or Path): Path to the HDF5 file (defaults to the subject's catalogued file)
+    """
+    meta = load_subject_metadata(subj_id, h5_path)
+    fs = {name: float(meta[name]['fs']) for name in SIGNALS if name in meta and 'fs' in meta[name]}
+    return _window_fs(fs, selected(signals))
+
+def window_cache():
+    """Return the shared window cache configured in settings, or None when disabled."""
+    return get_window_cache(WINDOW_CACHE_PATH, WINDOW_CACHE_BYTES, WIN_SAMPLES)
+
+# (h5_path, subj_id) -> preloaded recording, most recently used last; entries record the `source_fingerprint`
+# they were read at and are dropped on the first lookup after the file is rewritten
+_preloaded = OrderedDict()
+_preloaded_lock = threading.Lock()
+
+def preload_subject(subj_id, h5_path=None, max_bytes=None, signals=None):
+    """
+    Read the selected signals of a short recording once into a contiguous float32 array held in this process.
+
+    Parameters:
+        subj_id (str)        : Identifier of the subject
+        h5_path (str or Path): Path to the HDF5 file (defaults to the subject's catalogued file)
+        max_bytes (int)      : Size threshold (defaults to settings.SUBJECT_PRELOAD_MAX_BYTES; 0 disables)
+        signals (list[str])  : Signals to read (default: every registered signal); preloading again with other
+                               signals reads the union of both selections
+
+    Returns:
+        bool: True if the subject is now held in memory, False if it is too large (windows keep coming
+              from the shared cache / HDF5)
+
+    Notes:
+        - Advantage     : After the one read, every window of the subject is a slice - no file I/O at all.
+        - Advantage     : The size check only reads dataset shapes, so large subjects cost nothing extra.
+        - Shortcoming   : Held per process; other workers fall back to the shared window cache.
+    """
+    h5_path = subject_path(subj_id, h5_path)
+    max_bytes = SUBJECT_PRELOAD_MAX_BYTES if max_bytes is None else max_bytes
+    key = (h5_path, subj_id)
+    names = [spec.name for spec in selected(signals)]
+    source = source_fingerprint(h5_path)     # taken before the read: a rewrite during it makes the entry stale
+    with _preloaded_lock:
+        held = _preloaded.get(key)
+        if held is not None and held['source'] != source:
+            del _preloaded[key]
+            held = None
+        if held is not None:
+            _preloaded.move_to_end(key)
+            if all(n in held['rows'] or n not in held['fs'] for n in names):
+                return True
+            names = list(dict.fromkeys([*held['rows'], *names]))
+
+    with open_h5(h5_path) as f:
+        subj = f['subjects'][subj_id]
+        groups = {n: subj[SIGNALS[n].group] for n in SIGNALS if n in names and SIGNALS[n].group in subj}
+        lengths = {k: g["v"].shape[0] for k, g in groups.items()}
+        if not lengths or sum(lengths.values()) * 4 > max_bytes:
+            return False
+        data = np.full((len(groups), max(lengths.values())), np.nan, dtype=np.float32)
+        for row, (k, g) in enumerate(groups.items()):
+            if lengths[k]:
+                # decompress straight into the shared buffer (HDF5 converts the dtype if needed)
+                g["v"].read_direct(data, dest_sel=np.s_[row, :lengths[k]])
+        # rates of every signal the subject has: they tell absent signals apart and give windows a time axis
+        fs = {s.name: float(subj[s.group]["fs"][()]) for s in SIGNALS.values() if s.group in subj}
+
+    entry = {'data': data, 'rows': {k: i for i, k in enumerate(groups)}, 'lengths': lengths, 'fs': fs,
+             'source': source}
+    with _preloaded_lock:
+        _preloaded[key] = entry
+        while len(_preloaded) > SUBJECT_PRELOAD_MAX_SUBJECTS:
+            _preloaded.popitem(last=False)
+    return True
+
+def _preloaded_entry(h5_path, subj_id, names):
+    """
+    The preloaded recording of a subject if it holds every one of `names` the subject has, else None. An entry
+    read before the file was rewritten or replaced (e.g. by `repack_h5`) is dropped and None returned.
+    """
+    key = (h5_path, subj_id)
+    entry = _preloaded.get(key)
+    if entry is None:
+        return None
+    if entry['source'] != source_fingerprint(h5_path):
+        with _preloaded_lock:
+            if _preloaded.get(key) is entry:
+                del _preloaded[key]
+        return None
+    if not all(n in entry['rows'] or n not in entry['fs'] for n in names):
+        return None
+    return entry
+
+def preloaded_recording(subj_id, h5_path=None, signals=None):
+    """
+    Whole-recording arrays of the selected signals from this process's preloaded copy (see `preload_subject`).
+
+    Returns:
+        tuple | None: ({name: float32 array view}, {name: sampling rate}) for the selected signals the subject
+                      has, or None when they are not all held (or the file changed since they were read)
+    """
+    names = [spec.name for spec in selected(signals)]
+    entry = _preloaded_entry(subject_path(subj_id, h5_path), subj_id, names)
+    if entry is None:
+        return None
+    rows = {n: entry['rows'][n] for n in names if n in entry['rows']}
+    return ({n: entry['data'][row, :entry['lengths'][n]] for n, row in rows.items()},
+            {n: entry['fs'][n] for n in rows})
+
+def is_preloaded(subj_id, h5_path=None, signals=None):
+    """True when this process holds the selected signals of the subject's whole recording in memory (see `preload_subject`)."""
+    names = [spec.name for spec in selected(signals)]
+    return _preloaded_entry(subject_path(subj_id, h5_path), subj_id, names) is not None
+
+def release_subjects():
+    """Drop every preloaded recording held by this process."""
+    with _preloaded_lock:
+        _preloaded.clear()
+
+def count_windows(subj_id, h5_path=None):
+    """
+    Number of WIN_SAMPLES windows needed to cover the longest signal of a subject (the last one may be partial).
+
+    Only dataset shapes are read (or the lengths of a recording preloaded with all its signals), so this costs
+    no decoding.
+    """
+    h5_path = subject_path(subj_id, h5_path)
+    preloaded = _preloaded_entry(h5_path, subj_id, list(SIGNALS))
+    if preloaded is not None:
+        n_samples = max(preloaded['lengths'].values())
+    else:
+        with open_h5(h5_path) as f:
+            subj = f['subjects'][subj_id]
+            n_samples = max((subj[s.group]["v"].shape[0] for s in SIGNALS.values() if s.group in subj), default=0)
+    return -(-n_samples // WIN_SAMPLES)
+
+def source_fingerprint(path):
+    """
+    Identity of an HDF5 file's current contents, from its inode, size, mtime and ctime. Replacing the file
+    (`repack_h5`, `os.replace`) always gives a new inode; an in-place rewrite changes size, mtime or ctime
+    unless it keeps the size and lands within the filesystem's timestamp resolution.
+    """
+    st = os.stat(path)
+    return f"{os.path.abspath(path)}|{st.st_ino}|{st.st_size}|{st.st_mtime_ns}|{st.st_ctime_ns}"
+
+def window_key(source, subj_id, group, widx):
+    """Shared window cache key of one window of a dataset group; `source` is a `source_fingerprint`."""
+    return cache_key(source, subj_id, group, widx)
+
+def _window_fs(fs, specs):
+    """Sampling rate of a window: that of the first selected signal present, else of any signal the subject has."""
+    for spec in specs:
+        if spec.name in fs:
+            return fs[spec.name]
+    if not fs:
+        raise KeyError("Subject has none of the registered signals")
+    return next(iter(fs.values()))
+
+def _load_window(subj_id, widx, h5_path, convert, signals=None):
+    """
+    Assemble one window of the selected signals, serving each signal from the shared cache when possible.
+
+    `convert` is applied to every float32 array; for cache hits it runs against the shared
+    memory view itself, so no intermediate copy is made. Signals the subject does not have come back empty.
+    """
+    h5_path = subject_path(subj_id, h5_path)
+    specs = selected(signals)
+    start = widx * WIN_SAMPLES
+    end = start + WIN_SAMPLES
+    out = SignalDict(start=start, end=end)
+
+    preloaded = _preloaded_entry(h5_path, subj_id, [spec.name for spec in specs])
+    if preloaded is not None:
+        for spec in specs:
+            row = preloaded['rows'].get(spec.name)
+            v = EMPTY_SIGNAL if row is None else preloaded['data'][row, start:min(end, preloaded['lengths'][spec.name])]
+            out[spec.name] = convert(v)
+        out["fs"] = _window_fs(preloaded['fs'], specs)
+        out["t"] = convert((np.arange(start, end) / out["fs"]).astype(np.float32))
+        return out
+
+    cache = window_cache()
+    source = source_fingerprint(h5_path) if cache else None
+    fs = {}
+
+    missing = []
+    for spec in specs:
+        hit = cache.get(window_key(source, subj_id, spec.group, widx), convert) if cache else None
+        if hit is None:
+            missing.append(spec)
+        else:
+            out[spec.name], fs[spec.name] = hit
+
+    if missing or not fs:
+        with open_h5(h5_path) as f:
+            subj = f['subjects'][subj_id]
+            for spec in missing:
+                if spec.group not in subj:
+                    out[spec.name] = convert(EMPTY_SIGNAL)
+                    continue
+                v = subj[spec.group]["v"][start:end].astype(np.float32)
+                fs[spec.name] = float(subj[spec.group]["fs"][()])
+                if cache:
+                    cache.put(window_key(source, subj_id, spec.group, widx), v, fs[spec.name])
+                out[spec.name] = convert(v)
+            if not fs:
+                # none of the selected signals is recorded: take the time axis from one that is
+                fs = {s.name: float(subj[s.group]["fs"][()]) for s in SIGNALS.values() if s.group in subj}
+
+    out["fs"] = _window_fs(fs, specs)
+    out["t"] = convert((np.arange(start, end) / out["fs"]).astype(np.float32))
+    return out
+
+def load_window_slice(subj_id, widx, h5_path=None, signals=None):
     """
     Load a specific fixed-length window of waveform samples and corresponding timestamps.
 
     Parameters:
         subj_id (str)        : Identifier of the subject
         widx (int)           : Zero-based window index
-        h5_path (str or Path): Path to the HDF5 file
+        h5_path (str or Path): Path to the HDF5 file (defaults to the subject's catalogued file)
+        signals (list[str])  : Signals to read (default: every registered signal); others are not touched
 
     Returns:
         dict: Window data with keys:
             - 'start', 'end' (int)              : sample indices bounding the window
             - 'fs' (float)                      : sampling frequency
-            - 'ppg', 'ecg', 'bp' (list[float])  : raw signal values for the window
+            - 'ecg', 'ppg', 'abp' (list[float]) : raw signal values for the window, one key per selected signal
+                                                  (empty for signals the subject does not have)
             - 't' (list[float])                 : time axis in seconds for each sample
+
+    Notes:
+        - Advantage     : Windows already decoded by any worker on this host come from the shared cache (no HDF5 I/O).
+        - Advantage     : Only the selected signals' datasets are read, so single-channel sessions cost one read.
+        - Shortcoming   : Still converts every array to a Python list; use `load_window_arrays` when NumPy will do.
     """
-    with h5py.File(h5_path, 'r') as f:
-        subj = f['subjects'][subj_id]
-        fs = subj['ppg']['fs'][()]
-        start = widx * WIN_SAMPLES
-        end = start + WIN_SAMPLES
+    return _load_window(subj_id, widx, h5_path, lambda a: a.tolist(), signals)
+
+def load_window_arrays(subj_id, widx, h5_path=None, signals=None):
+    """
+    Same as `load_window_slice`, but returns float32 NumPy arrays (private copies) instead of lists.
+    """
+    return _load_window(subj_id, widx, h5_path, np.array, signals)
 
-        return {
-            "start": start,
-            "end": end,
-            "fs": fs,
-            "ppg": subj["ppg"]["v"][start:end][()].astype(np.float32).tolist(),
-            "ecg": subj["ekg"]["v"][start:end][()].astype(np.float32).tolist(),
-            "bp":  subj["bp"]["v"][start:end][()].astype(np.float32).tolist(),
-            "t":   (np.arange(start, end) / fs).astype(np.float32).tolist(),
-        }
+def load_signal_range(subj_id, signal, start=0, end=None, h5_path=None):
+    """
+    Load an arbitrary sample range of one signal, backed by the same caches as the window loaders.
 
+    Parameters:
+        subj_id (str)        : Identifier of the subject
+        signal (str)         : Signal name, alias or HDF5 group (see signals.SIGNAL_ALIASES, e.g. 'ecg'/'ekg', 'abp'/'bp')
+        start (int)          : First sample (inclusive)
+        end (int | None)     : Last sample (exclusive); None or past the end means "to the end of the recording"
+        h5_path (str or Path): Path to the HDF5 file (defaults to the subject's catalogued file)
 
-def overlay_annotations(fig, annotations, subj_id, window_idx, fs, win_len_samples):
+    Returns:
+        tuple: (np.ndarray float32 samples, float sampling frequency)
+
+    Raises:
+        KeyError: Unknown signal, subject or dataset
+
+    Notes:
+        - Advantage     : Preloaded subjects are sliced in memory; short ranges reuse (and fill) the shared window cache.
+        - Shortcoming   : Ranges longer than RANGE_CACHE_MAX_WINDOWS windows bypass the cache and read HDF5 directly.
+    """
+    key = SIGNAL_ALIASES[signal]
+    group = SIGNALS[key].group
+    h5_path = subject_path(subj_id, h5_path)
+
+    preloaded = _preloaded_entry(h5_path, subj_id, [key])
+    if preloaded is not None:
+        if key not in preloaded['rows']:
+            raise KeyError(f"Subject {subj_id!r} has no {key!r} signal")
+        n = preloaded['lengths'][key]
+        end = n if end is None else min(end, n)
+        return preloaded['data'][preloaded['rows'][key], start:max(start, end)].copy(), preloaded['fs'][key]
+
+    cache = window_cache()
+    parts = {}
+    if cache is not None and end is not None and end - start <= RANGE_CACHE_MAX_WINDOWS * WIN_SAMPLES:
+        source = source_fingerprint(h5_path)
+        windows = range(start // WIN_SAMPLES, -(-end // WIN_SAMPLES))
+        parts = {w: cache.get(window_key(source, subj_id, group, w)) for w in windows}
+        if parts and all(p is not None for p in parts.values()):
+            data = np.concatenate([p[0] for p in parts.values()])
+            offset = windows.start * WIN_SAMPLES
+            return data[start - offset:end - offset], parts[windows.start][1]
+
+    with open_h5(h5_path) as f:
+        ds = f['subjects'][subj_id][group]
+        fs = float(ds["fs"][()])
+        n = ds["v"].shape[0]
+        end = n if end is None else min(end, n)
+        start = min(start, end)
+        if not parts:
+            return ds["v"][start:end].astype(np.float32), fs
+        for w, hit in parts.items():
+            if hit is None:
+                v = ds["v"][w * WIN_SAMPLES:(w + 1) * WIN_SAMPLES].astype(np.float32)
+                if v.size:
+                    cache.put(window_key(source, subj_id, group, w), v, fs)
+                parts[w] = (v, fs)
+
+    offset = min(parts) * WIN_SAMPLES
+    data = np.concatenate([parts[w][0] for w in sorted(parts)])
+    return data[start - offset:end - offset], fs
+
+
+def overlay_annotations(fig, annotations, subj_id, window_idx, fs, win_len_samples, signals=None):
     """
     Overlay user-generated peak markers onto a multi-trace Plotly figure for a specific subject window.
 
     Parameters:
-        fig (plotly.graph_objs.Figure)  : Base figure with ECG, PPG, ABP traces
+        fig (Figure or dict)            : Base figure with one trace per displayed signal (a go.Figure or a figure dict)
         annotations (dict)              : User annotation store, mapping signal names to peak positions and times
         subj_id (Any)                   : Identifier for the current subject (used for logging/debugging)
         window_idx (int)                : Current window index (0-based)
         fs (float)                      : Sampling rate of the signals (Hz)
         win_len_samples (int)           : Number of samples per window
+        signals (list[str])             : Signals displayed in `fig`, as passed to the figure builder (default: all)
 
     Returns:
-        plotly.graph_objs.Figure    : Original figure with manual peak markers added as scatter traces
+        Figure or dict              : Original figure with manual peak markers added as scatter traces
 
     Notes:
         - Advantage     : Dynamically filters annotations to the visible window, avoiding off-window noise.
         - Advantage     : Uses signal-to-trace alignment via index arithmetic, ensuring marker accuracy.
-        - Shortcoming   : Relies on hard-coded row mapping; adding new signal types requires manual updates.
+        - Advantage     : Rows and marker colours come from the signal registry; peaks of hidden signals are skipped.
         - Shortcoming   : Converts lists to NumPy arrays on each call, which can add overhead for large annotation sets.
     """
-    peak_color_map = {'ecg': 'red', 'ppg': 'blue', 'abp': 'black'}
-    row_map = {'ecg': 1, 'ppg': 2, 'abp': 3}
+    row_map = {spec.name: row for row, spec in enumerate(selected(signals), start=1)}
 
     start = window_idx * win_len_samples
     end = start + win_len_samples
 
     for sig, ann in (annotations or {}).items():
-        if sig == 'window_label':
+        if not isinstance(ann, dict) or sig not in row_map:  # e.g. the per-window label codes, hidden signals
             continue
         samples = np.array(ann.get('sample_peak_positions', []), dtype=int)
         times = np.array(ann.get('time_peak_positions', []), dtype=float)
@@ -147,20 +549,25 @@ def overlay_annotations(fig, annotations, subj_id, window_idx, fs, win_len_sampl
 
         try:
             trace = fig['data'][row_map[sig]-1]  # Access the base signal trace
-            signal_y = trace['y']
+            signal_y = array_values(trace['y'])
             y = np.array([signal_y[int(s - start)] for s in win_samples])
         except Exception as e:
             print(f"[WARN] Could not align annotation for {sig} in window {window_idx}: {e}")
             continue
-        fig.add_trace(go.Scatter(
+        marker_trace = dict(
             x=x, y=y,
             mode='markers',
             name=f"{sig}-manual-peaks",
             showlegend=False,
-            marker=dict(symbol='x', size=10, color=peak_color_map[sig]),
+            marker=dict(symbol='x', size=10, color=SIGNALS[sig].color),
             customdata=[{'signal': sig}] * len(x),
             hovertemplate='(%{x:.3f}, %{y:.3f})<extra></extra>'
-        ), row=row_map[sig], col=1)
+        )
+        if isinstance(fig, dict):  # template-built figure (see build_shared_xaxis_figure)
+            xref, yref = row_axes(row_map[sig])[:2]
+            fig['data'].append({'type': 'scatter', 'xaxis': xref, 'yaxis': yref, **marker_trace})
+        else:
+            fig.add_trace(go.Scatter(**marker_trace), row=row_map[sig], col=1)
 
     return fig
 
@@ -0,0 +1,207 @@
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import h5py
+
+from .get_data import WIN_SAMPLES, open_h5
+
+COMPRESSIONS = ('gzip', 'lzf', 'none')
+STR_DTYPE = h5py.string_dtype(encoding='utf-8')
+
+
+def inspect_layout(h5_path):
+    """
+    Describe the storage layout of every dataset in an HDF5 file.
+
+    Parameters:
+        h5_path (str or Path): HDF5 file to inspect
+
+    Returns:
+        list[dict]: One entry per dataset with path, shape, dtype, chunks, compression,
+                    compression_opts, shuffle, nbytes (decoded) and storage_bytes (on disk)
+    """
+    out = []
+
+    def visit(name, obj):
+        if isinstance(obj, h5py.Dataset):
+            out.append({
+                'path': name,
+                'shape': obj.shape,
+                'dtype': str(obj.dtype),
+                'chunks': obj.chunks,
+                'compression': obj.compression,
+                'compression_opts': obj.compression_opts,
+                'shuffle': obj.shuffle,
+                'nbytes': int(obj.size * obj.dtype.itemsize),
+                'storage_bytes': int(obj.id.get_storage_size()),
+            })
+
+    with h5py.File(h5_path, 'r') as f:
+        f.visititems(visit)
+    return out
+
+
+def window_datasets(layout):
+    """Return the waveform (`.../v`) entries of an `inspect_layout` result."""
+    return [d for d in layout if d['path'].endswith('/v') and len(d['shape']) == 1]
+
+
+def window_read_cost(h5_path, win_samples=WIN_SAMPLES, max_windows=200, rdcc_nbytes=None):
+    """
+    Estimate and measure what reading one window costs for the current file layout.
+
+    Parameters:
+        h5_path (str or Path) : HDF5 file to measure
+        win_samples (int)     : Window length in samples, as used by `load_window_slice`
+        max_windows (int)     : Upper bound on the number of windows timed
+        rdcc_nbytes (int)     : Chunk cache size used for the timed reads (defaults to settings)
+
+    Returns:
+        dict:
+            - chunks_per_window (float) : Mean number of chunks touched by a window read, per signal
+            - decoded_bytes_per_window  : Mean bytes decompressed per window, per signal
+            - stored_bytes_per_window   : Mean compressed bytes read from disk per window, per signal
+            - read_amplification        : decoded bytes / bytes actually requested
+            - seconds_per_window        : Measured mean time to open the file and read all signals of a window
+
+    Notes:
+        - Windows start at multiples of `win_samples`, so a chunk size equal to (or a multiple of) the
+          window length gives exactly one chunk per window and an amplification of 1.
+        - The timed loop opens the file per window, mirroring the dashboard's loaders.
+    """
+    layout = window_datasets(inspect_layout(h5_path))
+    if not layout:
+        raise ValueError(f"No 1-D waveform datasets found in {h5_path}")
+
+    chunks, decoded, stored, requested = [], [], [], []
+    for d in layout:
+        n = d['shape'][0]
+        itemsize = d['nbytes'] // max(n, 1)
+        chunk_len = d['chunks'][0] if d['chunks'] else n
+        ratio = d['storage_bytes'] / max(d['nbytes'], 1)
+        starts = np.arange(0, n, win_samples)
+        ends = np.minimum(starts + win_samples, n)
+        touched = (ends - 1) // chunk_len - starts // chunk_len + 1
+        chunks.append(touched)
+        decoded.append(touched * chunk_len * itemsize)
+        stored.append(touched * chunk_len * itemsize * ratio)
+        requested.append((ends - starts) * itemsize)
+
+    chunks, decoded, stored, requested = map(np.concatenate, (chunks, decoded, stored, requested))
+
+    # group signals by subject ('subjects/<id>/<sig>/v') so each timed read loads a full window
+    by_subject = {}
+    for d in layout:
+        by_subject.setdefault(d['path'].rsplit('/', 2)[0], []).append(d)
+    windows = [(ds, w) for ds in by_subject.values()
+               for w in range(int(np.ceil(ds[0]['shape'][0] / win_samples)))]
+    step = max(len(windows) // max_windows, 1)
+    sample = windows[::step][:max_windows]
+
+    t0 = time.perf_counter()
+    for ds, w in sample:
+        with open_h5(h5_path, rdcc_nbytes=rdcc_nbytes) as f:
+            for d in ds:
+                f[d['path']][w * win_samples:(w + 1) * win_samples]
+    elapsed = time.perf_counter() - t0
+
+    return {
+        'chunks_per_window': float(chunks.mean()),
+        'decoded_bytes_per_window': float(decoded.mean()),
+        'stored_bytes_per_window': float(stored.mean()),
+        'read_amplification': float(decoded.sum() / max(requested.sum(), 1)),
+        'seconds_per_window': elapsed / max(len(sample), 1),
+    }
+
+
+def repack_h5(src, dst, win_samples=WIN_SAMPLES, windows_per_chunk=1, compression='gzip',
+              compression_level=None, shuffle=True):
+    """
+    Rewrite an HDF5 store with waveform chunks aligned to the dashboard's window length.
+
+    Parameters:
+        src (str or Path)       : Source HDF5 file
+        dst (str or Path)       : Destination file; may equal `src` (written to a temp file, then swapped in)
+        win_samples (int)       : Window length in samples; chunk length is `win_samples * windows_per_chunk`
+        windows_per_chunk (int) : Windows per chunk; >1 trades read amplification for better compression
+        compression (str)       : 'gzip', 'lzf' or 'none'
+        compression_level (int) : gzip level 0-9 (ignored otherwise)
+        shuffle (bool)          : Apply the byte-shuffle filter before compression
+
+    Returns:
+        Path: The written file
+
+    Notes:
+        - Only 1-D `v` datasets longer than one chunk are re-chunked; every other dataset, group and
+          attribute is copied verbatim.
+        - Data is streamed chunk by chunk, so memory use is bounded by one chunk, not one recording.
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"compression must be one of {COMPRESSIONS}, got {compression!r}")
+    src, dst = Path(src), Path(dst)
+    chunk_len = int(win_samples * windows_per_chunk)
+    filters = {}
+    if compression != 'none':
+        filters['compression'] = compression
+        if compression == 'gzip' and compression_level is not None:
+            filters['compression_opts'] = int(compression_level)
+        filters['shuffle'] = bool(shuffle)
+
+    tmp = dst.with_name(dst.name + '.repack-tmp')
+    try:
+        with h5py.File(src, 'r') as fin, h5py.File(tmp, 'w') as fout:
+            fout.attrs.update(fin.attrs)
+
+            def copy(name, obj):
+                if isinstance(obj, h5py.Group):
+                    fout.require_group(name).attrs.update(obj.attrs)
+                    return
+                rechunk = (name.endswith('/v') and obj.ndim == 1 and obj.shape[0] > chunk_len
+                           and obj.dtype.kind in 'fiu')
+                if not rechunk:
+                    fin.copy(obj, fout.require_group(obj.parent.name), name=name.rsplit('/', 1)[-1])
+                    return
+                out = fout.create_dataset(name, shape=obj.shape, dtype=obj.dtype, chunks=(chunk_len,), **filters)
+                out.attrs.update(obj.attrs)
+                for start in range(0, obj.shape[0], chunk_len):
+                    out[start:start + chunk_len] = obj[start:start + chunk_len]
+
+            fin.visititems(copy)
+
+        os.replace(tmp, dst)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return dst
+
+
+def write_subject(subjects, subj_id, fix, signals, fs, labels=None, methods=None, chunks=True, compression='gzip'):
+    """
+    Write one subject in the store layout: `subjects/<id>/fix` plus a `{v, fs, label, method}` group per signal.
+
+    Parameters:
+        subjects (h5py.Group)   : The file's 'subjects' group
+        subj_id (str)           : Subject identifier (the new group's name)
+        fix (dict)              : Scalar subject fields; strings are stored as UTF-8, numbers as-is
+        signals (dict)          : HDF5 signal group name ('ekg', 'ppg', 'bp') -> 1-D float32 array
+        fs (float)              : Sampling frequency shared by the signals (Hz)
+        labels, methods (dict)  : Per-signal 'label' / 'method' strings (default: the group name / '')
+        chunks (bool or tuple)  : Chunk shape for the `v` datasets, passed through to h5py
+        compression (str|None)  : Compression filter for the `v` datasets
+    """
+    g = subjects.create_group(subj_id)
+    fg = g.create_group('fix')
+    for key, val in fix.items():
+        if isinstance(val, (str, bytes)) or (isinstance(val, np.ndarray) and val.dtype == object):
+            fg.create_dataset(key, data=val, dtype=STR_DTYPE)
+        else:
+            fg.create_dataset(key, data=val)
+    for sig, v in signals.items():
+        sg = g.create_group(sig)
+        sg.create_dataset('v', data=v, chunks=chunks, compression=compression)
+        sg.create_dataset('fs', data=fs)
+        sg.create_dataset('method', data=(methods or {}).get(sig, ''), dtype=STR_DTYPE)
+        sg.create_dataset('label', data=(labels or {}).get(sig, sig), dtype=STR_DTYPE)
+    return g
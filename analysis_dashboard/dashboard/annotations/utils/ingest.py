@@ -0,0 +1,199 @@
+import os
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+import h5py
+
+from . import get_data
+from .get_data import WIN_SAMPLES
+from .h5_layout import write_subject
+from .search_index import build_index, resolve_index
+from .signals import SIGNALS
+
+# HDF5 signal group -> accepted input channel names (lower-case), in order of preference (see SignalSpec.channels)
+CHANNEL_ALIASES = {spec.group: spec.channels or (spec.name, spec.group) for spec in SIGNALS.values()}
+TIME_COLUMNS = ('t', 'time', 'time_s', 'seconds')
+FIX_DEFAULTS = {'af_status': np.int64(-1), 'subject_notes': ''}
+
+
+def _pick_channels(names):
+    """Map each signal group to the index of its preferred input channel (groups without one are left out)."""
+    lowered = [str(n).strip().lower() for n in names]
+    picked = {}
+    for group, aliases in CHANNEL_ALIASES.items():
+        for alias in aliases:
+            if alias in lowered:
+                picked[group] = lowered.index(alias)
+                break
+    return picked
+
+
+def _recording(subj_id, fs, columns, names, source, fix=None):
+    """
+    Assemble a recording dict from per-channel arrays.
+
+    Only the signals the input has are kept (a PPG-only session gets a `ppg` group and nothing else); readers
+    treat a missing group as an absent signal. Shorter channels are NaN-padded to the longest one.
+    """
+    picked = _pick_channels(names)
+    if not picked:
+        raise ValueError(f"{source}: none of the channels {list(names)} is a registered signal "
+                         f"({', '.join(s.label for s in SIGNALS.values())})")
+    n_samples = max(len(columns[i]) for i in picked.values())
+    signals, labels = {}, {}
+    for group, i in picked.items():
+        v = np.full(n_samples, np.nan, dtype=np.float32)
+        col = np.asarray(columns[i], dtype=np.float32)
+        v[:col.size] = col
+        labels[group] = str(names[i])
+        signals[group] = v
+    return {
+        'subj_id': subj_id,
+        'fs': float(fs),
+        'signals': signals,
+        'labels': labels,
+        'methods': {g: f"{labels[g]} from {Path(source).name}" for g in signals},
+        'fix': {**FIX_DEFAULTS, 'subj_id': subj_id, 'rec_id': subj_id, 'files': Path(source).name, **(fix or {})},
+    }
+
+
+def read_npz(path, subj_id=None):
+    """
+    Read a NumPy `.npz` recording: one 1-D array per channel (named as in CHANNEL_ALIASES) plus a scalar `fs`.
+
+    Any other scalar entries (e.g. `af_status`, `rec_id`) become `fix` fields.
+    """
+    with np.load(path, allow_pickle=False) as z:
+        if 'fs' not in z:
+            raise ValueError(f"{path}: missing the sampling rate entry 'fs'")
+        fs = float(z['fs'])
+        names = [k for k in z.files if z[k].ndim == 1 and k != 'fs']
+        fix = {k: (str(z[k]) if z[k].dtype.kind in 'US' else z[k][()]) for k in z.files
+               if z[k].ndim == 0 and k not in ('fs', 'subj_id')}
+        subj_id = subj_id or (str(z['subj_id']) if 'subj_id' in z.files else Path(path).stem)
+        return _recording(subj_id, fs, [z[k] for k in names], names, path, fix)
+
+
+def read_csv(path, fs=None, subj_id=None):
+    """
+    Read a CSV recording with a header row naming the channels; the sampling rate comes from `fs` or,
+    when omitted, from a time column (`t`, `time`, ...) in seconds.
+    """
+    data = np.genfromtxt(path, delimiter=',', names=True, dtype=np.float64, encoding='utf-8')
+    names = list(data.dtype.names)
+    time_col = next((n for n in names if n.lower() in TIME_COLUMNS), None)
+    if fs is None:
+        if time_col is None or data.size < 2:
+            raise ValueError(f"{path}: pass fs, or include a time column ({', '.join(TIME_COLUMNS)})")
+        fs = 1.0 / float(np.median(np.diff(data[time_col])))
+    names = [n for n in names if n != time_col]
+    return _recording(subj_id or Path(path).stem, fs, [data[n] for n in names], names, path)
+
+
+def read_wfdb(record_path, subj_id=None):
+    """
+    Read a WFDB record (`<record>.hea` + signal files) with the optional `wfdb` package.
+    """
+    try:
+        import wfdb
+    except ImportError as e:
+        raise ImportError("Reading WFDB records needs the `wfdb` package (pip install wfdb)") from e
+    record_path = str(record_path)
+    if record_path.endswith('.hea'):
+        record_path = record_path[:-4]
+    rec = wfdb.rdrecord(record_path)
+    return _recording(subj_id or rec.record_name, rec.fs, list(rec.p_signal.T), rec.sig_name, record_path + '.hea',
+                      fix={'rec_id': rec.record_name})
+
+
+READERS = {'npz': read_npz, 'csv': read_csv, 'wfdb': read_wfdb}
+
+
+def detect_format(path):
+    """'npz', 'csv' or 'wfdb' from a path's suffix (a bare record name with a `.hea` beside it is WFDB)."""
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix == '.npz':
+        return 'npz'
+    if suffix == '.csv':
+        return 'csv'
+    if suffix == '.hea' or path.with_name(path.name + '.hea').exists():
+        return 'wfdb'
+    raise ValueError(f"{path}: cannot tell the input format from the file name; pass it explicitly")
+
+
+def write_shard(recordings, shard_dir, win_samples=WIN_SAMPLES, compression='gzip'):
+    """
+    Write recordings to a new shard file and publish it atomically.
+
+    The file is written under a hidden temporary name and renamed into `shard_dir` only once it is complete
+    and closed, so readers (including running servers) never open a partially written shard.
+
+    Parameters:
+        recordings (list[dict]): Output of the `read_*` functions
+        shard_dir (str or Path): Directory of shard files (created if needed)
+        win_samples (int)      : Window length; waveform chunks are aligned to it (see `repack_h5`)
+        compression (str|None) : Compression filter for the waveform datasets
+
+    Returns:
+        Path: The published shard
+    """
+    shard_dir = Path(shard_dir)
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    name = f"shard-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.h5"
+    tmp, dst = shard_dir / f".{name}.tmp", shard_dir / name
+    try:
+        with h5py.File(tmp, 'w') as f:
+            subjects = f.create_group('subjects')
+            for rec in recordings:
+                n = max(v.size for v in rec['signals'].values())
+                write_subject(subjects, rec['subj_id'], rec['fix'], rec['signals'], rec['fs'],
+                              labels=rec['labels'], methods=rec['methods'],
+                              chunks=(min(win_samples, n),) if n else None, compression=compression)
+        with open(tmp, 'rb') as fh:
+            os.fsync(fh.fileno())
+        os.replace(tmp, dst)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return dst
+
+
+def ingest(recordings, shard_dir=None, index=True, compression='gzip', progress=None):
+    """
+    Add recordings to the store as a new shard, register them in the catalogue and index their windows.
+
+    Parameters:
+        recordings (list[dict]): Output of the `read_*` functions
+        shard_dir (str or Path): Shard directory (defaults to settings.H5_SHARD_DIR)
+        index (bool)           : Also compute their search-index rows (only the new subjects are processed;
+                                 skipped when the index is disabled)
+        compression (str|None) : Compression filter for the waveform datasets
+        progress (callable)    : Passed to `search_index.build_index`
+
+    Returns:
+        dict: {'shard': Path, 'subjects': [ids], 'windows': int indexed windows}
+
+    Notes:
+        - Advantage     : Nothing already stored is rewritten; the cost is proportional to the new data only.
+        - Shortcoming   : Subject ids must be new; re-ingesting a subject needs its old shard removed first.
+    """
+    shard_dir = shard_dir or get_data.H5_SHARD_DIR
+    if not shard_dir:
+        raise ValueError("No shard directory: set H5_SHARD_DIR in settings or pass one")
+    ids = [rec['subj_id'] for rec in recordings]
+    catalogue = get_data.subject_catalogue()
+    catalogue.refresh(force=True)
+    existing = set(catalogue.subject_ids()) & set(ids)
+    duplicates = {i for i in ids if ids.count(i) > 1}
+    if existing or duplicates:
+        raise ValueError(f"Subject ids already present: {sorted(existing | duplicates)}")
+
+    shard = write_shard(recordings, shard_dir, compression=compression)
+    catalogue.refresh(force=True)
+    windows = 0
+    if index and resolve_index() is not None:
+        windows = build_index(shard, subj_ids=ids, progress=progress)['windows']
+    return {'shard': shard, 'subjects': ids, 'windows': windows}
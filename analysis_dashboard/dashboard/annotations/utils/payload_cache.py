@@ -0,0 +1,320 @@
+import atexit
+import contextlib
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from . import get_data
+from .generate_shared_axis_figure import typed_array
+from .get_data import WIN_SAMPLES, load_window_arrays, open_h5, source_fingerprint, subject_path
+from .signals import SIGNALS, selected
+
+logger = logging.getLogger(__name__)
+
+# Directory of encoded window payloads (None disables the cache); see `python manage.py warm_payload_cache`
+PAYLOAD_CACHE_DIR = getattr(settings, 'PAYLOAD_CACHE_DIR', None)
+PAYLOAD_CACHE_MAX_BYTES = getattr(settings, 'PAYLOAD_CACHE_MAX_BYTES', 1024 ** 3)
+PAYLOAD_CACHE_LEVEL = getattr(settings, 'PAYLOAD_CACHE_LEVEL', 1)   # gzip level of the entry files
+PAYLOAD_VERSION = 2      # bump when the entry format changes; old entries are then never looked up again
+EVICT_TO = 0.9           # eviction trims the cache to this fraction of its budget
+
+
+def encode_window(window):
+    """
+    JSON-ready payload of a window dict from `load_window_arrays`: arrays as plotly.js typed arrays (base64
+    float32), which `build_shared_xaxis_figure` passes through as is.
+    """
+    out = {'start': window['start'], 'end': window['end'], 'fs': window['fs']}
+    for key in ('t', *(name for name in SIGNALS if name in window)):
+        v = typed_array(window[key])
+        out[key] = v.tolist() if isinstance(v, np.ndarray) else v   # empty (absent) signals
+    return out
+
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+CREATE TABLE IF NOT EXISTS totals (
+    id    INTEGER PRIMARY KEY CHECK (id = 0),
+    bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO totals VALUES (0, 0);
+"""
+
+
+class PayloadCache:
+    """
+    On-disk cache of encoded window payloads, one gzip JSON file per (subject, window, signal set, window length).
+
+    An entry holds the selected signals of the window plus its time axis, already base64-encoded, so either
+    render mode is served from it (render modes share data and differ in the figure template only). The file
+    name is a hash of the key and of the source file's `source_fingerprint` (inode, size, mtime, ctime):
+    replacing or rewriting the HDF5 file changes every name, and the stale entries age out through eviction.
+
+    Files are written under a temporary name and renamed into place, so concurrent workers never read a
+    partial entry; the cache survives restarts and deploys, unlike the in-memory and shared-memory caches.
+    Entry sizes and last-use times are kept in a SQLite index next to them (`index.sqlite3`), so enforcing the
+    budget never scans the directory. Writes and hits are recorded in memory and flushed to the index in one
+    transaction every FLUSH_EVERY records or FLUSH_INTERVAL_S seconds; eviction removes the least recently used
+    entries first.
+
+    Notes:
+        - Advantage     : A cold process serves a window with one small file read and a gunzip instead of an
+                          HDF5 open, chunk decompression and encoding; neither hits nor misses wait on the index.
+        - Shortcoming   : Each signal selection has its own entries; a subject annotated with several
+                          selections is stored several times over.
+        - Shortcoming   : Between flushes the cache can exceed its budget by up to FLUSH_EVERY entries per
+                          worker, and records not yet flushed when a worker is killed are lost (their files
+                          stay until `clear`).
+    """
+
+    FLUSH_EVERY = 64
+    FLUSH_INTERVAL_S = 5.0
+
+    def __init__(self, root, max_bytes=PAYLOAD_CACHE_MAX_BYTES, level=PAYLOAD_CACHE_LEVEL):
+        self.root = Path(root)
+        self.max_bytes = int(max_bytes)
+        self.level = level
+        self._schema_ready = False
+        self._pending = {}    # entry name -> (size or None for a hit, last use)
+        self._pending_lock = threading.Lock()
+        self._flushed = time.monotonic()
+
+    @contextlib.contextmanager
+    def _index(self):
+        """Connection to the size index, in a write transaction committed on success."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.root / 'index.sqlite3'), timeout=30)
+        try:
+            if not self._schema_ready:
+                conn.execute("PRAGMA journal_mode=WAL")
+                columns = [row[1] for row in conn.execute("PRAGMA table_info(entries)")]
+                if 'written' in columns:     # index of an older version, evicted by write time
+                    conn.execute("ALTER TABLE entries RENAME COLUMN written TO used")
+                    conn.execute("DROP INDEX IF EXISTS entries_written")
+                conn.executescript(INDEX_SCHEMA)
+                self._schema_ready = True
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                yield conn
+        finally:
+            conn.close()
+
+    def path_for(self, subj_id, widx, source, signals, win_samples=WIN_SAMPLES):
+        digest = hashlib.sha256(f"{PAYLOAD_VERSION}|{source_fingerprint(source)}|{subj_id}|{win_samples}|{widx}|"
+                                f"{','.join(signals)}".encode()).hexdigest()
+        return self.root / digest[:2] / f"{digest}.json.gz"
+
+    @staticmethod
+    def _name(path):
+        return f"{path.parent.name}/{path.name}"
+
+    def _record(self, name, size):
+        """Queue an index update (size None: a hit) and flush the queue when it is due."""
+        with self._pending_lock:
+            known = self._pending.get(name)
+            self._pending[name] = (size if size is not None else known and known[0], time.time())
+            due = (len(self._pending) >= self.FLUSH_EVERY
+                   or time.monotonic() - self._flushed >= self.FLUSH_INTERVAL_S)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write queued entries and hits to the index and evict least recently used entries above the budget."""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+            self._flushed = time.monotonic()
+        if not pending:
+            return
+        with self._index() as conn:
+            added = 0
+            for name, (size, used) in pending.items():
+                old = conn.execute("SELECT size FROM entries WHERE name = ?", (name,)).fetchone()
+                if size is None:
+                    if old is not None:
+                        conn.execute("UPDATE entries SET used = ? WHERE name = ?", (used, name))
+                    continue
+                conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (name, size, used))
+                added += size - (old[0] if old else 0)
+            conn.execute("UPDATE totals SET bytes = bytes + ?", (added,))
+            if self._total(conn) > self.max_bytes:
+                self._evict(conn, int(self.max_bytes * EVICT_TO))
+
+    def get(self, subj_id, widx, source, signals, win_samples=WIN_SAMPLES):
+        """Cached payload of a window with the given signal names, or None."""
+        path = self.path_for(subj_id, widx, source, signals, win_samples)
+        try:
+            with gzip.open(path, 'rb') as fh:
+                payload = json.loads(fh.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, EOFError) as e:
+            logger.warning("Dropping unreadable payload cache entry %s: %s", path, e)
+            path.unlink(missing_ok=True)
+            return None
+        self._record(self._name(path), None)
+        return payload
+
+    def put(self, subj_id, widx, source, signals, payload, win_samples=WIN_SAMPLES):
+        """Store a window payload (atomically); the least recently used entries are evicted on the next flush."""
+        path = self.path_for(subj_id, widx, source, signals, win_samples)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = gzip.compress(json.dumps(payload, separators=(',', ':')).encode(), compresslevel=self.level)
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        self._record(self._name(path), len(data))
+        return path
+
+    @staticmethod
+    def _total(conn):
+        return conn.execute("SELECT bytes FROM totals").fetchone()[0]
+
+    def _evict(self, conn, target_bytes):
+        """Delete the least recently used indexed entries until at most `target_bytes` remain. Returns the bytes left."""
+        total = self._total(conn)
+        while total > target_bytes:
+            rows = conn.execute("SELECT name, size FROM entries ORDER BY used LIMIT 256").fetchall()
+            if not rows:
+                break
+            done = []
+            for name, size in rows:
+                (self.root / name).unlink(missing_ok=True)
+                done.append((name,))
+                total -= size
+                if total <= target_bytes:
+                    break
+            conn.executemany("DELETE FROM entries WHERE name = ?", done)
+        total = max(total, 0)
+        conn.execute("UPDATE totals SET bytes = ?", (total,))
+        return total
+
+    def size(self):
+        """Bytes of all indexed entries."""
+        self.flush()
+        with self._index() as conn:
+            return self._total(conn)
+
+    def evict(self, target_bytes):
+        """Delete the least recently used entries until at most `target_bytes` remain. Returns the bytes left."""
+        self.flush()
+        with self._index() as conn:
+            return self._evict(conn, target_bytes)
+
+    def clear(self):
+        """Delete every entry, including files missing from the index (e.g. of older cache versions)."""
+        with self._pending_lock:
+            self._pending = {}
+        with self._index() as conn:
+            if self.root.is_dir():
+                for sub in os.scandir(self.root):
+                    if sub.is_dir():
+                        for e in os.scandir(sub.path):
+                            if e.name.endswith(('.json.gz', '.tmp')):
+                                os.unlink(e.path)
+            conn.execute("DELETE FROM entries")
+            conn.execute("UPDATE totals SET bytes = 0")
+
+
+_caches = {}
+
+def payload_cache():
+    """The payload cache configured in settings (one per process), or None when disabled."""
+    if not PAYLOAD_CACHE_DIR:
+        return None
+    key = (str(PAYLOAD_CACHE_DIR), PAYLOAD_CACHE_MAX_BYTES)
+    cache = _caches.get(key)
+    if cache is None:
+        cache = _caches.setdefault(key, PayloadCache(PAYLOAD_CACHE_DIR, PAYLOAD_CACHE_MAX_BYTES))
+        atexit.register(cache.flush)      # index the entries written since the last flush
+    return cache
+
+
+def load_window_payload(subj_id, widx, signals=None, h5_path=None):
+    """
+    Encoded window of the selected signals, from the payload cache when possible.
+
+    Parameters:
+        subj_id (str)        : Identifier of the subject
+        widx (int)           : Zero-based window index
+        signals (list[str])  : Signals to return (default: every registered signal)
+        h5_path (str or Path): Path to the HDF5 file (defaults to the subject's catalogued file)
+
+    Returns:
+        dict: 'start', 'end', 'fs', 't' and one typed array (or empty list) per selected signal
+
+    Notes:
+        - Advantage     : Subjects read whole on load (`preload_subject`) are sliced in memory and never touch
+                          the disk cache; a miss reads only the selected signals.
+        - Shortcoming   : With the cache disabled this is `load_window_arrays` plus encoding, nothing more.
+    """
+    names = [spec.name for spec in selected(signals)]
+    source = subject_path(subj_id, h5_path)
+    cache = payload_cache()
+    if cache is None or get_data.is_preloaded(subj_id, source, names):
+        return encode_window(load_window_arrays(subj_id, widx, h5_path=source, signals=names))
+
+    payload = cache.get(subj_id, widx, source, names)
+    if payload is None:
+        payload = encode_window(load_window_arrays(subj_id, widx, h5_path=source, signals=names))
+        cache.put(subj_id, widx, source, names, payload)
+    return payload
+
+
+def warm_subject(subj_id, h5_path=None, force=False, cache=None, signals=None):
+    """
+    Write the payload of every window of a subject, reading each signal from HDF5 once.
+
+    Parameters:
+        signals (list[str]): Signal selection to warm (default: every registered signal, the dashboard's default)
+
+    Returns:
+        tuple: (windows written, windows already cached)
+    """
+    cache = cache or payload_cache()
+    if cache is None:
+        raise ValueError("The payload cache is disabled: set PAYLOAD_CACHE_DIR in settings")
+    specs = selected(signals)
+    names = [spec.name for spec in specs]
+    source = subject_path(subj_id, h5_path)
+    n_windows = get_data.count_windows(subj_id, source)
+    todo = [w for w in range(n_windows) if force or not cache.path_for(subj_id, w, source, names).exists()]
+    if not todo:
+        return 0, n_windows
+
+    with open_h5(source) as f:
+        subj = f['subjects'][subj_id]
+        present = [s for s in SIGNALS.values() if s.group in subj]
+        if not present:
+            return 0, n_windows
+        data = {s.name: subj[s.group]["v"][()].astype(np.float32) for s in specs if s.group in subj}
+        fs = {s.name: float(subj[s.group]["fs"][()]) for s in present}
+    ref_fs = get_data._window_fs(fs, specs)
+    for widx in todo:
+        start, end = widx * WIN_SAMPLES, (widx + 1) * WIN_SAMPLES
+        window = {'start': start, 'end': end, 'fs': ref_fs,
+                  't': (np.arange(start, end) / ref_fs).astype(np.float32)}
+        for name in names:
+            window[name] = data[name][start:end] if name in data else get_data.EMPTY_SIGNAL
+        cache.put(subj_id, widx, source, names, encode_window(window))
+    cache.flush()
+    return len(todo), n_windows - len(todo)
@@ -0,0 +1,336 @@
+import contextlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from . import get_data
+from .features import PEAK_DETECTORS, window_features
+from .get_data import METADATA_MAX_ELEMENTS, WIN_SAMPLES, load_group, open_h5
+from .signals import SIGNALS
+from .window_labels import LABELS, label_code
+
+SEARCH_INDEX_PATH = getattr(settings, 'SEARCH_INDEX_PATH', None)
+SEARCH_LIMIT = 500
+
+# signals with `<sig>_peaks` / `has_<sig>` columns in the windows table
+INDEX_SIGNALS = ('ecg', 'ppg', 'abp')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subjects (
+    subj_id      TEXT PRIMARY KEY,
+    n_windows    INTEGER NOT NULL,
+    fs           REAL,
+    source       TEXT,
+    source_mtime INTEGER
+);
+CREATE TABLE IF NOT EXISTS subject_meta (
+    subj_id TEXT NOT NULL,
+    key     TEXT NOT NULL,
+    value   TEXT,
+    num     REAL,
+    PRIMARY KEY (subj_id, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS subject_meta_value ON subject_meta (key, value);
+CREATE INDEX IF NOT EXISTS subject_meta_num ON subject_meta (key, num);
+CREATE TABLE IF NOT EXISTS windows (
+    subj_id   TEXT NOT NULL,
+    widx      INTEGER NOT NULL,
+    label     INTEGER NOT NULL DEFAULT 0,
+    quality   REAL,
+    hr        REAL,
+    ecg_peaks INTEGER,
+    ppg_peaks INTEGER,
+    abp_peaks INTEGER,
+    has_ecg   INTEGER,
+    has_ppg   INTEGER,
+    has_abp   INTEGER,
+    PRIMARY KEY (subj_id, widx)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS windows_label_hr ON windows (label, hr);
+CREATE INDEX IF NOT EXISTS windows_hr ON windows (hr);
+CREATE INDEX IF NOT EXISTS windows_quality ON windows (quality);
+CREATE TABLE IF NOT EXISTS disagreements (
+    annotator_a TEXT NOT NULL,
+    annotator_b TEXT NOT NULL,
+    subj_id     TEXT NOT NULL,
+    widx        INTEGER NOT NULL,
+    min_f1      REAL,
+    fp          INTEGER,
+    fn          INTEGER,
+    label_a     TEXT,
+    label_b     TEXT,
+    PRIMARY KEY (annotator_a, annotator_b, subj_id, widx)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS disagreements_f1 ON disagreements (min_f1);
+CREATE TABLE IF NOT EXISTS tasks (
+    subj_id       TEXT NOT NULL,
+    widx          INTEGER NOT NULL,
+    score         REAL NOT NULL,
+    state         INTEGER NOT NULL DEFAULT 0,
+    annotator     TEXT,
+    lease_expires REAL,
+    PRIMARY KEY (subj_id, widx)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tasks_next ON tasks (state, score DESC);
+CREATE INDEX IF NOT EXISTS tasks_expiry ON tasks (state, lease_expires);
+CREATE INDEX IF NOT EXISTS tasks_annotator ON tasks (annotator, state);
+"""
+
+FEATURE_COLUMNS = ('quality', 'hr', 'ecg_peaks', 'ppg_peaks', 'abp_peaks', 'has_ecg', 'has_ppg', 'has_abp')
+
+
+def resolve_index(index_path=None):
+    """The index file to use (`index_path`, else settings.SEARCH_INDEX_PATH), or None when the index is disabled."""
+    path = index_path or SEARCH_INDEX_PATH
+    return None if path is None else str(path)
+
+
+def index_exists(index_path=None):
+    """True when the index is enabled and its file exists; readers return empty results otherwise instead of creating it."""
+    path = resolve_index(index_path)
+    return path is not None and os.path.exists(path)
+
+
+# index files whose schema this process has created or checked
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def connect(index_path=None):
+    """
+    Open the search index (creating the file and tables on first use in this process) and commit on success.
+
+    Parameters:
+        index_path (str or Path): SQLite file (defaults to settings.SEARCH_INDEX_PATH)
+
+    Raises:
+        ValueError: The index is disabled (SEARCH_INDEX_PATH is None) and no `index_path` was given
+    """
+    path = resolve_index(index_path)
+    if path is None:
+        raise ValueError("The search index is disabled: set SEARCH_INDEX_PATH in settings")
+    fresh = path not in _schema_ready or not os.path.exists(path)
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        if fresh:
+            with _schema_lock:
+                conn.execute("PRAGMA journal_mode=WAL")      # readers (dashboard) never block the indexer
+                conn.executescript(SCHEMA)
+                _schema_ready.add(path)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.row_factory = sqlite3.Row
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _meta_rows(subj_id, fix):
+    """subject_meta rows for the scalar fields of a subject's `fix` group (numbers also go to `num`)."""
+    rows = []
+    for key, val in fix.items():
+        if isinstance(val, dict):       # 'arrays' / 'attrs' summaries from load_group
+            continue
+        if isinstance(val, np.ndarray):
+            if val.size != 1:
+                continue
+            val = val.item()
+        if isinstance(val, (bool, int, float, np.number)):
+            rows.append((subj_id, key, str(val), float(val)))
+        else:
+            rows.append((subj_id, key, str(val), None))
+    return rows
+
+
+def index_subject(conn, subj_id, h5_path=None):
+    """
+    Compute the per-window features of one subject and write them, with its `fix` metadata, to the index.
+
+    Labels already in the index are kept: they come from annotators, not from the recording.
+
+    Returns:
+        int: Number of windows indexed
+    """
+    h5_path = get_data.subject_path(subj_id, h5_path)
+    specs = [SIGNALS[sig] for sig in INDEX_SIGNALS if sig in SIGNALS]
+    with open_h5(h5_path) as f:
+        subj = f['subjects'][subj_id]
+        present = [s for s in specs if s.group in subj]
+        signals = {s.name: subj[s.group]["v"][()] if s in present else np.empty(0, dtype=np.float32) for s in specs}
+        fs = float(subj[present[0].group]["fs"][()]) if present else np.nan
+        fix = load_group(subj['fix'], METADATA_MAX_ELEMENTS) if 'fix' in subj else {}
+
+    cols = window_features(signals, fs, WIN_SAMPLES, detectors={s.name: PEAK_DETECTORS[s.detector] for s in specs})
+    n_windows = len(cols['quality'])
+    hr = cols['hr']
+    rows = zip(
+        [subj_id] * n_windows, range(n_windows),
+        cols['quality'].tolist(), np.where(np.isnan(hr), None, hr).tolist(),
+        *(cols.get(f'{sig}_peaks', np.zeros(n_windows, dtype=int)).tolist() for sig in INDEX_SIGNALS),
+        *(cols.get(f'has_{sig}', np.zeros(n_windows, dtype=bool)).astype(int).tolist() for sig in INDEX_SIGNALS),
+    )
+    updates = ', '.join(f'{c} = excluded.{c}' for c in FEATURE_COLUMNS)
+    conn.executemany(
+        f"INSERT INTO windows (subj_id, widx, {', '.join(FEATURE_COLUMNS)}) VALUES (?, ?, {', '.join('?' * len(FEATURE_COLUMNS))}) "
+        f"ON CONFLICT (subj_id, widx) DO UPDATE SET {updates}", rows)
+    conn.execute("DELETE FROM windows WHERE subj_id = ? AND widx >= ?", (subj_id, n_windows))
+    conn.execute("DELETE FROM subject_meta WHERE subj_id = ?", (subj_id,))
+    conn.executemany("INSERT INTO subject_meta VALUES (?, ?, ?, ?)", _meta_rows(subj_id, fix))
+    conn.execute("INSERT OR REPLACE INTO subjects VALUES (?, ?, ?, ?, ?)",
+                 (subj_id, n_windows, fs, h5_path, os.stat(h5_path).st_mtime_ns))
+    return n_windows
+
+
+def build_index(h5_path=None, index_path=None, subj_ids=None, force=False, progress=None):
+    """
+    Index every subject of the HDF5 store (or `subj_ids`), skipping subjects already indexed from the same file.
+
+    Parameters:
+        h5_path (str or Path)   : One HDF5 file (defaults to the main store and every shard in the catalogue)
+        index_path (str or Path): SQLite index (defaults to settings.SEARCH_INDEX_PATH)
+        subj_ids (list[str])    : Subjects to index (defaults to every subject in the store)
+        force (bool)            : Re-index subjects even if the store has not changed since
+        progress (callable)     : Called as progress(subj_id, n_windows or None when skipped)
+
+    Returns:
+        dict: {'indexed': int, 'skipped': int, 'windows': int}
+
+    Notes:
+        - Advantage     : Each subject is committed on its own, so an interrupted build resumes where it stopped.
+        - Shortcoming   : Whole recordings are read to compute features; the first build of a large store is I/O bound.
+    """
+    if h5_path is not None:
+        sources = {str(h5_path): subj_ids or get_data.get_subject_ids(h5_path)}
+    else:
+        sources = get_data.subject_catalogue().by_file(subj_ids)
+    stats = {'indexed': 0, 'skipped': 0, 'windows': 0}
+    with connect(index_path) as conn:
+        for path, ids in sources.items():
+            done = {r['subj_id'] for r in conn.execute(
+                "SELECT subj_id FROM subjects WHERE source = ? AND source_mtime = ?", (path, os.stat(path).st_mtime_ns))}
+            for subj_id in ids:
+                if subj_id in done and not force:
+                    stats['skipped'] += 1
+                    if progress:
+                        progress(subj_id, None)
+                    continue
+                with conn:
+                    n = index_subject(conn, subj_id, path)
+                stats['indexed'] += 1
+                stats['windows'] += n
+                if progress:
+                    progress(subj_id, n)
+    return stats
+
+
+def record_label(subj_id, widx, code, index_path=None):
+    """Store one window's label code (called on every label edit, so searches see it immediately); no-op when disabled."""
+    if resolve_index(index_path) is None:
+        return
+    with connect(index_path) as conn:
+        conn.execute("INSERT INTO windows (subj_id, widx, label) VALUES (?, ?, ?) "
+                     "ON CONFLICT (subj_id, widx) DO UPDATE SET label = excluded.label", (subj_id, widx, int(code)))
+
+
+def load_labels(subj_id, n_windows, index_path=None):
+    """Label codes stored for a subject as a uint8 array of length `n_windows` (0 where none is stored)."""
+    codes = np.zeros(n_windows, dtype=np.uint8)
+    if not index_exists(index_path):
+        return codes
+    with connect(index_path) as conn:
+        rows = conn.execute("SELECT widx, label FROM windows WHERE subj_id = ? AND label != 0 AND widx < ?",
+                            (subj_id, n_windows)).fetchall()
+    if rows:
+        widx, labels = np.array(rows, dtype=np.int64).T
+        codes[widx] = labels
+    return codes
+
+
+def meta_values(key, index_path=None):
+    """Distinct values of a subject metadata field (e.g. 'af_status'), for building filter options."""
+    if not index_exists(index_path):
+        return []
+    with connect(index_path) as conn:
+        return [r['value'] for r in conn.execute(
+            "SELECT DISTINCT value FROM subject_meta WHERE key = ? ORDER BY num, value", (key,))]
+
+
+def search_windows(label=None, min_hr=None, max_hr=None, min_quality=None, has=(), meta=None,
+                   limit=SEARCH_LIMIT, index_path=None):
+    """
+    Find windows across all indexed subjects matching every given filter.
+
+    Parameters:
+        label (str)         : Window label name from LABELS ('' for unlabelled); None for any
+        min_hr, max_hr (float): Heart-rate bounds in bpm (inclusive)
+        min_quality (float) : Minimum quality score (0..1)
+        has (iterable)      : Signals that must be present in the window ('ecg', 'ppg', 'abp')
+        meta (dict)         : Subject `fix` fields that must match, e.g. {'af_status': 1}
+        limit (int)         : Maximum number of rows returned
+        index_path (str or Path): SQLite index (defaults to settings.SEARCH_INDEX_PATH)
+
+    Returns:
+        list[dict]: Matching windows ordered by subject and window index, with their label name and features
+
+    Notes:
+        - Advantage     : Filters run in SQLite against indexes on (label, hr), hr and quality, so a query over
+                          millions of windows takes milliseconds instead of loading any recording.
+        - Shortcoming   : Features reflect the last `build_search_index` run; labels are updated live.
+    """
+    where, params = [], []
+    if label is not None:
+        where.append("w.label = ?")
+        params.append(label_code(label))
+    if min_hr is not None:
+        where.append("w.hr >= ?")
+        params.append(float(min_hr))
+    if max_hr is not None:
+        where.append("w.hr <= ?")
+        params.append(float(max_hr))
+    if min_quality is not None:
+        where.append("w.quality >= ?")
+        params.append(float(min_quality))
+    for sig in has or ():
+        if sig not in INDEX_SIGNALS:
+            raise ValueError(f"Unknown signal {sig!r}")
+        where.append(f"w.has_{sig} = 1")
+    for key, value in (meta or {}).items():
+        column = 'num' if isinstance(value, (int, float, np.number)) and not isinstance(value, bool) else 'value'
+        where.append(f"EXISTS (SELECT 1 FROM subject_meta m WHERE m.subj_id = w.subj_id AND m.key = ? AND m.{column} = ?)")
+        params += [key, float(value) if column == 'num' else str(value)]
+
+    if not index_exists(index_path):
+        return []
+    sql = f"SELECT w.* FROM windows w {'WHERE ' + ' AND '.join(where) if where else ''} " \
+          f"ORDER BY w.subj_id, w.widx LIMIT ?"
+    with connect(index_path) as conn:
+        rows = conn.execute(sql, params + [int(limit)]).fetchall()
+    return [{**dict(r), 'label': LABELS[r['label']] if r['label'] < len(LABELS) else ''} for r in rows]
+
+
+def record_disagreements(annotator_a, annotator_b, results, index_path=None):
+    """
+    Store the flagged windows of an annotator comparison (see `agreement.compare_annotators`), replacing
+    those previously stored for the same pair and subjects.
+    """
+    with connect(index_path) as conn:
+        for r in results:
+            conn.execute("DELETE FROM disagreements WHERE annotator_a = ? AND annotator_b = ? AND subj_id = ?",
+                         (annotator_a, annotator_b, r['subj_id']))
+            conn.executemany("INSERT INTO disagreements VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", [
+                (annotator_a, annotator_b, r['subj_id'], w['widx'], w['min_f1'], w['fp'], w['fn'],
+                 w['label_a'], w['label_b']) for w in r['windows']])
+
+
+def disagreement_windows(limit=SEARCH_LIMIT, index_path=None):
+    """Stored disagreement windows of every compared annotator pair, lowest peak F1 first."""
+    if not index_exists(index_path):
+        return []
+    with connect(index_path) as conn:
+        rows = conn.execute("SELECT * FROM disagreements ORDER BY min_f1, label_a = label_b, subj_id, widx LIMIT ?",
+                            (int(limit),)).fetchall()
+    return [dict(r) for r in rows]
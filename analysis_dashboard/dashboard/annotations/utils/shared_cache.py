@@ -0,0 +1,206 @@
+import contextlib
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'CAWCACHE'
+HEADER = struct.Struct('<8sQQ')   # magic, n_slots, slot_samples
+HEADER_BYTES = 64
+INDEX_DTYPE = np.dtype([('key', '<u8'), ('stamp', '<u8'), ('fs', '<f8'), ('length', '<u4'), ('pad', '<u4')])
+
+
+def cache_key(*parts):
+    """Hash the parts identifying one cached array into a non-zero 64-bit key (0 marks an empty slot)."""
+    digest = hashlib.blake2b('|'.join(map(str, parts)).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+
+class SharedWindowCache:
+    """
+    Host-wide cache of float32 window arrays in a memory-mapped slab file shared by all worker processes.
+
+    The slab holds a fixed number of equally sized slots, so the whole cache is bounded by a single byte
+    budget no matter how many workers map it. Layout: a 64-byte header, an index table with one
+    (key, last-access stamp, fs, length) record per slot, then the slot data.
+
+    Notes:
+        - Advantage     : A window decoded by one worker is served to every other worker straight from shared pages.
+        - Advantage     : Readers share a lock and never write to the slab; only inserts take it exclusively. Lookups
+                          and LRU eviction are vectorized scans of the index table (a few microseconds for 10^5 slots).
+        - Shortcoming   : Keys are 64-bit hashes; a collision would return the wrong window (probability ~n^2/2^65).
+        - Shortcoming   : Hits are stamped in process memory and written to the index under the exclusive lock (on
+                          the process's next insert, or every TOUCH_FLUSH hits when the lock is free), so another
+                          process's eviction may not yet see up to TOUCH_FLUSH of this process's latest hits.
+    """
+
+    TOUCH_FLUSH = 64
+
+    def __init__(self, path, budget_bytes, slot_samples):
+        self.slot_samples = int(slot_samples)
+        slot_bytes = self.slot_samples * 4 + INDEX_DTYPE.itemsize
+        self.n_slots = int(budget_bytes // slot_bytes)
+        if self.n_slots < 1:
+            raise ValueError(f"Cache budget of {budget_bytes} bytes cannot hold a single {slot_samples}-sample window")
+        # one slab file per layout, so processes configured differently never share (or resize) one
+        self.path = f"{path}.{self.n_slots}x{self.slot_samples}"
+        self._thread_lock = threading.RLock()
+        self._touched = {}     # slot -> (key, last hit) not yet written to the index
+        self._hits = 0         # hits since the stamps were last written
+        self._pid = None
+        self._open()
+
+    @property
+    def nbytes(self):
+        return HEADER_BYTES + self.n_slots * (INDEX_DTYPE.itemsize + self.slot_samples * 4)
+
+    def _open(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            expected = HEADER.pack(MAGIC, self.n_slots, self.slot_samples)
+            if os.fstat(fd).st_size == 0:
+                # first user: lay out an empty slab
+                os.ftruncate(fd, self.nbytes)
+                os.pwrite(fd, expected, 0)
+            elif os.pread(fd, HEADER.size, 0) != expected or os.fstat(fd).st_size != self.nbytes:
+                # never resized in place: other processes may have it mapped with this layout
+                raise ValueError(f"{self.path} is not a slab of {self.n_slots} x {self.slot_samples} samples")
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            self._mm = mmap.mmap(fd, self.nbytes)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        index_end = HEADER_BYTES + self.n_slots * INDEX_DTYPE.itemsize
+        self.index = np.frombuffer(self._mm, dtype=INDEX_DTYPE, count=self.n_slots, offset=HEADER_BYTES)
+        self.data = np.frombuffer(self._mm, dtype=np.float32, offset=index_end).reshape(self.n_slots, self.slot_samples)
+        self._pid = os.getpid()
+
+    @contextlib.contextmanager
+    def _locked(self, op):
+        if self._pid != os.getpid():
+            # forked (e.g. gunicorn preload): the inherited descriptor shares flock state with the parent, and the
+            # thread lock may have been held by a parent thread that does not exist here
+            self._thread_lock = threading.RLock()
+            self._touched, self._hits = {}, 0
+            self._open()
+        with self._thread_lock:
+            fcntl.flock(self._fd, op)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _find(self, key):
+        hits = np.flatnonzero(self.index['key'] == key)
+        return int(hits[0]) if hits.size else None
+
+    @contextlib.contextmanager
+    def read(self, key):
+        """
+        Zero-copy access to a cached array.
+
+        Yields:
+            tuple | None: (float32 view into the shared slab, fs), or None on a miss. The view is only valid
+                          inside the `with` block; copy or convert it before leaving.
+        """
+        with self._locked(fcntl.LOCK_SH):
+            slot = self._find(key)
+            if slot is None:
+                yield None
+                return
+            rec = self.index[slot]
+            self._touched[slot] = (key, time.monotonic_ns())
+            self._hits += 1
+            yield self.data[slot, :rec['length']], float(rec['fs'])
+        if self._hits >= self.TOUCH_FLUSH:
+            self._flush_touches()
+
+    def _write_touches(self):
+        """Write this process's pending hit stamps to the index; the caller holds the exclusive lock."""
+        touched, self._touched, self._hits = self._touched, {}, 0
+        for slot, (key, stamp) in touched.items():
+            if self.index['key'][slot] == key:       # not evicted since
+                self.index['stamp'][slot] = max(stamp, int(self.index['stamp'][slot]))
+
+    def _flush_touches(self):
+        """Write pending hit stamps if the exclusive lock is free right now; otherwise keep them for later."""
+        with self._thread_lock:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            try:
+                self._write_touches()
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def get(self, key, convert=np.array):
+        """Return (convert(array), fs) for a cached entry, or None. `convert` runs while the slot is locked."""
+        with self.read(key) as hit:
+            return None if hit is None else (convert(hit[0]), hit[1])
+
+    def put(self, key, values, fs):
+        """Store a 1-D array (at most `slot_samples` long), evicting the least recently used slot if full."""
+        values = np.asarray(values, dtype=np.float32)
+        if values.ndim != 1 or values.size > self.slot_samples:
+            raise ValueError(f"Expected a 1-D array of at most {self.slot_samples} samples, got shape {values.shape}")
+        with self._locked(fcntl.LOCK_EX):
+            self._write_touches()
+            if self._find(key) is not None:
+                return
+            keys = self.index['key']
+            empty = np.flatnonzero(keys == 0)
+            slot = int(empty[0]) if empty.size else int(np.argmin(self.index['stamp']))
+            keys[slot] = 0  # invalidate while the payload is rewritten
+            self.data[slot, :values.size] = values
+            self.index['length'][slot] = values.size
+            self.index['fs'][slot] = fs
+            self.index['stamp'][slot] = time.monotonic_ns()
+            keys[slot] = key
+
+    def clear(self):
+        with self._locked(fcntl.LOCK_EX):
+            self._touched, self._hits = {}, 0
+            self.index['key'][:] = 0
+
+    def stats(self):
+        used = int(np.count_nonzero(self.index['key']))
+        return {'path': self.path, 'slots': self.n_slots, 'used': used, 'bytes': self.nbytes}
+
+
+# (path, budget_bytes, slot_samples) -> handle, or None when the slab could not be opened
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_window_cache(path, budget_bytes, slot_samples):
+    """
+    Return this process's handle to the shared window cache of that path and layout, or None when it is
+    disabled or unavailable.
+
+    Parameters:
+        path (str or Path | None): Slab file (ideally on /dev/shm), suffixed with the slab layout; None disables the cache
+        budget_bytes (int)       : Host-wide memory budget for the slab
+        slot_samples (int)       : Samples per cached array (the window length)
+    """
+    if not path or not budget_bytes:
+        return None
+    key = (str(path), int(budget_bytes), int(slot_samples))
+    with _caches_lock:
+        if key not in _caches:
+            try:
+                _caches[key] = SharedWindowCache(path, budget_bytes, slot_samples)
+            except (OSError, ValueError) as e:
+                logger.warning("Shared window cache disabled (%s): %s", path, e)
+                _caches[key] = None
+        return _caches[key]
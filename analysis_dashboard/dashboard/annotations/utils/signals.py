@@ -0,0 +1,121 @@
+import warnings
+from dataclasses import dataclass, field
+
+from django.conf import settings
+
+
+@dataclass(frozen=True)
+class SignalSpec:
+    """
+    One waveform the dashboard can load, plot and annotate.
+
+    Parameters:
+        name (str)      : Name used in the UI, the annotation store and window dicts ('ecg')
+        group (str)     : HDF5 group under `subjects/<id>/` holding its `{v, fs, label, method}` datasets ('ekg')
+        label (str)     : Short display name ('ECG')
+        title (str)     : Subplot title
+        units (str)     : Y-axis title
+        row (int)       : Display order; enabled signals are stacked top to bottom by row
+        color (str)     : Colour of manual peak markers
+        detector (str)  : Default peak detector, a key of `features.PEAK_DETECTORS`
+        band (tuple)    : (low, high) pass band in Hz of the band-passed views (see `transforms.VIEWS`)
+        aliases (tuple) : Other names accepted for the signal (e.g. in the signal API URL)
+        channels (tuple): Input channel names (lower-case) mapped to it by `ingest_recordings`, in order of preference
+        yaxis (dict)    : Extra Plotly y-axis properties for its subplot
+    """
+    name: str
+    group: str
+    label: str
+    title: str
+    units: str
+    row: int
+    color: str = 'black'
+    detector: str = 'local_max'
+    band: tuple = (0.5, 40.0)
+    aliases: tuple = ()
+    channels: tuple = ()
+    yaxis: dict = field(default_factory=dict)
+
+
+DEFAULT_SIGNALS = (
+    SignalSpec('ecg', 'ekg', 'ECG', 'Electro-Cardiogram (ECG)', 'mV', row=1, color='red',
+               aliases=('ekg',), channels=('ekg', 'ecg', 'ii', 'ecg_ii', 'lead_ii', 'i', 'iii', 'v', 'avr'),
+               yaxis=dict(dtick=0.1, showgrid=True, gridcolor='lightgrey', gridwidth=1, zeroline=False,
+                          tickmode='array', tickvals=[-1.0, -0.75, -0.5, -0.25, 0.0, 0.25, 0.5, 0.75])),
+    SignalSpec('ppg', 'ppg', 'PPG', 'Photo-Plethysmography (PPG)', 'a.u.', row=2, color='blue', band=(0.5, 8.0),
+               channels=('ppg', 'pleth', 'spo2_wave')),
+    SignalSpec('abp', 'bp', 'ABP', 'Arterial Blood Pressure (ABP)', 'mmHg', row=3, color='black', band=(0.5, 15.0),
+               aliases=('bp',), channels=('bp', 'abp', 'art', 'ibp')),
+)
+
+
+def load_registry(specs=None):
+    """
+    Build the signal registry from SignalSpecs or dicts of SignalSpec fields (defaults to settings.SIGNALS,
+    then DEFAULT_SIGNALS).
+
+    Returns:
+        dict: name -> SignalSpec, ordered by display row
+
+    Raises:
+        ValueError: Two signals share a name, alias or HDF5 group
+    """
+    if specs is None:
+        specs = getattr(settings, 'SIGNALS', None) or DEFAULT_SIGNALS
+    specs = sorted((s if isinstance(s, SignalSpec) else SignalSpec(**s) for s in specs), key=lambda s: s.row)
+    names = [n for s in specs for n in (s.name, *s.aliases)]
+    groups = [s.group for s in specs]
+    if len(set(names)) != len(names) or len(set(groups)) != len(groups):
+        raise ValueError("Signal names, aliases and HDF5 groups must be unique across the registry")
+    return {s.name: s for s in specs}
+
+
+SIGNALS = load_registry()
+# every accepted name (names, aliases and HDF5 groups) -> signal name
+SIGNAL_ALIASES = {alias: s.name for s in SIGNALS.values() for alias in (s.name, s.group, *s.aliases)}
+
+
+def resolve(name):
+    """
+    SignalSpec for a signal name, alias or HDF5 group.
+
+    Raises:
+        KeyError: Unknown signal
+    """
+    return SIGNALS[SIGNAL_ALIASES[name]]
+
+
+def selected(names=None):
+    """
+    SignalSpecs of `names` (any accepted names) in display order; None selects every registered signal.
+
+    Raises:
+        KeyError: Unknown signal
+    """
+    if names is None:
+        return list(SIGNALS.values())
+    wanted = {SIGNAL_ALIASES[n] for n in names}
+    return [s for s in SIGNALS.values() if s.name in wanted]
+
+
+def signal_options():
+    """Checklist/dropdown options for the registered signals."""
+    return [{'label': f" {s.label}", 'value': s.name} for s in SIGNALS.values()]
+
+
+# keys of window and metadata dicts before the registry named them after the signal -> signal name
+LEGACY_KEYS = {'bp': 'abp'}
+
+
+class SignalDict(dict):
+    """
+    Window or metadata dict keyed by signal name that still answers the pre-registry keys (LEGACY_KEYS) on
+    `[]` lookup, with a DeprecationWarning. The old keys are not stored, so iteration and JSON are unchanged.
+    """
+
+    def __missing__(self, key):
+        name = LEGACY_KEYS.get(key)
+        if name is None or name not in self:
+            raise KeyError(key)
+        warnings.warn(f"{key!r} is deprecated, use {name!r}", DeprecationWarning, stacklevel=2)
+        return self[name]
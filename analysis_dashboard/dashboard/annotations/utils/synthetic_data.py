@@ -0,0 +1,81 @@
+import numpy as np
+import h5py
+
+from .h5_layout import write_subject
+
+
+def synthetic_waveforms(n_samples, fs, rng, hr_bpm=75.0):
+    """
+    Generate deterministic ECG-, PPG- and ABP-like waveforms sharing one beat train.
+
+    Parameters:
+        n_samples (int)             : Number of samples per signal
+        fs (float)                  : Sampling frequency (Hz)
+        rng (np.random.Generator)   : Random generator used for beat jitter and noise
+        hr_bpm (float)              : Mean heart rate in beats per minute
+
+    Returns:
+        dict: {'ekg', 'ppg', 'bp'} -> float32 arrays of length n_samples
+
+    Notes: Shapes are only loosely physiological; they exist to give the loaders and
+           plots realistic sizes and value ranges, not to validate detectors.
+    """
+    t = np.arange(n_samples) / fs
+    rr = 60.0 / hr_bpm
+    n_beats = int(np.ceil(t[-1] / rr)) + 2 if n_samples else 0
+    beats = np.cumsum(rr + rng.normal(0, 0.02 * rr, n_beats)) - rr
+
+    # phase in [0, 1) since the most recent beat, for every sample
+    idx = np.clip(np.searchsorted(beats, t, side='right') - 1, 0, max(n_beats - 1, 0))
+    phase = (t - beats[idx]) / rr
+
+    ekg = 0.9 * np.exp(-((phase - 0.02) / 0.012) ** 2) - 0.1 * np.exp(-((phase - 0.3) / 0.05) ** 2)
+    ppg = np.exp(-((phase - 0.25) / 0.1) ** 2) + 0.3 * np.exp(-((phase - 0.55) / 0.08) ** 2)
+    bp = 80 + 40 * np.exp(-((phase - 0.15) / 0.09) ** 2) + 8 * np.exp(-((phase - 0.45) / 0.06) ** 2)
+
+    return {
+        'ekg': (ekg + rng.normal(0, 0.02, n_samples)).astype(np.float32),
+        'ppg': (ppg + rng.normal(0, 0.01, n_samples)).astype(np.float32),
+        'bp':  (bp + rng.normal(0, 0.5, n_samples)).astype(np.float32),
+    }
+
+
+def write_synthetic_h5(h5_path, n_subjects=2, duration_sec=1800, fs=125, seed=0,
+                       chunks=True, compression='gzip'):
+    """
+    Write an HDF5 file with the same `subjects/<id>/{fix,ppg,ekg,bp}` layout as the MIMIC export.
+
+    Parameters:
+        h5_path (str or Path)   : Destination file (overwritten)
+        n_subjects (int)        : Number of subjects to generate
+        duration_sec (float)    : Recording length per subject in seconds
+        fs (int)                : Sampling frequency (Hz) for every signal
+        seed (int)              : Seed for reproducible waveforms
+        chunks (bool or tuple)  : Chunk shape for the `v` datasets, passed through to h5py
+        compression (str|None)  : Compression filter for the `v` datasets
+
+    Returns:
+        list[str]: Generated subject identifiers
+    """
+    rng = np.random.default_rng(seed)
+    n_samples = int(duration_sec * fs)
+    labels = {'ppg': 'pleth', 'ekg': 'ii', 'bp': 'abp'}
+    subj_ids = [f"s{i:06d}" for i in range(n_subjects)]
+
+    with h5py.File(h5_path, 'w') as f:
+        subjects = f.create_group('subjects')
+        for subj_id in subj_ids:
+            fix = {
+                'subj_id': subj_id,
+                'rec_id': f"{subj_id}-synthetic",
+                'files': f"{subj_id}_0001",
+                'af_status': np.int64(rng.integers(-1, 2)),
+                'subject_notes': np.array([b''], dtype=object),
+            }
+            hr = float(rng.uniform(55, 130))
+            waves = synthetic_waveforms(n_samples, fs, rng, hr_bpm=hr)
+            write_subject(subjects, subj_id, fix, waves, np.int64(fs), labels=labels,
+                          methods={sig: f"{name} synthetic" for sig, name in labels.items()},
+                          chunks=chunks, compression=compression)
+
+    return subj_ids
@@ -0,0 +1,282 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from scipy import signal as sp_signal
+from scipy.fft import next_fast_len
+
+from . import get_data
+from .get_data import EMPTY_SIGNAL, WIN_SAMPLES, open_h5, source_fingerprint, subject_path, window_cache, window_key
+from .signals import SIGNALS, resolve, selected
+
+# Subjects whose whole-recording transforms are kept per worker process (all their views count as one subject)
+TRANSFORM_CACHE_SUBJECTS = getattr(settings, 'TRANSFORM_CACHE_SUBJECTS', 4)
+BANDPASS_ORDER = getattr(settings, 'BANDPASS_ORDER', 4)
+SPECTROGRAM_SEGMENT_S = getattr(settings, 'SPECTROGRAM_SEGMENT_S', 2.0)   # STFT segment length
+SPECTROGRAM_OVERLAP = 0.75                                                # fraction of a segment shared by neighbours
+
+
+def fill_gaps(v):
+    """Copy of `v` with NaN gaps linearly interpolated (filters would spread a NaN over the whole recording)."""
+    v = np.asarray(v, dtype=np.float64)
+    gaps = np.isnan(v)
+    if not gaps.any():
+        return v.copy()
+    if gaps.all():
+        return np.zeros_like(v)
+    idx = np.arange(v.size)
+    out = v.copy()
+    out[gaps] = np.interp(idx[gaps], idx[~gaps], v[~gaps])
+    return out
+
+
+def bandpass(v, fs, band, order=BANDPASS_ORDER):
+    """Zero-phase Butterworth band-pass (forward-backward second-order sections, so peaks are not shifted)."""
+    low, high = band
+    high = min(high, 0.45 * fs)
+    sos = sp_signal.butter(order, (low, high), btype='bandpass', fs=fs, output='sos')
+    if v.size <= 3 * (2 * len(sos) + 1):     # too short for filtfilt's edge padding
+        return v - v.mean() if v.size else v
+    return sp_signal.sosfiltfilt(sos, v)
+
+
+def derivative(v, fs):
+    """First derivative in units per second (central differences)."""
+    return np.gradient(v) * fs if v.size > 1 else np.zeros_like(v)
+
+
+def envelope(v, fs):
+    """Amplitude envelope: magnitude of the analytic signal (Hilbert transform, FFT padded to a fast length)."""
+    if not v.size:
+        return v
+    return np.abs(sp_signal.hilbert(v, N=next_fast_len(v.size))[:v.size])
+
+
+# view name -> (label, view it is computed from (None: the raw recording), step f(v, fs, spec))
+VIEWS = OrderedDict([
+    ('raw', ('Raw', None, None)),
+    ('bandpass', ('Band-pass', None, lambda v, fs, spec: bandpass(v, fs, tuple(spec.band)))),
+    ('derivative', ('Derivative', 'bandpass', lambda v, fs, spec: derivative(v, fs))),
+    ('envelope', ('Envelope', 'bandpass', lambda v, fs, spec: envelope(v, fs))),
+])
+
+
+def view_options():
+    """RadioItems options for the signal views."""
+    return [{'label': label, 'value': name} for name, (label, _base, _step) in VIEWS.items()]
+
+
+def apply_step(v, fs, spec, step):
+    """Run one transform step over a whole recording with its gaps interpolated, then put the gaps back as NaN."""
+    gaps = np.isnan(v)
+    out = step(fill_gaps(v), fs, spec).astype(np.float32)
+    out[gaps] = np.nan
+    return out
+
+
+def _view_key(spec, view):
+    """Shared-window-cache group name of a transformed signal (the band is part of it, so edits miss)."""
+    return f"{spec.group}:{view}:{tuple(spec.band)}"
+
+
+# (source_fingerprint, subj_id) -> {'fs': {name: fs}, 'absent': {name}, 'views': {view: {name: array}},
+#                                  'spectrogram': {name: (...)}}; a rewritten store gets new entries and the
+#                                  old ones age out
+_transformed = OrderedDict()
+_transformed_lock = threading.Lock()
+
+
+def _read_recording(subj_id, h5_path, names):
+    """
+    The signals `names` of a subject that it has, whole, as float32 arrays (from the preloaded copy if it holds
+    them), and their sampling rates.
+    """
+    preloaded = get_data.preloaded_recording(subj_id, h5_path, names)
+    if preloaded is not None:
+        return preloaded
+    with open_h5(h5_path) as f:
+        subj = f['subjects'][subj_id]
+        present = [SIGNALS[n] for n in names if SIGNALS[n].group in subj]
+        return ({s.name: subj[s.group]["v"][()].astype(np.float32) for s in present},
+                {s.name: float(subj[s.group]["fs"][()]) for s in present})
+
+
+def _subject_entry(subj_id, source):
+    """
+    The transform entry of a subject at file version `source` (a `source_fingerprint`), created empty (and the
+    least recently used subject evicted) if needed.
+    """
+    key = (source, subj_id)
+    with _transformed_lock:
+        entry = _transformed.get(key)
+        if entry is None:
+            entry = _transformed[key] = {'fs': {}, 'absent': set(), 'views': {}, 'spectrogram': {}}
+            while len(_transformed) > TRANSFORM_CACHE_SUBJECTS:
+                _transformed.popitem(last=False)
+        else:
+            _transformed.move_to_end(key)
+        return entry
+
+
+def _has_view(entry, view, names):
+    """Whether a transform entry holds `view` of every one of `names` the subject has."""
+    done = entry['views'].get(view, {})
+    return all(n in done or n in entry['absent'] for n in names)
+
+
+def transform_subject(subj_id, view, h5_path=None, signals=None):
+    """
+    Transform the selected signals of a subject over the whole recording, once per worker.
+
+    Parameters:
+        subj_id (str)        : Identifier of the subject
+        view (str)           : Key of VIEWS other than 'raw'
+        h5_path (str or Path): Path to the HDF5 file (defaults to the subject's catalogued file)
+        signals (list[str])  : Signals to transform (default: every registered signal); signals transformed
+                               by earlier calls are kept and not recomputed
+
+    Returns:
+        dict: {'data': {name: float32 array}, 'fs': {name: float}, 'spectrogram': {name: cached spectrogram}};
+              'data' holds every selected signal the subject has (and any transformed before)
+
+    Notes:
+        - Advantage     : Filtering the whole recording has no window-edge transients, and navigating costs a
+                          slice instead of a filter run.
+        - Advantage     : A subject's views (and the band-pass they are derived from) are evicted together, so
+                          TRANSFORM_CACHE_SUBJECTS bounds memory by subjects, whichever views were shown.
+        - Advantage     : Entries are keyed by the file's `source_fingerprint`, so a rewritten store (e.g. by
+                          `repack_h5`) is transformed afresh instead of serving the old recording.
+        - Shortcoming   : The first request of a view reads and filters the whole recording of each selected
+                          signal (about a second per signal for a day at 125 Hz).
+    """
+    if view not in VIEWS or view == 'raw':
+        raise ValueError(f"view must be one of {tuple(VIEWS)[1:]}, got {view!r}")
+    h5_path = subject_path(subj_id, h5_path)
+    # taken before reading: a rewrite during the read leaves the result under the old version
+    entry = _subject_entry(subj_id, source_fingerprint(h5_path))
+    with _transformed_lock:
+        done = entry['views'].get(view, {})
+        todo = [s.name for s in selected(signals) if s.name not in done and s.name not in entry['absent']]
+    if todo:
+        _label, base, step = VIEWS[view]
+        if base is None:
+            source, fs = _read_recording(subj_id, h5_path, todo)
+        else:
+            base_entry = transform_subject(subj_id, base, h5_path, todo)
+            source = {n: base_entry['data'][n] for n in todo if n in base_entry['data']}
+            fs = {n: base_entry['fs'][n] for n in source}
+        data = {name: apply_step(v, fs[name], SIGNALS[name], step) for name, v in source.items()}
+        with _transformed_lock:
+            entry['fs'].update(fs)
+            entry['absent'].update(n for n in todo if n not in source)
+            done = entry['views'].setdefault(view, {})
+            for name, v in data.items():
+                done.setdefault(name, v)
+    with _transformed_lock:
+        return {'data': dict(entry['views'].get(view, {})), 'fs': dict(entry['fs']), 'spectrogram': entry['spectrogram']}
+
+
+def load_view_window(subj_id, widx, view, h5_path=None, signals=None):
+    """
+    One window of the selected signals in a transformed view, sliced from the whole-recording transform.
+
+    Parameters:
+        subj_id (str)        : Identifier of the subject
+        widx (int)           : Zero-based window index
+        view (str)           : Key of VIEWS; 'raw' is `load_window_arrays`
+        h5_path (str or Path): Path to the HDF5 file (defaults to the subject's catalogued file)
+        signals (list[str])  : Signals to return (default: every registered signal)
+
+    Returns:
+        dict: Same keys as `load_window_arrays` ('start', 'end', 'fs', 't' and one float32 array per signal)
+
+    Notes:
+        - Advantage     : Each window served is written to the shared window cache, so a worker without this
+                          subject's transform serves windows already shown elsewhere without filtering.
+        - Shortcoming   : Only requested windows are shared; the first request in a worker of a window nobody
+                          has shown still transforms the whole recording.
+    """
+    if view == 'raw':
+        return get_data.load_window_arrays(subj_id, widx, h5_path=h5_path, signals=signals)
+    h5_path = subject_path(subj_id, h5_path)
+    specs = selected(signals)
+    start, end = widx * WIN_SAMPLES, (widx + 1) * WIN_SAMPLES
+    out = {'start': start, 'end': end}
+
+    cache = window_cache()
+    source = source_fingerprint(h5_path)
+    local = _transformed.get((source, subj_id))
+    hits = {}
+    if cache is not None and (local is None or not _has_view(local, view, [spec.name for spec in specs])):
+        for spec in specs:
+            # another worker may have served this window already
+            hit = cache.get(window_key(source, subj_id, _view_key(spec, view), widx))
+            if hit is None:
+                break
+            hits[spec.name] = hit
+    if specs and len(hits) == len(specs):
+        fs = {name: f for name, (_v, f) in hits.items()}
+        out.update({name: v for name, (v, _f) in hits.items()})
+    else:
+        entry = transform_subject(subj_id, view, h5_path, [spec.name for spec in specs])
+        fs = entry['fs']
+        for spec in specs:
+            v = entry['data'].get(spec.name)
+            if v is None:
+                out[spec.name] = EMPTY_SIGNAL.copy()
+                continue
+            out[spec.name] = v[start:end].copy()
+            if cache is not None:
+                cache.put(window_key(source, subj_id, _view_key(spec, view), widx), out[spec.name], fs[spec.name])
+    if any(spec.name in fs for spec in specs):
+        out['fs'] = get_data._window_fs(fs, specs)
+    else:   # none of the selected signals is recorded: time axis of one that is
+        out['fs'] = get_data.subject_fs(subj_id, signals, h5_path)
+    out['t'] = (np.arange(start, end) / out['fs']).astype(np.float32)
+    return out
+
+
+def spectrogram_window(subj_id, widx, sig, h5_path=None):
+    """
+    Spectrogram columns of one window, cut from a spectrogram of the band-passed whole recording.
+
+    Parameters:
+        subj_id (str)        : Identifier of the subject
+        widx (int)           : Zero-based window index
+        sig (str)            : Signal name or alias
+        h5_path (str or Path): Path to the HDF5 file (defaults to the subject's catalogued file)
+
+    Returns:
+        dict: {'signal', 'times' (s, segment centres), 'freqs' (Hz, up to the signal's band), 'power' (dB,
+              freqs x times)}, or None when the subject does not have the signal
+
+    Notes:
+        - Advantage     : Computed once per subject and signal; columns near window edges use the samples of the
+                          neighbouring windows, like a continuous view.
+        - Shortcoming   : Time resolution is one segment step (a quarter of SPECTROGRAM_SEGMENT_S).
+    """
+    spec = resolve(sig)
+    entry = transform_subject(subj_id, 'bandpass', h5_path, [spec.name])
+    v = entry['data'].get(spec.name)
+    if v is None or not v.size:
+        return None
+    fs = entry['fs'][spec.name]
+    cached = entry['spectrogram'].get(spec.name)
+    if cached is None:
+        nperseg = min(int(SPECTROGRAM_SEGMENT_S * fs), v.size)
+        freqs, times, power = sp_signal.spectrogram(np.nan_to_num(v), fs=fs, nperseg=nperseg,
+                                                    noverlap=int(nperseg * SPECTROGRAM_OVERLAP))
+        keep = freqs <= min(spec.band[1], fs / 2)
+        power = (10 * np.log10(power[keep] + 1e-12)).astype(np.float32)
+        cached = entry['spectrogram'][spec.name] = (freqs[keep].astype(np.float32), times.astype(np.float32), power)
+    freqs, times, power = cached
+    t0, t1 = widx * WIN_SAMPLES / fs, (widx + 1) * WIN_SAMPLES / fs
+    lo, hi = np.searchsorted(times, [t0, t1])
+    return {'signal': spec.name, 'times': times[lo:hi], 'freqs': freqs, 'power': power[:, lo:hi]}
+
+
+def release_transforms():
+    """Drop every whole-recording transform held by this process."""
+    with _transformed_lock:
+        _transformed.clear()
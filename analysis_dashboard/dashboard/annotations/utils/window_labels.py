@@ -0,0 +1,104 @@
+import numpy as np
+
+# label code = position in LABELS; code 0 means "not labelled yet"
+LABELS = ('', 'clean', 'noisy', 'motion')
+LABEL_CODES = {name: code for code, name in enumerate(LABELS)}
+UNLABELED = 0
+
+
+def label_code(name):
+    """Map a label name ('' / None for unlabelled) to its uint8 code."""
+    return LABEL_CODES[name or '']
+
+
+class WindowLabels:
+    """
+    Per-window labels of one subject as a uint8 code array with vectorized queries.
+
+    The array is used in place (no copy), so it can be the very array held in the annotation store.
+    "Next unlabelled window" is answered by a union-find over labelled runs: every labelled window points
+    to its successor, and path compression makes repeated forward searches O(1) amortized.
+
+    Notes:
+        - Advantage     : 1 byte per window; counts and "all windows with label X" are single NumPy passes.
+        - Shortcoming   : Un-labelling a window (e.g. undo) invalidates the union-find, which is rebuilt
+                          (vectorized, O(n)) on the next unlabelled-window query.
+    """
+
+    def __init__(self, codes):
+        self.codes = codes if isinstance(codes, np.ndarray) and codes.dtype == np.uint8 \
+            else np.asarray(codes, dtype=np.uint8)
+        self._parent = None
+
+    @classmethod
+    def empty(cls, n_windows):
+        return cls(np.zeros(n_windows, dtype=np.uint8))
+
+    def __len__(self):
+        return int(self.codes.size)
+
+    def label(self, widx):
+        """Label name of window `widx` ('' when unlabelled or out of range)."""
+        return LABELS[self.codes[widx]] if 0 <= widx < self.codes.size else ''
+
+    def set(self, widx, code):
+        """Write a label code and keep the unlabelled-window index current. Returns the previous code."""
+        old = int(self.codes[widx])
+        self.codes[widx] = code
+        self.changed(widx, old, code)
+        return old
+
+    def changed(self, widx, old, new):
+        """Update the index after `codes[widx]` was changed from `old` to `new` by someone else."""
+        if self._parent is None or old == new:
+            return
+        if old == UNLABELED:
+            self._parent[widx] = widx + 1
+        elif new == UNLABELED:
+            self._parent = None
+
+    def _find(self, i):
+        parent = self._parent
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    def next_unlabeled(self, after=0, wrap=True):
+        """
+        Index of the first unlabelled window at or after `after` (wrapping to the start if `wrap`), or None.
+        """
+        n = self.codes.size
+        if self._parent is None:
+            parent = np.arange(n + 1)
+            parent[:n][self.codes != UNLABELED] += 1
+            self._parent = parent.tolist()  # list indexing is faster than NumPy scalar access here
+        found = self._find(min(max(after, 0), n))
+        if found == n and wrap and after > 0:
+            found = self._find(0)
+        return None if found == n else found
+
+    def next_matching(self, code, after=0, wrap=True):
+        """Index of the next window with label `code` at or after `after` (optionally wrapping), or None."""
+        if code == UNLABELED:
+            return self.next_unlabeled(after, wrap)
+        after = min(max(after, 0), self.codes.size)
+        hits = np.flatnonzero(self.codes[after:] == code)
+        if hits.size:
+            return int(after + hits[0])
+        if wrap:
+            hits = np.flatnonzero(self.codes[:after] == code)
+            if hits.size:
+                return int(hits[0])
+        return None
+
+    def windows_with(self, code):
+        """All window indices carrying label `code`."""
+        return np.flatnonzero(self.codes == code)
+
+    def counts(self):
+        """{label name: number of windows}, with '' counting unlabelled windows."""
+        counts = np.bincount(self.codes, minlength=len(LABELS))
+        return {LABELS[code]: int(c) for code, c in enumerate(counts[:len(LABELS)])}
@@ -0,0 +1,140 @@
+import time
+
+from django.conf import settings
+
+from .search_index import connect, index_exists
+
+# A leased task returns to the queue when its annotator has not finished it within this many seconds
+WORK_QUEUE_LEASE_S = getattr(settings, 'WORK_QUEUE_LEASE_S', 15 * 60)
+# Score bonus of windows in subjects nobody has labelled yet (scaled by the unlabelled fraction)
+WORK_QUEUE_COVERAGE_WEIGHT = getattr(settings, 'WORK_QUEUE_COVERAGE_WEIGHT', 0.5)
+# Windows below this quality score are not queued; None queues every unlabelled window
+WORK_QUEUE_MIN_QUALITY = getattr(settings, 'WORK_QUEUE_MIN_QUALITY', None)
+SKIP_PENALTY = 1.0      # a skipped task goes back behind the untouched ones of similar score
+
+# tasks.state
+OPEN, LEASED, DONE = 0, 1, 2
+
+
+def build_work_queue(min_quality=WORK_QUEUE_MIN_QUALITY, coverage_weight=WORK_QUEUE_COVERAGE_WEIGHT,
+                     index_path=None):
+    """
+    Queue every unlabelled window of the search index as a task, or refresh the queue after more labelling.
+
+    A task's score is its window quality plus `coverage_weight` times the fraction of its subject's windows
+    still unlabelled, so clean windows of little-annotated subjects are served first. Re-running updates the
+    scores of open tasks and adds new windows; leased tasks are left alone.
+
+    Parameters:
+        min_quality (float)     : Leave windows below this quality out of the queue (None: queue all)
+        coverage_weight (float) : Weight of the subject coverage term
+        index_path (str or Path): SQLite index (defaults to settings.SEARCH_INDEX_PATH)
+
+    Returns:
+        dict: Task counts after the refresh (see `queue_stats`)
+    """
+    with connect(index_path) as conn:
+        # windows labelled outside the queue are done; labels cleared since then reopen their task
+        conn.execute("UPDATE tasks SET state = ?, annotator = NULL, lease_expires = NULL WHERE state != ? AND "
+                     "EXISTS (SELECT 1 FROM windows w WHERE w.subj_id = tasks.subj_id AND w.widx = tasks.widx "
+                     "AND w.label != 0)", (DONE, DONE))
+        conn.execute("UPDATE tasks SET state = ? WHERE state = ? AND NOT EXISTS (SELECT 1 FROM windows w WHERE "
+                     "w.subj_id = tasks.subj_id AND w.widx = tasks.widx AND w.label != 0)", (OPEN, DONE))
+        conn.execute(f"""
+            INSERT INTO tasks (subj_id, widx, score)
+            SELECT w.subj_id, w.widx, COALESCE(w.quality, 0) + ? * c.unlabelled
+            FROM windows w JOIN (SELECT subj_id, AVG(label = 0) AS unlabelled FROM windows GROUP BY subj_id) c
+                 USING (subj_id)
+            WHERE w.label = 0 {'' if min_quality is None else 'AND w.quality >= ?'}
+            ON CONFLICT (subj_id, widx) DO UPDATE SET score = excluded.score WHERE tasks.state = {OPEN}
+        """, (float(coverage_weight),) + (() if min_quality is None else (float(min_quality),)))
+    return queue_stats(index_path)
+
+
+def lease_task(annotator, lease_s=WORK_QUEUE_LEASE_S, index_path=None):
+    """
+    Lease the best open task to an annotator.
+
+    Expired leases are returned to the queue first. An annotator who already holds a lease (e.g. after a
+    page reload) gets the same task back with its lease renewed instead of a second one.
+
+    Parameters:
+        annotator (str)         : Name of the annotator
+        lease_s (float)         : Seconds until the task returns to the queue unless completed
+        index_path (str or Path): SQLite index (defaults to settings.SEARCH_INDEX_PATH)
+
+    Returns:
+        dict: {'subj_id', 'widx', 'score', 'lease_expires'} of the leased task, or None when the queue is empty
+
+    Notes:
+        - Advantage     : The queue lives in the search index, so every worker process and annotator shares it;
+                          the next task is one seek in the (state, score) index, O(log n) at any queue size.
+        - Advantage     : Runs in one write transaction, so two annotators never lease the same task.
+        - Shortcoming   : Leases are not renewed while an annotator works; a task left open longer than
+                          `lease_s` can be served to someone else.
+    """
+    if not index_exists(index_path):
+        return None
+    now = time.time()
+    expires = now + lease_s
+    with connect(index_path) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("UPDATE tasks SET state = ?, annotator = NULL, lease_expires = NULL "
+                     "WHERE state = ? AND lease_expires < ?", (OPEN, LEASED, now))
+        row = conn.execute("UPDATE tasks SET lease_expires = ? WHERE annotator = ? AND state = ? "
+                           "RETURNING subj_id, widx, score, lease_expires", (expires, annotator, LEASED)).fetchone()
+        if row is None:
+            row = conn.execute("""
+                UPDATE tasks SET state = ?, annotator = ?, lease_expires = ?
+                WHERE (subj_id, widx) = (SELECT subj_id, widx FROM tasks WHERE state = ? ORDER BY score DESC LIMIT 1)
+                RETURNING subj_id, widx, score, lease_expires
+            """, (LEASED, annotator, expires, OPEN)).fetchone()
+    return None if row is None else dict(row)
+
+
+def complete_task(subj_id, widx, index_path=None):
+    """Mark a window's task done, whoever holds it (called when the window gets a label). Returns False if there is none."""
+    if not index_exists(index_path):
+        return False
+    with connect(index_path) as conn:
+        return conn.execute("UPDATE tasks SET state = ?, lease_expires = NULL WHERE subj_id = ? AND widx = ? "
+                            "AND state != ?", (DONE, subj_id, int(widx), DONE)).rowcount > 0
+
+
+def reopen_task(subj_id, widx, index_path=None):
+    """Return a done task to the queue (called when its window's label is cleared, e.g. by undo). Returns False if it was not done."""
+    if not index_exists(index_path):
+        return False
+    with connect(index_path) as conn:
+        return conn.execute("UPDATE tasks SET state = ?, annotator = NULL, lease_expires = NULL WHERE subj_id = ? "
+                            "AND widx = ? AND state = ?", (OPEN, subj_id, int(widx), DONE)).rowcount > 0
+
+
+def release_task(subj_id, widx, annotator, skip=True, index_path=None):
+    """
+    Return an unfinished task leased by `annotator` to the queue.
+
+    Parameters:
+        skip (bool): Lower its score by SKIP_PENALTY, so the next lease does not serve it straight back
+
+    Returns:
+        bool: False when the annotator no longer holds the task (completed, expired or leased by someone else)
+    """
+    if not index_exists(index_path):
+        return False
+    with connect(index_path) as conn:
+        return conn.execute("UPDATE tasks SET state = ?, annotator = NULL, lease_expires = NULL, score = score - ? "
+                            "WHERE subj_id = ? AND widx = ? AND annotator = ? AND state = ?",
+                            (OPEN, SKIP_PENALTY if skip else 0.0, subj_id, int(widx), annotator, LEASED)).rowcount > 0
+
+
+def queue_stats(index_path=None):
+    """Task counts: {'open', 'leased', 'expired' (leased but past their lease), 'done'}."""
+    if not index_exists(index_path):
+        return {'open': 0, 'leased': 0, 'expired': 0, 'done': 0}
+    with connect(index_path) as conn:
+        counts = dict(conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+        expired = conn.execute("SELECT COUNT(*) FROM tasks WHERE state = ? AND lease_expires < ?",
+                               (LEASED, time.time())).fetchone()[0]
+    return {'open': counts.get(OPEN, 0), 'leased': counts.get(LEASED, 0), 'expired': expired,
+            'done': counts.get(DONE, 0)}
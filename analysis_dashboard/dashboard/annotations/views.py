@@ -0,0 +1,147 @@
+import hashlib
+import re
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.views.decorators.http import require_safe
+
+from dashboard.middleware import CALLBACK_PAYLOAD_BUDGET, payload_stats
+from .utils import get_data
+from .utils.get_data import load_signal_range, load_subject_metadata, source_fingerprint
+from .utils.signals import SIGNAL_ALIASES
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+SAMPLE_BYTES = 4     # float32
+SIGNAL_RANGE_MAX_SAMPLES = getattr(settings, 'SIGNAL_RANGE_MAX_SAMPLES', 1024 * 1024)
+
+
+def _int_param(request, name):
+    value = request.GET.get(name)
+    if value in (None, ''):
+        return None
+    return int(value)
+
+
+def _etag(subj_id, signal, start, end):
+    """Strong validator for a requested range; changes whenever the subject's file is rewritten or replaced."""
+    key = f"{source_fingerprint(get_data.subject_path(subj_id))}|{subj_id}|{signal}|{start}|{end}"
+    return '"' + hashlib.sha1(key.encode()).hexdigest() + '"'
+
+
+def _etag_matches(header, etag):
+    """Whether an `If-None-Match` header matches `etag` (weak comparison; `*` matches any current body)."""
+    tags = [t.strip() for t in header.split(',')] if header else []
+    return '*' in tags or etag in [t[2:] if t.startswith('W/') else t for t in tags]
+
+
+def _byte_range(header, size):
+    """
+    Parse a single-range `Range` header against a body of `size` bytes.
+
+    Returns:
+        tuple | None | False: (first, last) inclusive byte offsets, None to serve the full body
+                              (no/unsupported header), or False when the range is unsatisfiable
+    """
+    m = RANGE_RE.match(header.strip()) if header else None
+    if m is None:
+        return None
+    first, last = m.groups()
+    if first == '' and last == '':
+        return None
+    if size == 0:
+        return False
+    if first == '':
+        # suffix range: the last N bytes
+        n = int(last)
+        if n == 0:
+            return False
+        return max(size - n, 0), size - 1
+    first = int(first)
+    last = size - 1 if last == '' else min(int(last), size - 1)
+    if first >= size or first > last:
+        return False
+    return first, last
+
+
+@require_safe
+def signal_window(request, subj_id, sig):
+    """
+    Serve a sample range of one signal as raw little-endian float32.
+
+    GET /api/subjects/<id>/signals/<sig>?start=<sample>&end=<sample>
+
+    Parameters:
+        subj_id (str): Subject identifier
+        sig (str)    : Signal name, alias or HDF5 group from the signal registry ('ecg'/'ekg', 'ppg', 'abp'/'bp')
+
+    Returns:
+        HttpResponse: application/octet-stream body with `X-Sample-Rate`, `X-Dtype`, `X-Shape`,
+                      `X-Start` and `X-End` headers; honours `Range` (206/416) and `If-None-Match` (304)
+
+    Notes:
+        - Advantage     : No float-to-text encoding; clients read it with np.frombuffer(body, '<f4').
+        - Advantage     : Uses `load_signal_range`, so preloaded subjects and the shared window cache are reused;
+                          a byte range reads only the samples it covers.
+        - Shortcoming   : At most SIGNAL_RANGE_MAX_SAMPLES samples per response (the default when `end` is
+                          missing; longer ranges get 400), so whole long recordings are fetched in pages.
+        - Shortcoming   : Only single byte ranges are supported; multi-range requests get the full body.
+    """
+    if sig not in SIGNAL_ALIASES:
+        raise Http404(f"Unknown signal {sig!r}")
+    try:
+        start = _int_param(request, 'start') or 0
+        end = _int_param(request, 'end')
+    except ValueError:
+        return HttpResponseBadRequest("start and end must be integer sample indices")
+    if end is None:
+        end = start + SIGNAL_RANGE_MAX_SAMPLES
+    if start < 0 or end < start:
+        return HttpResponseBadRequest("expected 0 <= start <= end")
+    if end - start > SIGNAL_RANGE_MAX_SAMPLES:
+        return HttpResponseBadRequest(f"at most {SIGNAL_RANGE_MAX_SAMPLES} samples per request")
+
+    key = SIGNAL_ALIASES[sig]
+    try:
+        etag = _etag(subj_id, key, start, end)
+        meta = load_subject_metadata(subj_id)
+    except (KeyError, FileNotFoundError):
+        raise Http404(f"No subject {subj_id!r}")
+    if _etag_matches(request.headers.get('If-None-Match'), etag):
+        return HttpResponse(status=304, headers={'ETag': etag})
+    if key not in meta:
+        raise Http404(f"No signal {sig!r} for subject {subj_id!r}")
+
+    # clip to the recording and resolve the byte range against the clipped body before reading anything
+    end = min(end, max(start, meta[key]['arrays']['v']['shape'][0]))
+    size = (end - start) * SAMPLE_BYTES
+    byte_range = _byte_range(request.headers.get('Range'), size)
+    first, last = (0, size - 1) if byte_range in (None, False) else byte_range
+    headers = {'ETag': etag, 'Accept-Ranges': 'bytes', 'X-Sample-Rate': repr(float(meta[key]['fs'])),
+               'X-Dtype': '<f4', 'X-Shape': str(end - start), 'X-Start': str(start), 'X-End': str(end)}
+    if byte_range is False:
+        headers['Content-Range'] = f"bytes */{size}"
+        return HttpResponse(status=416, headers=headers)
+
+    try:
+        data, _ = load_signal_range(subj_id, key, start + first // SAMPLE_BYTES, start + last // SAMPLE_BYTES + 1)
+    except KeyError:
+        raise Http404(f"No signal {sig!r} for subject {subj_id!r}")
+    body = data.astype('<f4', copy=False).tobytes()
+    if byte_range is None:
+        return HttpResponse(body, content_type='application/octet-stream', headers=headers)
+    offset = first % SAMPLE_BYTES
+    headers['Content-Range'] = f"bytes {first}-{last}/{size}"
+    return HttpResponse(body[offset:offset + last - first + 1], status=206, content_type='application/octet-stream',
+                        headers=headers)
+
+
+@require_safe
+def callback_payloads(request):
+    """
+    Request/response byte totals per Dash callback ID for the serving process (see PayloadBudgetMiddleware).
+
+    GET /api/callback-payloads; available with DEBUG on or to staff users.
+    """
+    if not (settings.DEBUG or request.user.is_staff):
+        raise Http404()
+    return JsonResponse({'budget_bytes': CALLBACK_PAYLOAD_BUDGET, 'callbacks': payload_stats()})
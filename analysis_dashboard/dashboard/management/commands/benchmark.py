@@ -0,0 +1,65 @@
+import json
+import tempfile
+from pathlib import Path
+
+import h5py
+from django.core.management.base import BaseCommand
+
+from dashboard.annotations.utils.benchmark import run_benchmarks
+from dashboard.annotations.utils.get_data import get_subject_ids
+from dashboard.annotations.utils.synthetic_data import write_synthetic_h5
+
+
+class Command(BaseCommand):
+    help = ("Generate a synthetic HDF5 store and benchmark window/metadata loading, figure building, "
+            "annotation overlay and Dash callback round-trips. Writes JSON results.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subjects', type=int, default=4, help='Number of synthetic subjects')
+        parser.add_argument('--duration', type=float, default=1800, help='Recording length per subject (s)')
+        parser.add_argument('--fs', type=int, default=125, help='Sampling frequency (Hz)')
+        parser.add_argument('--peaks', type=int, nargs='+', default=[100, 1000, 10000, 100000],
+                            help='Annotation sizes (peaks per signal) for overlay and redraw benchmarks')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed repetitions per benchmark')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed repetitions per benchmark')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--h5', type=Path, default=None,
+                            help='Benchmark this existing file instead of generating one')
+        parser.add_argument('--keep', type=Path, default=None, help='Also save the generated file here')
+        parser.add_argument('--no-callbacks', action='store_true', help='Skip Dash callback round-trips')
+        parser.add_argument('--output', '-o', type=Path, default=None, help='Write JSON results here')
+
+    def handle(self, *args, **opts):
+        with tempfile.TemporaryDirectory() as tmp:
+            if opts['h5'] is not None:
+                h5_path = opts['h5']
+                subj_ids = get_subject_ids(h5_path)
+                with h5py.File(h5_path, 'r') as f:
+                    n_samples = f['subjects'][subj_ids[0]]['ppg']['v'].shape[0]
+                    fs = float(f['subjects'][subj_ids[0]]['ppg']['fs'][()])
+            else:
+                h5_path = opts['keep'] or Path(tmp) / 'synthetic.h5'
+                fs = opts['fs']
+                n_samples = int(opts['duration'] * fs)
+                self.stderr.write(f"Writing {opts['subjects']} synthetic subjects "
+                                  f"({n_samples} samples @ {fs} Hz) to {h5_path}")
+                subj_ids = write_synthetic_h5(h5_path, opts['subjects'], opts['duration'], fs, seed=opts['seed'])
+
+            report = run_benchmarks(h5_path, subj_ids, n_samples, fs,
+                                    peak_counts=opts['peaks'], repeat=opts['repeat'], warmup=opts['warmup'],
+                                    seed=opts['seed'], callbacks=not opts['no_callbacks'])
+
+        for r in report['results']:
+            params = ' '.join(f"{k}={v}" for k, v in r['params'].items())
+            if 'error' in r:
+                self.stderr.write(self.style.WARNING(f"{r['name']:<36} {params:<28} {r['error']}"))
+                continue
+            self.stderr.write(f"{r['name']:<36} {params:<28} median {r['stats']['median_s'] * 1e3:9.3f} ms"
+                              f"   p95 {r['stats']['p95_s'] * 1e3:9.3f} ms")
+
+        text = json.dumps(report, indent=2, sort_keys=True)
+        if opts['output']:
+            opts['output'].write_text(text)
+            self.stderr.write(self.style.SUCCESS(f"Results written to {opts['output']}"))
+        else:
+            self.stdout.write(text)
@@ -0,0 +1,43 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard.annotations.utils import get_data
+from dashboard.annotations.utils.search_index import build_index, resolve_index
+
+
+class Command(BaseCommand):
+    help = ("Compute per-window features (quality, peak counts, heart rate) and subject metadata for every "
+            "subject in the HDF5 store and write them to the SQLite search index used by the dashboard.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--h5', type=Path, default=None,
+                            help='Index only this HDF5 file (defaults to settings.H5_PATH and every shard in '
+                                 'settings.H5_SHARD_DIR)')
+        parser.add_argument('--index', type=Path, default=None,
+                            help='SQLite index file (defaults to settings.SEARCH_INDEX_PATH)')
+        parser.add_argument('--subjects', nargs='+', default=None, help='Only index these subjects')
+        parser.add_argument('--force', action='store_true',
+                            help='Re-index subjects even if the store is unchanged since they were indexed')
+
+    def handle(self, *args, **opts):
+        h5_path = opts['h5']     # None: the main store and every shard (see SubjectCatalogue)
+        store = h5_path or get_data.H5_PATH
+        if not Path(store).exists():
+            raise CommandError(f"{store} does not exist")
+        if resolve_index(opts['index']) is None:
+            raise CommandError("The search index is disabled: set SEARCH_INDEX_PATH in settings or pass --index")
+
+        def progress(subj_id, n_windows):
+            if n_windows is None:
+                self.stdout.write(f"  {subj_id:<24} unchanged, skipped")
+            else:
+                self.stdout.write(f"  {subj_id:<24} {n_windows} windows")
+
+        t0 = time.perf_counter()
+        stats = build_index(h5_path, opts['index'], subj_ids=opts['subjects'], force=opts['force'],
+                            progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {stats['indexed']} subjects ({stats['windows']} windows), skipped {stats['skipped']} "
+            f"in {time.perf_counter() - t0:.1f} s"))
@@ -0,0 +1,35 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard.annotations.utils.work_queue import (WORK_QUEUE_COVERAGE_WEIGHT, WORK_QUEUE_MIN_QUALITY,
+                                                    build_work_queue, queue_stats)
+from dashboard.annotations.utils.search_index import resolve_index
+
+
+class Command(BaseCommand):
+    help = ("Queue every unlabelled window of the search index as an annotation task, best quality and least "
+            "covered subjects first, or refresh the queue's scores after more labelling. Annotators are served "
+            "tasks by the dashboard's \"Next Task\" button. Run build_search_index first.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--index', type=Path, default=None,
+                            help='SQLite index file (defaults to settings.SEARCH_INDEX_PATH)')
+        parser.add_argument('--min-quality', type=float, default=WORK_QUEUE_MIN_QUALITY,
+                            help='Do not queue windows below this quality score')
+        parser.add_argument('--coverage-weight', type=float, default=WORK_QUEUE_COVERAGE_WEIGHT,
+                            help="Score bonus for windows of subjects with few labelled windows")
+        parser.add_argument('--stats', action='store_true', help='Only print the task counts')
+
+    def handle(self, *args, **opts):
+        if resolve_index(opts['index']) is None:
+            raise CommandError("The search index is disabled: set SEARCH_INDEX_PATH in settings or pass --index")
+        if opts['stats']:
+            stats = queue_stats(opts['index'])
+        else:
+            t0 = time.perf_counter()
+            stats = build_work_queue(opts['min_quality'], opts['coverage_weight'], opts['index'])
+            self.stdout.write(f"Queue refreshed in {time.perf_counter() - t0:.1f} s")
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['open']} open, {stats['leased']} leased ({stats['expired']} expired), {stats['done']} done"))
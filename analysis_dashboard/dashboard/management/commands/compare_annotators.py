@@ -0,0 +1,67 @@
+import json
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard.annotations.utils.agreement import (AGREEMENT_MIN_F1, AGREEMENT_TOLERANCE_S, ANNOTATIONS_DIR,
+                                                   compare_annotators, summarize)
+from dashboard.annotations.utils.search_index import record_disagreements, resolve_index
+
+
+class Command(BaseCommand):
+    help = ("Compare two annotators' exported annotation stores subject by subject: peak sensitivity/PPV/F1 per "
+            "signal, Cohen's kappa of the window labels, and the windows they disagree on. Flagged windows are "
+            "stored in the search index and listed by the dashboard's \"Disagreements\" button.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('annotator_a', help='Reference annotator: a directory of <subj_id>.json stores, or its '
+                                                'name under settings.ANNOTATIONS_DIR')
+        parser.add_argument('annotator_b', help='Annotator compared against it')
+        parser.add_argument('--subjects', nargs='+', default=None, help='Only compare these subjects')
+        parser.add_argument('--tolerance', type=float, default=AGREEMENT_TOLERANCE_S,
+                            help='Peak matching tolerance in seconds')
+        parser.add_argument('--min-f1', type=float, default=AGREEMENT_MIN_F1,
+                            help='Flag windows where a signal scores below this F1')
+        parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: one per CPU)')
+        parser.add_argument('--index', type=Path, default=None,
+                            help='SQLite index file (defaults to settings.SEARCH_INDEX_PATH)')
+        parser.add_argument('--no-index', action='store_true', help='Do not store the flagged windows')
+        parser.add_argument('-o', '--output', type=Path, default=None, help='Write the full report as JSON')
+
+    def annotator_dir(self, name):
+        path = Path(name)
+        if not path.is_dir() and ANNOTATIONS_DIR:
+            path = Path(ANNOTATIONS_DIR) / name
+        if not path.is_dir():
+            raise CommandError(f"No annotation directory {name!r}")
+        return path
+
+    def handle(self, *args, **opts):
+        dir_a, dir_b = self.annotator_dir(opts['annotator_a']), self.annotator_dir(opts['annotator_b'])
+        if not opts['no_index'] and resolve_index(opts['index']) is None:
+            raise CommandError("The search index is disabled: set SEARCH_INDEX_PATH in settings, pass --index or --no-index")
+        t0 = time.perf_counter()
+        results = compare_annotators(dir_a, dir_b, subj_ids=opts['subjects'], workers=opts['workers'],
+                                     tolerance_s=opts['tolerance'], min_f1=opts['min_f1'])
+        if not results:
+            raise CommandError(f"No subject has an exported store in both {dir_a} and {dir_b}")
+
+        for r in results:
+            f1 = ' '.join(f"{sig}={s['f1']:.3f}" for sig, s in r['signals'].items())
+            kappa = '-' if r['labels']['kappa'] is None else f"{r['labels']['kappa']:.3f}"
+            self.stdout.write(f"  {r['subj_id']:<24} F1 {f1}  kappa {kappa}  {len(r['windows'])} flagged windows")
+        summary = summarize(results)
+        for sig, s in summary['signals'].items():
+            self.stdout.write(f"  {sig:<6} Se {s['se']:.3f}  PPV {s['ppv']:.3f}  F1 {s['f1']:.3f}  "
+                              f"(TP {s['tp']}, FP {s['fp']}, FN {s['fn']})")
+
+        if not opts['no_index']:
+            record_disagreements(dir_a.name, dir_b.name, results, opts['index'])
+        if opts['output']:
+            opts['output'].write_text(json.dumps({'annotator_a': str(dir_a), 'annotator_b': str(dir_b),
+                                                  'tolerance_s': opts['tolerance'], 'min_f1': opts['min_f1'],
+                                                  'summary': summary, 'subjects': results}, indent=2))
+        self.stdout.write(self.style.SUCCESS(
+            f"Compared {summary['subjects']} subjects, {summary['flagged_windows']} windows flagged "
+            f"in {time.perf_counter() - t0:.1f} s"))
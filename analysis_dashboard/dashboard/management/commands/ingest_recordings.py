@@ -0,0 +1,46 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard.annotations.utils.h5_layout import COMPRESSIONS
+from dashboard.annotations.utils.ingest import READERS, detect_format, ingest
+
+
+class Command(BaseCommand):
+    help = ("Add new recordings (NumPy .npz, CSV or WFDB) to the store as a new shard file and index their "
+            "windows. Running servers list the new subjects on the next page load; no restart is needed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('inputs', nargs='+', type=Path, help='Recording files (or WFDB record names)')
+        parser.add_argument('--format', choices=('auto',) + tuple(READERS), default='auto')
+        parser.add_argument('--fs', type=float, default=None, help='Sampling rate for CSV files without a time column')
+        parser.add_argument('--subject-id', default=None, help='Subject id (only with a single input)')
+        parser.add_argument('--shard-dir', type=Path, default=None,
+                            help='Shard directory (defaults to settings.H5_SHARD_DIR)')
+        parser.add_argument('--compression', choices=COMPRESSIONS, default='gzip')
+        parser.add_argument('--no-index', action='store_true', help='Skip computing search-index rows')
+
+    def handle(self, *args, **opts):
+        if opts['subject_id'] and len(opts['inputs']) > 1:
+            raise CommandError("--subject-id can only be used with a single input")
+
+        recordings = []
+        for path in opts['inputs']:
+            try:
+                fmt = detect_format(path) if opts['format'] == 'auto' else opts['format']
+                kwargs = {'fs': opts['fs']} if fmt == 'csv' else {}
+                rec = READERS[fmt](path, subj_id=opts['subject_id'], **kwargs)
+            except (OSError, ValueError, ImportError) as e:
+                raise CommandError(str(e))
+            n_samples = max(v.size for v in rec['signals'].values())
+            self.stdout.write(f"  {rec['subj_id']:<24} {fmt:<5} {n_samples} samples @ {rec['fs']:g} Hz "
+                              f"({', '.join(f'{g}={name}' for g, name in rec['labels'].items())})")
+            recordings.append(rec)
+
+        try:
+            result = ingest(recordings, shard_dir=opts['shard_dir'], index=not opts['no_index'],
+                            compression=None if opts['compression'] == 'none' else opts['compression'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {len(result['subjects'])} subjects to {result['shard']} ({result['windows']} windows indexed)"))
@@ -0,0 +1,64 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard.annotations.utils.get_data import WIN_SAMPLES
+from dashboard.annotations.utils.h5_layout import (COMPRESSIONS, inspect_layout, repack_h5,
+                                                   window_datasets, window_read_cost)
+
+
+class Command(BaseCommand):
+    help = ("Inspect the HDF5 store layout and rewrite it with waveform chunks aligned to the window "
+            "length, reporting the per-window read cost before and after.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--src', type=Path, default=None, help='Source file (defaults to settings.H5_PATH)')
+        parser.add_argument('--dst', type=Path, default=None,
+                            help='Destination file (defaults to <src>.repacked.h5; pass the source path to replace it)')
+        parser.add_argument('--window-samples', type=int, default=WIN_SAMPLES,
+                            help='Window length in samples the chunks are aligned to')
+        parser.add_argument('--windows-per-chunk', type=int, default=1)
+        parser.add_argument('--compression', choices=COMPRESSIONS, default='gzip')
+        parser.add_argument('--level', type=int, default=None, help='gzip compression level (0-9)')
+        parser.add_argument('--no-shuffle', action='store_true', help='Disable the byte-shuffle filter')
+        parser.add_argument('--rdcc-nbytes', type=int, default=None,
+                            help='Chunk cache size used when timing reads (defaults to settings.H5_RDCC_NBYTES)')
+        parser.add_argument('--inspect-only', action='store_true', help='Report the current layout and exit')
+
+    def report(self, label, h5_path, opts):
+        layout = window_datasets(inspect_layout(h5_path))
+        chunks = sorted({d['chunks'] for d in layout}, key=str)
+        filters = sorted({(d['compression'], d['compression_opts'], d['shuffle']) for d in layout}, key=str)
+        stored = sum(d['storage_bytes'] for d in layout)
+        decoded = sum(d['nbytes'] for d in layout)
+        cost = window_read_cost(h5_path, opts['window_samples'], rdcc_nbytes=opts['rdcc_nbytes'])
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"{label}: {h5_path}"))
+        self.stdout.write(f"  waveform datasets   : {len(layout)}")
+        self.stdout.write(f"  chunk shapes        : {chunks}")
+        self.stdout.write(f"  filters             : {filters} (compression, opts, shuffle)")
+        self.stdout.write(f"  stored / decoded    : {stored / 1e6:.2f} MB / {decoded / 1e6:.2f} MB")
+        self.stdout.write(f"  chunks per window   : {cost['chunks_per_window']:.2f}")
+        self.stdout.write(f"  decoded per window  : {cost['decoded_bytes_per_window'] / 1e3:.1f} kB per signal")
+        self.stdout.write(f"  read amplification  : {cost['read_amplification']:.2f}x")
+        self.stdout.write(f"  time per window     : {cost['seconds_per_window'] * 1e3:.3f} ms")
+        return cost
+
+    def handle(self, *args, **opts):
+        src = opts['src'] or Path(settings.H5_PATH)
+        if not src.exists():
+            raise CommandError(f"{src} does not exist")
+
+        before = self.report('Current layout', src, opts)
+        if opts['inspect_only']:
+            return
+
+        dst = opts['dst'] or src.with_name(src.stem + '.repacked.h5')
+        repack_h5(src, dst, win_samples=opts['window_samples'], windows_per_chunk=opts['windows_per_chunk'],
+                  compression=opts['compression'], compression_level=opts['level'],
+                  shuffle=not opts['no_shuffle'])
+
+        after = self.report('Repacked layout', dst, opts)
+        speedup = before['seconds_per_window'] / max(after['seconds_per_window'], 1e-12)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {dst} ({speedup:.2f}x per-window read time)"))
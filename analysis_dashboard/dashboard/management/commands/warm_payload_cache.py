@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard.annotations.utils import payload_cache
+from dashboard.annotations.utils.get_data import get_subject_ids
+
+
+class Command(BaseCommand):
+    help = ("Encode every window of every subject (or --subjects) into the on-disk payload cache "
+            "(settings.PAYLOAD_CACHE_DIR), so freshly started servers serve windows without touching HDF5.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subjects', nargs='+', default=None, help='Only warm these subjects')
+        parser.add_argument('--force', action='store_true', help='Rewrite windows that are already cached')
+        parser.add_argument('--clear', action='store_true', help='Delete every cached entry first')
+
+    def handle(self, *args, **opts):
+        cache = payload_cache.payload_cache()
+        if cache is None:
+            raise CommandError("The payload cache is disabled: set PAYLOAD_CACHE_DIR in settings")
+        if opts['clear']:
+            cache.clear()
+
+        t0 = time.perf_counter()
+        written = cached = 0
+        for subj_id in opts['subjects'] or get_subject_ids():
+            try:
+                n_new, n_old = payload_cache.warm_subject(subj_id, force=opts['force'], cache=cache)
+            except KeyError:
+                raise CommandError(f"No subject {subj_id!r}")
+            written += n_new
+            cached += n_old
+            self.stdout.write(f"  {subj_id:<24} {n_new} windows written, {n_old} already cached")
+        size = cache.size()
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {written} windows ({cached} already cached) in {time.perf_counter() - t0:.1f} s; "
+            f"cache holds {size / 1e6:.1f} MB of {cache.max_bytes / 1e6:.0f} MB at {cache.root}"))
@@ -0,0 +1,184 @@
+import gzip
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:      # optional: pip install brotli
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Responses under these path prefixes are compressed (Dash layout, dependencies and callback responses)
+COMPRESSION_PATHS = tuple(getattr(settings, 'RESPONSE_COMPRESSION_PATHS', ('/django_plotly_dash/',)))
+COMPRESSION_MIN_BYTES = getattr(settings, 'RESPONSE_COMPRESSION_MIN_BYTES', 1024)
+GZIP_LEVEL = getattr(settings, 'RESPONSE_GZIP_LEVEL', 6)
+BROTLI_QUALITY = getattr(settings, 'RESPONSE_BROTLI_QUALITY', 5)   # 0-11; 4-6 suits per-request JSON
+COMPRESSIBLE_TYPES = ('application/json', 'text/', 'application/javascript')
+
+# A callback whose request body or (uncompressed) response exceeds this many bytes is logged
+CALLBACK_PAYLOAD_BUDGET = getattr(settings, 'CALLBACK_PAYLOAD_BUDGET', 512 * 1024)
+CALLBACK_PATH_SUFFIX = '_dash-update-component'
+
+
+def accepted_encodings(header):
+    """Content codings a client accepts, from its Accept-Encoding header (entries with q=0 are refused)."""
+    accepted = set()
+    for item in (header or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def compress_body(body, accept_encoding):
+    """
+    Compress a response body with the best coding the client accepts.
+
+    Returns:
+        tuple: (coding, compressed bytes), or (None, body) when no supported coding is accepted
+    """
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and 'br' in accepted:
+        return 'br', brotli.compress(body, quality=BROTLI_QUALITY)
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip', gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    return None, body
+
+
+class CompressionMiddleware:
+    """
+    Brotli/gzip compression of the Dash endpoints' responses, negotiated from Accept-Encoding.
+
+    Figure and store JSON is highly repetitive (trace skeletons, base64 arrays of smooth signals), so callback
+    responses shrink several times over. Brotli is used when the optional `brotli` package is installed and
+    the client accepts it, gzip otherwise. Bodies already encoded, streamed or below COMPRESSION_MIN_BYTES are
+    left alone, as are paths outside COMPRESSION_PATHS (the binary signal API serves byte ranges of its body).
+
+    Notes:
+        - Advantage     : Cuts transfer time on slow links (VPN) by the compression ratio, for a few ms of CPU.
+        - Shortcoming   : Requests are not compressed by browsers, so the annotation stores still travel
+                          uncompressed from the client; the payload budget log shows which callbacks that hurts.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (not request.path.startswith(COMPRESSION_PATHS) or response.streaming
+                or response.has_header('Content-Encoding')
+                or not response.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES)):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        body = response.content
+        if len(body) < COMPRESSION_MIN_BYTES:
+            return response
+        coding, compressed = compress_body(body, request.headers.get('Accept-Encoding'))
+        if coding is None or len(compressed) >= len(body):
+            return response
+        response.uncompressed_length = len(body)      # read by PayloadBudgetMiddleware
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = coding
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag            # the representation changed, as Django's GZipMiddleware does
+        return response
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def payload_stats():
+    """
+    Payload totals of this process per callback ID (the Dash output spec), largest responses first.
+
+    Returns:
+        list[dict]: 'callback', 'calls', 'request_bytes', 'response_bytes', 'sent_bytes' (after compression),
+                    'max_request_bytes', 'max_response_bytes', 'over_budget' and 'seconds'
+    """
+    with _stats_lock:
+        rows = [{'callback': cid, **totals} for cid, totals in _stats.items()]
+    return sorted(rows, key=lambda r: r['response_bytes'], reverse=True)
+
+
+def reset_payload_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def record_payload(callback_id, request_bytes, response_bytes, sent_bytes, seconds, over_budget):
+    with _stats_lock:
+        totals = _stats.get(callback_id)
+        if totals is None:
+            totals = _stats[callback_id] = {'calls': 0, 'request_bytes': 0, 'response_bytes': 0, 'sent_bytes': 0,
+                                            'max_request_bytes': 0, 'max_response_bytes': 0, 'over_budget': 0,
+                                            'seconds': 0.0}
+        totals['calls'] += 1
+        totals['request_bytes'] += request_bytes
+        totals['response_bytes'] += response_bytes
+        totals['sent_bytes'] += sent_bytes
+        totals['max_request_bytes'] = max(totals['max_request_bytes'], request_bytes)
+        totals['max_response_bytes'] = max(totals['max_response_bytes'], response_bytes)
+        totals['over_budget'] += int(over_budget)
+        totals['seconds'] += seconds
+
+
+def callback_id(body):
+    """Dash callback ID (its output spec, e.g. 'signal-plots.figure') of a callback request body."""
+    try:
+        return str(json.loads(body).get('output', '?'))
+    except (ValueError, AttributeError):
+        return '?'
+
+
+class PayloadBudgetMiddleware:
+    """
+    Measure the request and response size of every Dash callback, keep totals per callback ID and log a
+    warning for each call whose request body or uncompressed response exceeds CALLBACK_PAYLOAD_BUDGET.
+
+    Must come before CompressionMiddleware in MIDDLEWARE so it sees both the uncompressed and the sent size.
+    Totals are per process; `payload_stats()` reads them (served at /api/callback-payloads).
+
+    Notes:
+        - Advantage     : Shows which callbacks move the most data (e.g. stores echoed back on every call)
+                          without a browser profiler.
+        - Shortcoming   : The request body is parsed a second time to find the callback ID, only for
+                          callback requests.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method != 'POST' or not request.path.endswith(CALLBACK_PATH_SUFFIX):
+            return self.get_response(request)
+        body = request.body          # read before the view so it stays available afterwards
+        t0 = time.perf_counter()
+        response = self.get_response(request)
+        seconds = time.perf_counter() - t0
+        if response.streaming:
+            return response
+        sent = len(response.content)
+        size = getattr(response, 'uncompressed_length', sent)
+        cid = callback_id(body)
+        over = len(body) > CALLBACK_PAYLOAD_BUDGET or size > CALLBACK_PAYLOAD_BUDGET
+        record_payload(cid, len(body), size, sent, seconds, over)
+        if over:
+            logger.warning("Callback %s over payload budget (%d B): request %d B, response %d B (%d B sent), %.0f ms",
+                           cid, CALLBACK_PAYLOAD_BUDGET, len(body), size, sent, seconds * 1000)
+        return response
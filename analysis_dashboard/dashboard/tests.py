@@ -1,3 +1,1022 @@
-from django.test import TestCase
+import contextlib
+import gzip
+import io
+import json
+import os
+import shutil
+import signal
+import tempfile
+import threading
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import h5py
+import numpy as np
+from plotly.utils import PlotlyJSONEncoder
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase
+
+from . import middleware
+from .annotations import views
+from .annotations.utils import get_data, h5_layout, payload_cache, transforms, work_queue
+from .annotations.utils.agreement import cohen_kappa, match_peaks
+from .annotations.utils.annotation_journal import REVISION, AnnotationJournal, get_journal
+from .annotations.utils.benchmark import (SCHEMA_VERSION, run_benchmarks, use_h5_path, use_payload_cache,
+                                          use_search_index, without_window_cache)
+from .annotations.utils.catalogue import SubjectCatalogue
+from .annotations.utils.generate_shared_axis_figure import (RENDER_MODES, array_values, build_shared_xaxis_figure,
+                                                            generate_shared_xaxis_figure)
+from .annotations.utils.ingest import read_npz, write_shard
+from .annotations.utils.search_index import (build_index, connect, load_labels, meta_values, record_label,
+                                              search_windows)
+from .annotations.utils import shared_cache
+from .annotations.utils.shared_cache import INDEX_DTYPE, SharedWindowCache, get_window_cache
+from .annotations.utils.signals import SIGNALS
+from .annotations.utils.synthetic_data import write_synthetic_h5
+from .annotations.utils.window_labels import WindowLabels, label_code
+
+
+def pairs(matched):
+    """Matched (test, reference) index pairs of `match_peaks` as a set."""
+    test_idx, ref_idx = matched
+    return set(zip(test_idx.tolist(), ref_idx.tolist()))
+
+
+class AgreementTests(SimpleTestCase):
+    def test_match_peaks_within_tolerance(self):
+        # 102 is 2 samples from 100; 190 is 10 from 200, beyond the tolerance; 500 has no partner
+        self.assertEqual(pairs(match_peaks([100, 200, 300], [102, 190, 500], tolerance=5)), {(0, 0)})
+
+    def test_match_peaks_closest_pair_first(self):
+        # 12 and 14 are both 1 sample from 13: 12 takes it (tie goes left), 14 falls back to 10 (4 samples)
+        self.assertEqual(pairs(match_peaks([10, 13], [12, 14], tolerance=5)), {(0, 1), (1, 0)})
+        # the nearest reference wins even when an earlier one is within the tolerance
+        self.assertEqual(pairs(match_peaks([100, 104], [103], tolerance=5)), {(0, 1)})
+
+    def test_match_peaks_one_to_one(self):
+        test_idx, ref_idx = match_peaks([50], [49, 50, 51], tolerance=3)
+        self.assertEqual((test_idx.tolist(), ref_idx.tolist()), ([1], [0]))
+
+    def test_match_peaks_empty(self):
+        self.assertEqual(pairs(match_peaks([], [1, 2], tolerance=5)), set())
+
+    def test_cohen_kappa(self):
+        # window 4 is unlabelled by the first annotator and left out; of the other 4, 3 agree (po = 0.75)
+        # marginals: a = {clean: 2, noisy: 2}, b = {clean: 1, noisy: 3}, so pe = (2*1 + 2*3) / 16 = 0.5
+        kappa, n = cohen_kappa([1, 1, 2, 2, 0], [1, 2, 2, 2, 1])
+        self.assertEqual(n, 4)
+        self.assertAlmostEqual(kappa, 0.5)
+
+    def test_cohen_kappa_degenerate(self):
+        self.assertEqual(cohen_kappa([0, 1], [2, 0]), (None, 0))
+        self.assertEqual(cohen_kappa([1, 1, 1], [1, 1, 1]), (1.0, 3))
+
+
+def peak_store(samples=(), n_windows=2):
+    return {'window_labels': [0] * n_windows,
+            'ecg': {'sample_peak_positions': list(samples), 'time_peak_positions': [x / 100 for x in samples]}}
+
+
+def ecg_peaks(state):
+    return state['ecg']['sample_peak_positions']
+
+
+class AnnotationJournalTests(SimpleTestCase):
+    def test_undo_redo(self):
+        journal = AnnotationJournal(peak_store([10]))
+        journal.add_peak('ecg', 30, 0.3)
+        journal.add_peak('ecg', 20, 0.2)
+        journal.remove_peaks('ecg', 10)
+        self.assertEqual(ecg_peaks(journal.state), [20, 30])
+        self.assertTrue(journal.undo())
+        self.assertEqual(ecg_peaks(journal.state), [10, 20, 30])
+        self.assertEqual(journal.state['ecg']['time_peak_positions'], [0.1, 0.2, 0.3])
+        journal.undo(), journal.undo()
+        self.assertEqual(ecg_peaks(journal.state), [10])
+        self.assertFalse(journal.undo())
+        journal.redo()
+        self.assertEqual(ecg_peaks(journal.state), [10, 30])
+
+    def test_new_edit_discards_redo(self):
+        journal = AnnotationJournal(peak_store(), snapshot_every=2)
+        for sample in (1, 2, 3, 4):
+            journal.add_peak('ecg', sample, sample / 100)
+        journal.undo(), journal.undo(), journal.undo()
+        journal.add_peak('ecg', 9, 0.09)
+        self.assertFalse(journal.redo())
+        self.assertEqual(ecg_peaks(journal.state), [1, 9])
+        self.assertEqual(ecg_peaks(journal.state_at(2)), [1, 9])
+        self.assertEqual(len(journal.ops), 2)
+
+    def test_state_at_across_snapshots(self):
+        journal = AnnotationJournal(peak_store(), snapshot_every=2)
+        for sample in (50, 10, 40, 20, 30):
+            journal.add_peak('ecg', sample, sample / 100)
+        journal.set_label(1, 'noisy')
+        journal.clear_range(15, 45)
+        self.assertEqual(sorted(journal.snapshots), [0, 2, 4, 6])
+        expected = [[], [50], [10, 50], [10, 40, 50], [10, 20, 40, 50], [10, 20, 30, 40, 50],
+                    [10, 20, 30, 40, 50], [10, 50]]
+        for n, peaks in enumerate(expected):
+            self.assertEqual(ecg_peaks(journal.state_at(n)), peaks, f"after {n} edits")
+        self.assertEqual(list(journal.state_at(5)['window_labels']), [0, 0])
+        self.assertEqual(list(journal.state_at(6)['window_labels']), [0, 2])
+        with self.assertRaises(IndexError):
+            journal.state_at(8)
+
+        journal.replay_to(3)
+        self.assertEqual(ecg_peaks(journal.state), [10, 40, 50])
+        journal.redo(), journal.redo(), journal.redo()
+        self.assertEqual(ecg_peaks(journal.state), [10, 20, 30, 40, 50])
+        self.assertEqual(journal.labels.label(1), 'noisy')
+        journal.undo(), journal.undo()                # the label, then the peak at 30
+        self.assertEqual(ecg_peaks(journal.state), [10, 20, 40, 50])
+        self.assertEqual(journal.labels.label(1), '')
+
+    def test_get_journal_follows_the_client_store(self):
+        with get_journal('tests-reseed', peak_store()) as journal:
+            journal.add_peak('ecg', 100, 1.0)
+            store = journal.state
+        with get_journal('tests-reseed', store) as journal:
+            journal.add_peak('ecg', 300, 3.0)     # same revision: the history continues
+            self.assertTrue(journal.can_undo and len(journal.ops) == 2)
+        # another worker changed the store: its revision differs, so the journal is reseeded from it
+        other = peak_store([100, 300, 500])
+        other[REVISION] = 'elsewhere'
+        with get_journal('tests-reseed', other) as journal:
+            self.assertEqual(ecg_peaks(journal.state), [100, 300, 500])
+            self.assertFalse(journal.can_undo)
+
+
+class WindowLabelsTests(SimpleTestCase):
+    def test_next_unlabeled(self):
+        labels = WindowLabels([1, 1, 0, 2, 0])
+        self.assertEqual(labels.next_unlabeled(0), 2)
+        self.assertEqual(labels.next_unlabeled(3), 4)
+        self.assertEqual(labels.next_unlabeled(5), 2)               # wraps to the start
+        self.assertIsNone(labels.next_unlabeled(5, wrap=False))
+
+    def test_next_unlabeled_follows_labelling(self):
+        labels = WindowLabels([1, 1, 0, 2, 0])
+        self.assertEqual(labels.next_unlabeled(0), 2)
+        labels.set(2, label_code('clean'))
+        self.assertEqual(labels.next_unlabeled(0), 4)
+        labels.set(4, label_code('noisy'))
+        self.assertIsNone(labels.next_unlabeled(0))
+        labels.set(3, 0)                                             # un-labelling rebuilds the index
+        self.assertEqual(labels.next_unlabeled(0), 3)
+
+    def test_next_unlabeled_after_undo(self):
+        journal = AnnotationJournal({'window_labels': [1, 0, 0]})
+        self.assertEqual(journal.labels.next_unlabeled(0), 1)
+        journal.set_label(1, 'clean')
+        self.assertEqual(journal.labels.next_unlabeled(0), 2)
+        journal.undo()
+        self.assertEqual(journal.labels.next_unlabeled(0), 1)
+        journal.redo()
+        self.assertEqual(journal.labels.next_unlabeled(0), 2)
+
+    def test_next_matching_and_counts(self):
+        labels = WindowLabels([1, 2, 0, 2])
+        self.assertEqual(labels.next_matching(label_code('noisy'), after=2), 3)
+        self.assertEqual(labels.next_matching(label_code('clean'), after=1), 0)   # wraps
+        self.assertIsNone(labels.next_matching(label_code('motion')))
+        self.assertEqual(labels.counts(), {'': 1, 'clean': 1, 'noisy': 2, 'motion': 0})
+
+
+class SyntheticStoreTestCase(SimpleTestCase):
+    """Points the loaders at a synthetic store in a temporary directory, with no shared caches or search index."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        stack = contextlib.ExitStack()
+        cls.addClassCleanup(stack.close)
+        cls.tmp = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+        cls.h5_path = str(cls.tmp / 'store.h5')
+        cls.subj_ids = write_synthetic_h5(cls.h5_path, n_subjects=1, duration_sec=60)
+        stack.enter_context(use_h5_path(cls.h5_path))
+        stack.enter_context(mock.patch.object(get_data, 'H5_SHARD_DIR', str(cls.tmp / 'shards')))
+        stack.enter_context(without_window_cache())
+        stack.enter_context(use_payload_cache(None))
+        stack.enter_context(use_search_index(None))
+
+    def write_npz(self, subj_id, n_samples=3000, fs=125.0):
+        """A recording with an ECG channel and a PPG channel half as long, as `ingest_recordings` reads it."""
+        rng = np.random.default_rng(0)
+        path = self.tmp / f"{subj_id}.npz"
+        np.savez(path, fs=fs, ecg=rng.standard_normal(n_samples).astype(np.float32),
+                 pleth=rng.standard_normal(n_samples // 2).astype(np.float32), af_status=np.int64(1))
+        return path
+
+
+class SignalWindowTests(SyntheticStoreTestCase):
+    def setUp(self):
+        self.url = f"/api/subjects/{self.subj_ids[0]}/signals/ecg"
+        with h5py.File(self.h5_path, 'r') as f:
+            self.ekg = f['subjects'][self.subj_ids[0]]['ekg']['v'][:100].astype('<f4')
+
+    def test_full_body(self):
+        response = self.client.get(self.url, {'start': 0, 'end': 100})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Shape'], '100')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        np.testing.assert_array_equal(np.frombuffer(response.content, '<f4'), self.ekg)
+
+    def test_byte_ranges(self):
+        response = self.client.get(self.url, {'start': 0, 'end': 100}, headers={'Range': 'bytes=8-15'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 8-15/400')
+        np.testing.assert_array_equal(np.frombuffer(response.content, '<f4'), self.ekg[2:4])
+
+        response = self.client.get(self.url, {'start': 0, 'end': 100}, headers={'Range': 'bytes=-8'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 392-399/400')
+        np.testing.assert_array_equal(np.frombuffer(response.content, '<f4'), self.ekg[-2:])
+
+        response = self.client.get(self.url, {'start': 0, 'end': 100}, headers={'Range': 'bytes=400-'})
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */400')
+
+    def test_byte_range_reads_only_covered_samples(self):
+        with mock.patch.object(views, 'load_signal_range', wraps=views.load_signal_range) as load:
+            response = self.client.get(self.url, {'start': 0, 'end': 100}, headers={'Range': 'bytes=5-10'})
+        load.assert_called_once_with(self.subj_ids[0], 'ecg', 1, 3)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 5-10/400')
+        self.assertEqual(response.content, self.ekg.tobytes()[5:11])
+
+    def test_range_length_is_capped(self):
+        with mock.patch.object(views, 'SIGNAL_RANGE_MAX_SAMPLES', 100):
+            response = self.client.get(self.url, {'start': 20})
+            self.assertEqual(response['X-End'], '120')
+            self.assertEqual(len(response.content), 400)
+            self.assertEqual(self.client.get(self.url, {'start': 0, 'end': 101}).status_code, 400)
+        response = self.client.get(self.url, {'start': 7400, 'end': 8000})     # clipped to the recording
+        self.assertEqual((response['X-Shape'], response['X-End']), ('100', '7500'))
+
+    def test_etag_revalidation(self):
+        etag = self.client.get(self.url, {'start': 0, 'end': 100})['ETag']
+        response = self.client.get(self.url, {'start': 0, 'end': 100}, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        other = self.client.get(self.url, {'start': 0, 'end': 50}, headers={'If-None-Match': etag})
+        self.assertEqual(other.status_code, 200)
+        for header in ('*', f'"other", W/{etag}'):
+            response = self.client.get(self.url, {'start': 0, 'end': 100}, headers={'If-None-Match': header})
+            self.assertEqual(response.status_code, 304)
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get(self.url, {'start': 10, 'end': 5}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'start': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(f"/api/subjects/{self.subj_ids[0]}/signals/eeg").status_code, 404)
+        self.assertEqual(self.client.get("/api/subjects/nobody/signals/ecg").status_code, 404)
+        with mock.patch.object(get_data, 'subject_path', return_value=str(self.tmp / 'moved-away.h5')):
+            self.assertEqual(self.client.get(self.url, {'start': 0, 'end': 100}).status_code, 404)
+
+
+class CompressionTests(SimpleTestCase):
+    def test_accepted_encodings(self):
+        self.assertEqual(middleware.accepted_encodings('gzip, deflate, br'), {'gzip', 'deflate', 'br'})
+        self.assertEqual(middleware.accepted_encodings('GZIP;q=0.5, br;q=0'), {'gzip'})
+        self.assertEqual(middleware.accepted_encodings('identity;q=bad, *'), {'*'})
+        self.assertEqual(middleware.accepted_encodings(None), set())
+
+    def respond(self, body, path='/django_plotly_dash/app/x/_dash-update-component', accept='gzip',
+                content_type='application/json'):
+        request = RequestFactory().post(path, headers={'Accept-Encoding': accept})
+        compress = middleware.CompressionMiddleware(lambda request: HttpResponse(body, content_type=content_type))
+        return compress(request)
+
+    @mock.patch.object(middleware, 'brotli', None)
+    def test_size_threshold(self):
+        small = b'{"a": 1}' * ((middleware.COMPRESSION_MIN_BYTES - 1) // 8)
+        response = self.respond(small)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, small)
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+        large = b'{"a": 1}' * (middleware.COMPRESSION_MIN_BYTES // 8 + 1)
+        response = self.respond(large)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), large)
+        self.assertEqual(response['Content-Length'], str(len(response.content)))
+
+    @mock.patch.object(middleware, 'brotli', None)
+    def test_left_alone(self):
+        large = b'{"a": 1}' * (middleware.COMPRESSION_MIN_BYTES // 8 + 1)
+        self.assertFalse(self.respond(large, accept='identity').has_header('Content-Encoding'))
+        self.assertFalse(self.respond(large, path='/api/subjects/x/signals/ecg').has_header('Content-Encoding'))
+        self.assertFalse(self.respond(large, content_type='application/octet-stream').has_header('Content-Encoding'))
+
+
+class WorkQueueTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.index = str(Path(tmp.name) / 'index.sqlite3')
+
+    def queue(self, windows, coverage_weight=0.5):
+        """Index (subj_id, widx, label, quality) rows and queue them."""
+        with connect(self.index) as conn:
+            conn.executemany("INSERT INTO windows (subj_id, widx, label, quality) VALUES (?, ?, ?, ?)", windows)
+        return work_queue.build_work_queue(coverage_weight=coverage_weight, index_path=self.index)
+
+    def lease(self, annotator, **kwargs):
+        task = work_queue.lease_task(annotator, index_path=self.index, **kwargs)
+        return None if task is None else (task['subj_id'], task['widx'])
+
+    def test_lease_complete_release(self):
+        # scores: a/0 0.9 + 0.5, a/1 0.5 + 0.5, a/2 0.1 + 0.5, b/1 0.2 + 0.5 * 1/2 (b/0 is labelled)
+        stats = self.queue([('a', 0, 0, 0.9), ('a', 1, 0, 0.5), ('a', 2, 0, 0.1), ('b', 0, 1, 0.6), ('b', 1, 0, 0.2)])
+        self.assertEqual(stats, {'open': 4, 'leased': 0, 'expired': 0, 'done': 0})
+        self.assertEqual(self.lease('x'), ('a', 0))
+        self.assertEqual(self.lease('x'), ('a', 0))              # the same task again, lease renewed
+        self.assertEqual(self.lease('y'), ('a', 1))
+
+        self.assertTrue(work_queue.complete_task('a', 0, index_path=self.index))
+        self.assertFalse(work_queue.complete_task('a', 0, index_path=self.index))
+        self.assertEqual(self.lease('x'), ('a', 2))
+
+        self.assertFalse(work_queue.release_task('a', 1, 'x', index_path=self.index))   # leased by y
+        self.assertTrue(work_queue.release_task('a', 1, 'y', index_path=self.index))
+        self.assertEqual(self.lease('z'), ('b', 1))               # a/1 was skipped: 1.0 - SKIP_PENALTY < 0.45
+        self.assertEqual(self.lease('y'), ('a', 1))
+        self.assertIsNone(self.lease('w'))
+        self.assertEqual(work_queue.queue_stats(self.index), {'open': 0, 'leased': 3, 'expired': 0, 'done': 1})
+
+    def test_reopen_and_expiry(self):
+        self.queue([('a', 0, 0, 0.9), ('a', 1, 0, 0.1)])
+        self.assertEqual(self.lease('x', lease_s=-1), ('a', 0))
+        self.assertEqual(work_queue.queue_stats(self.index)['expired'], 1)
+        self.assertEqual(self.lease('y'), ('a', 0))               # the expired lease went back to the queue
+        self.assertTrue(work_queue.complete_task('a', 0, index_path=self.index))
+        self.assertTrue(work_queue.reopen_task('a', 0, index_path=self.index))
+        self.assertFalse(work_queue.reopen_task('a', 1, index_path=self.index))   # never done
+        self.assertEqual(self.lease('z'), ('a', 0))
+
+    def test_concurrent_leases(self):
+        self.queue([('a', w, 0, w / 100) for w in range(20)])
+        annotators = [f"annotator-{i}" for i in range(8)]
+        barrier = threading.Barrier(len(annotators))
+        leased = {}
+
+        def lease(annotator):
+            barrier.wait()
+            leased[annotator] = self.lease(annotator)
+
+        threads = [threading.Thread(target=lease, args=(a,)) for a in annotators]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(set(leased.values())), len(annotators))
+        self.assertEqual(sorted(w for _s, w in leased.values()), list(range(12, 20)))   # the best 8
+        self.assertEqual(work_queue.queue_stats(self.index)['leased'], len(annotators))
+
+    def test_disabled_index(self):
+        missing = str(Path(self.index).with_name('missing.sqlite3'))
+        self.assertIsNone(work_queue.lease_task('x', index_path=missing))
+        self.assertFalse(work_queue.complete_task('a', 0, index_path=missing))
+        self.assertFalse(Path(missing).exists())
+
+
+class SharedWindowCacheTests(SimpleTestCase):
+    SLOT_SAMPLES = 4
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = str(Path(tmp.name) / 'windows.slab')
+
+    def cache(self, n_slots=3):
+        return SharedWindowCache(self.path, n_slots * (self.SLOT_SAMPLES * 4 + INDEX_DTYPE.itemsize), self.SLOT_SAMPLES)
+
+    def test_round_trip(self):
+        cache = self.cache()
+        cache.put(1, [1, 2, 3], 125.0)
+        values, fs = cache.get(1)
+        np.testing.assert_array_equal(values, np.float32([1, 2, 3]))
+        self.assertEqual(fs, 125.0)
+        self.assertIsNone(cache.get(2))
+        with self.assertRaises(ValueError):
+            cache.put(2, np.zeros(self.SLOT_SAMPLES + 1), 125.0)
+
+    def test_evicts_least_recently_used(self):
+        cache = self.cache(n_slots=3)
+        for key in (1, 2, 3):
+            cache.put(key, [key], 125.0)
+        cache.get(1)                       # 2 is now the least recently used
+        cache.put(4, [4], 125.0)
+        self.assertIsNone(cache.get(2))
+        self.assertEqual([cache.get(k)[0].tolist() for k in (1, 3, 4)], [[1], [3], [4]])
+        self.assertEqual(cache.stats()['used'], 3)
+
+    def test_readers_do_not_write_the_slab(self):
+        cache = self.cache(n_slots=3)
+        cache.put(1, [1], 125.0)
+        stamps = cache.index['stamp'].copy()
+        for _ in range(cache.TOUCH_FLUSH - 1):
+            cache.get(1)
+        np.testing.assert_array_equal(cache.index['stamp'], stamps)       # kept in process memory
+        with cache.read(1):
+            pass                                                          # the lock was free: written now
+        self.assertGreater(cache.index['stamp'][cache._find(1)], stamps[cache._find(1)])
+        self.assertEqual(cache._touched, {})
+
+    def test_process_handles_follow_path_and_layout(self):
+        budget = 3 * (self.SLOT_SAMPLES * 4 + INDEX_DTYPE.itemsize)
+        self.addCleanup(shared_cache._caches.clear)
+        first = get_window_cache(self.path, budget, self.SLOT_SAMPLES)
+        self.assertIs(get_window_cache(self.path, budget, self.SLOT_SAMPLES), first)
+        other_path = get_window_cache(self.path + '-b', budget, self.SLOT_SAMPLES)
+        bigger = get_window_cache(self.path, 2 * budget, self.SLOT_SAMPLES)
+        self.assertEqual(len({first.path, other_path.path, bigger.path}), 3)
+        self.assertIsNone(get_window_cache(None, budget, self.SLOT_SAMPLES))
+        with open(f"{self.path}-c.6x{self.SLOT_SAMPLES}", 'wb') as fh:
+            fh.write(b'NOTASLAB')
+        with self.assertLogs(shared_cache.logger, 'WARNING'):
+            self.assertIsNone(get_window_cache(self.path + '-c', 2 * budget, self.SLOT_SAMPLES))
+        self.assertIs(get_window_cache(self.path, budget, self.SLOT_SAMPLES), first)
+
+    def test_shared_between_handles(self):
+        self.cache().put(7, [7, 7], 62.5)
+        self.assertEqual(self.cache().get(7)[0].tolist(), [7, 7])
+        # another layout gets its own slab instead of resizing this one
+        other = self.cache(n_slots=5)
+        self.assertNotEqual(other.path, self.cache().path)
+        self.assertIsNone(other.get(7))
+
+    def test_refuses_foreign_slab(self):
+        cache = self.cache()
+        with open(cache.path, 'r+b') as fh:
+            fh.write(b'NOTASLAB')
+        with self.assertRaises(ValueError):
+            self.cache()
+
+    @skipUnless(hasattr(os, 'fork'), "needs os.fork")
+    def test_forked_worker(self):
+        cache = self.cache()
+        cache.put(1, [1], 125.0)
+        pid = os.fork()
+        if pid == 0:
+            # child (as under a preloading server): reopens the slab on first use, then shares it
+            try:
+                ok = cache.get(1)[0].tolist() == [1]
+                cache.put(2, [2], 125.0)
+                ok = ok and cache._pid == os.getpid()
+            except BaseException:
+                ok = False
+            os._exit(0 if ok else 1)
+        _pid, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertEqual(cache.get(2)[0].tolist(), [2])           # written by the child
+
+    @skipUnless(hasattr(os, 'fork'), "needs os.fork")
+    def test_fork_while_another_thread_holds_the_lock(self):
+        cache = self.cache()
+        cache.put(1, [1], 125.0)
+        locked, release = threading.Event(), threading.Event()
+
+        def hold():
+            with cache._thread_lock:
+                locked.set()
+                release.wait()
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        self.addCleanup(holder.join)
+        self.addCleanup(release.set)
+        locked.wait()
+        pid = os.fork()
+        if pid == 0:
+            # the holder thread does not exist here; an inherited lock would never be released
+            signal.alarm(5)
+            try:
+                ok = cache.get(1)[0].tolist() == [1]
+            except BaseException:
+                ok = False
+            os._exit(0 if ok else 1)
+        _pid, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+
+class IngestTests(SyntheticStoreTestCase):
+    def test_catalogue_refresh_picks_up_new_shard(self):
+        shard_dir = self.tmp / 'catalogue-shards'
+        catalogue = SubjectCatalogue(self.h5_path, shard_dir, refresh_interval=3600)
+        self.assertEqual(catalogue.subject_ids(), self.subj_ids)
+        shard = write_shard([read_npz(self.write_npz('late'))], shard_dir)
+        self.assertEqual(catalogue.subject_ids(), self.subj_ids)          # within the refresh interval
+        self.assertEqual(catalogue.path_for('late'), str(shard))          # unknown id: forced refresh
+        self.assertEqual(catalogue.subject_ids(), self.subj_ids + ['late'])
+        shard.unlink()
+        self.assertTrue(catalogue.refresh(force=True))
+        with self.assertRaises(KeyError):
+            catalogue.path_for('late')
+
+    def test_ingest_round_trip(self):
+        path = self.write_npz('new-subject')
+        call_command('ingest_recordings', str(path), stdout=io.StringIO())
+        self.assertIn('new-subject', get_data.get_subject_ids())
+
+        with np.load(path) as z:
+            ecg, pleth = z['ecg'], z['pleth']
+        window = get_data.load_window_arrays('new-subject', 1)
+        self.assertEqual(window['fs'], 125.0)
+        np.testing.assert_array_equal(window['ecg'], ecg[1250:2500])
+        # the PPG channel is half as long: NaN-padded to the longest channel
+        np.testing.assert_array_equal(window['ppg'][:250], pleth[1250:])
+        self.assertTrue(np.isnan(window['ppg'][250:]).all())
+        self.assertEqual(window['abp'].size, 0)                             # no ABP channel in the input
+        self.assertEqual(get_data.count_windows('new-subject'), 3)
+
+        with self.assertRaises(CommandError):
+            call_command('ingest_recordings', str(path), stdout=io.StringIO())   # already present
+
+
+    def test_build_search_index_covers_shards_by_default(self):
+        call_command('ingest_recordings', str(self.write_npz('sharded')), stdout=io.StringIO())
+        index = str(self.tmp / 'shard-index.sqlite3')
+        call_command('build_search_index', index=index, stdout=io.StringIO())
+        with connect(index) as conn:
+            indexed = {r['subj_id']: r['source'] for r in conn.execute("SELECT subj_id, source FROM subjects")}
+        self.assertEqual(set(indexed), {*self.subj_ids, 'sharded'})
+        self.assertEqual(indexed['sharded'], get_data.subject_path('sharded'))
+
+        only = str(self.tmp / 'main-index.sqlite3')
+        call_command('build_search_index', index=only, h5=self.h5_path, stdout=io.StringIO())
+        with connect(only) as conn:
+            self.assertEqual([r['subj_id'] for r in conn.execute("SELECT subj_id FROM subjects")], self.subj_ids)
+
+
+def h5_contents(path):
+    """Every attribute and dataset in a store as raw bytes, keyed by path, plus each `v` chunk shape."""
+    contents, chunks = {}, {}
+
+    def visit(name, obj):
+        for key, value in obj.attrs.items():
+            contents[f"{name}@{key}"] = np.asarray(value).tobytes()
+        if isinstance(obj, h5py.Dataset):
+            contents[name] = (obj.dtype.str, obj.shape, obj[()].tobytes() if obj.dtype.kind != 'O' else obj[()])
+            if name.endswith('/v'):
+                chunks[name] = obj.chunks
+
+    with h5py.File(path, 'r') as f:
+        for key, value in f.attrs.items():
+            contents[f"@{key}"] = np.asarray(value).tobytes()
+        f.visititems(visit)
+    return contents, chunks
+
+
+class RepackTests(SyntheticStoreTestCase):
+    def test_repack_preserves_contents_and_rechunks(self):
+        src = self.tmp / 'repack-src.h5'
+        shutil.copy(self.h5_path, src)
+        with h5py.File(src, 'r+') as f:
+            f.attrs['origin'] = 'synthetic'
+            f['subjects'][self.subj_ids[0]]['ekg']['v'].attrs['units'] = 'mV'
+        before, old_chunks = h5_contents(src)
+
+        dst = h5_layout.repack_h5(src, self.tmp / 'repack-dst.h5', windows_per_chunk=2)
+        after, new_chunks = h5_contents(dst)
+        self.assertEqual(after.keys(), before.keys())
+        for key in before:
+            self.assertEqual(after[key], before[key], key)
+        self.assertTrue(new_chunks)
+        self.assertEqual(set(new_chunks.values()), {(2 * get_data.WIN_SAMPLES,)})
+        self.assertNotEqual(new_chunks, old_chunks)
+
+    def test_failed_repack_leaves_no_temp_file(self):
+        src = self.tmp / 'repack-fail.h5'
+        shutil.copy(self.h5_path, src)
+        original = src.read_bytes()
+        with mock.patch.object(h5py.Group, 'create_dataset', side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                h5_layout.repack_h5(src, src)                                  # in place
+        self.assertFalse(src.with_name(src.name + '.repack-tmp').exists())
+        self.assertEqual(src.read_bytes(), original)
+
+
+class PayloadCacheTests(SyntheticStoreTestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp(dir=self.tmp))
+        self.subj_id = self.subj_ids[0]
+
+    def test_rewritten_file_invalidates_entries(self):
+        source = str(self.tmp / 'rewritten.h5')
+        shutil.copy(self.h5_path, source)
+        with use_payload_cache(str(self.root)):
+            before = payload_cache.load_window_payload(self.subj_id, 0, ['ecg'], h5_path=source)
+            # same size and mtime, new contents: only the new inode tells them apart
+            stat = os.stat(source)
+            staged = str(self.tmp / 'staged.h5')
+            shutil.copy(source, staged)
+            with h5py.File(staged, 'r+') as f:
+                v = f['subjects'][self.subj_id]['ekg']['v']
+                v[:10] = v[:10] + 1.0
+            os.utime(staged, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            os.replace(staged, source)
+            after = payload_cache.load_window_payload(self.subj_id, 0, ['ecg'], h5_path=source)
+        np.testing.assert_allclose(array_values(after['ecg'])[:10], array_values(before['ecg'])[:10] + 1.0)
+        np.testing.assert_array_equal(array_values(after['ecg'])[10:], array_values(before['ecg'])[10:])
+
+    def test_eviction_drops_least_recently_used(self):
+        rng = np.random.default_rng(0)
+        payload = lambda: {'x': rng.bytes(2000).hex()}
+        probe = payload_cache.PayloadCache(self.root / 'probe')
+        entry_size = probe.put(self.subj_id, 0, self.h5_path, ['ecg'], payload()).stat().st_size
+        cache = payload_cache.PayloadCache(self.root / 'lru', max_bytes=int(entry_size * 3.5))
+        paths = [cache.put(self.subj_id, w, self.h5_path, ['ecg'], payload()) for w in range(3)]
+        cache.flush()
+        self.assertIsNotNone(cache.get(self.subj_id, 0, self.h5_path, ['ecg']))     # window 0 used last
+        cache.flush()
+        paths.append(cache.put(self.subj_id, 3, self.h5_path, ['ecg'], payload()))
+        self.assertLessEqual(cache.size(), cache.max_bytes)
+        self.assertEqual([p.exists() for p in paths], [True, False, True, True])
+
+    def test_corrupt_entry_is_dropped_and_recomputed(self):
+        with use_payload_cache(str(self.root)):
+            cache = payload_cache.payload_cache()
+            expected = payload_cache.load_window_payload(self.subj_id, 1, ['ecg', 'ppg'])
+            path = cache.path_for(self.subj_id, 1, self.h5_path, ['ecg', 'ppg'])
+            data = path.read_bytes()
+            for broken in (data[:len(data) // 2], b'not gzip at all'):
+                path.write_bytes(broken)
+                with self.assertLogs(payload_cache.logger, 'WARNING'):
+                    self.assertIsNone(cache.get(self.subj_id, 1, self.h5_path, ['ecg', 'ppg']))
+                self.assertFalse(path.exists())
+                path.write_bytes(broken)
+                with self.assertLogs(payload_cache.logger, 'WARNING'):
+                    self.assertEqual(payload_cache.load_window_payload(self.subj_id, 1, ['ecg', 'ppg']), expected)
+                with gzip.open(path, 'rb') as fh:
+                    self.assertEqual(json.loads(fh.read()), expected)
+
+
+class SignalSelectionTests(SyntheticStoreTestCase):
+    def setUp(self):
+        self.subj_id = self.subj_ids[0]
+        self.addCleanup(get_data.release_subjects)
+        self.addCleanup(transforms.release_transforms)
+
+    def test_legacy_bp_key(self):
+        window = get_data.load_window_arrays(self.subj_id, 0)
+        meta = get_data.load_subject_metadata(self.subj_id)
+        for out in (window, meta):
+            self.assertNotIn('bp', out)
+            with self.assertWarns(DeprecationWarning):
+                self.assertIs(out['bp'], out['abp'])
+        with self.assertRaises(KeyError):
+            get_data.load_window_arrays(self.subj_id, 0, signals=['ecg'])['bp']
+
+    def test_legacy_figure_signature(self):
+        w = get_data.load_window_arrays(self.subj_id, 0)
+        expected = generate_shared_xaxis_figure({k: w[k] for k in ('ecg', 'ppg', 'abp')}, w['t'], render_mode='webgl')
+        for args, kwargs in (((w['t'], 'webgl'), {}), ((w['t'],), {'render_mode': 'webgl'})):
+            with self.assertWarns(DeprecationWarning):
+                fig = generate_shared_xaxis_figure(w['ecg'], w['ppg'], w['abp'], *args, **kwargs)
+            self.assertEqual(plain(fig), plain(expected))
+
+    def test_preload_reads_selected_signals(self):
+        self.assertTrue(get_data.preload_subject(self.subj_id, signals=['ecg']))
+        self.assertTrue(get_data.is_preloaded(self.subj_id, signals=['ecg']))
+        self.assertFalse(get_data.is_preloaded(self.subj_id))
+        with mock.patch.object(get_data, 'open_h5', side_effect=AssertionError("read from HDF5")):
+            ecg = get_data.load_window_arrays(self.subj_id, 2, signals=['ecg'])['ecg']
+        with h5py.File(self.h5_path, 'r') as f:
+            np.testing.assert_array_equal(ecg, f['subjects'][self.subj_id]['ekg']['v'][2500:3750])
+            ppg = f['subjects'][self.subj_id]['ppg']['v'][2500:3750]
+        np.testing.assert_array_equal(get_data.load_window_arrays(self.subj_id, 2, signals=['ppg'])['ppg'], ppg)
+
+        self.assertTrue(get_data.preload_subject(self.subj_id, signals=['ppg']))    # union of both selections
+        self.assertTrue(get_data.is_preloaded(self.subj_id, signals=['ecg', 'ppg']))
+        self.assertFalse(get_data.is_preloaded(self.subj_id, signals=['abp']))
+
+    def test_preloaded_window_equals_hdf5_window(self):
+        windows = (0, 3, 6)                   # window 6 is past the end of the 60 s recording
+        from_file = [get_data.load_window_arrays(self.subj_id, w) for w in windows]
+        self.assertTrue(get_data.preload_subject(self.subj_id))
+        with mock.patch.object(get_data, 'open_h5', side_effect=AssertionError("read from HDF5")):
+            preloaded = [get_data.load_window_arrays(self.subj_id, w) for w in windows]
+        for expected, window in zip(from_file, preloaded):
+            self.assertEqual(window.keys(), expected.keys())
+            for key, value in expected.items():
+                np.testing.assert_array_equal(window[key], value)
+        self.assertEqual(preloaded[-1]['ecg'].size, 0)
+
+    def test_rewritten_store_drops_preloaded_recording(self):
+        source = str(self.tmp / 'preload-rewrite.h5')
+        shutil.copy(self.h5_path, source)
+        self.assertTrue(get_data.preload_subject(self.subj_id, h5_path=source))
+        staged = str(self.tmp / 'preload-staged.h5')
+        shutil.copy(source, staged)
+        with h5py.File(staged, 'r+') as f:
+            f['subjects'][self.subj_id]['ekg']['v'][:10] = 7.0
+        os.replace(staged, source)           # as repack_h5 does
+        self.assertFalse(get_data.is_preloaded(self.subj_id, h5_path=source))
+        np.testing.assert_array_equal(get_data.load_window_arrays(self.subj_id, 0, h5_path=source)['ecg'][:10], 7.0)
+
+    def test_transforms_read_selected_signals(self):
+        entry = transforms.transform_subject(self.subj_id, 'derivative', signals=['ppg'])
+        self.assertEqual(set(entry['data']), {'ppg'})
+        entry = transforms.transform_subject(self.subj_id, 'derivative', signals=['ecg'])
+        self.assertEqual(set(entry['data']), {'ecg', 'ppg'})
+        self.assertEqual(set(transforms.transform_subject(self.subj_id, 'bandpass')['data']), {'ecg', 'ppg', 'abp'})
+
+
+class SubjectMetadataTests(SyntheticStoreTestCase):
+    def test_waveforms_are_described_not_read(self):
+        read, original = [], h5py.Dataset.__getitem__
+
+        def spy(ds, *args, **kwargs):
+            read.append(ds.name)
+            return original(ds, *args, **kwargs)
+
+        with mock.patch.object(h5py.Dataset, '__getitem__', spy):
+            meta = get_data.load_subject_metadata(self.subj_ids[0], cache=False)
+        self.assertTrue(read)
+        self.assertEqual([name for name in read if name.endswith('/v')], [])
+        for name in ('ecg', 'ppg', 'abp'):
+            self.assertNotIn('v', meta[name])
+            self.assertEqual(meta[name]['arrays']['v'], {'shape': [7500], 'dtype': 'float32', 'nbytes': 30000})
+            self.assertEqual(float(meta[name]['fs']), 125.0)
+
+    def test_cache_follows_file_rewrites(self):
+        subj_id = self.subj_ids[0]
+        source = str(self.tmp / 'metadata-rewrite.h5')
+        shutil.copy(self.h5_path, source)
+        with h5py.File(source, 'r+') as f:
+            f['subjects'][subj_id]['fix'].attrs['reviewed'] = 0
+        self.assertEqual(get_data.load_subject_metadata(subj_id, source)['fix']['attrs'], {'reviewed': 0})
+        with mock.patch.object(get_data, 'open_h5', side_effect=AssertionError("read from HDF5")):
+            get_data.load_subject_metadata(subj_id, source)                  # served from the cache
+
+        # replaced with the same size and mtime (as an atomic rewrite can leave them)
+        stat = os.stat(source)
+        staged = str(self.tmp / 'metadata-staged.h5')
+        shutil.copy(source, staged)
+        with h5py.File(staged, 'r+') as f:
+            f['subjects'][subj_id]['fix'].attrs['reviewed'] = 1
+        os.utime(staged, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(os.stat(staged).st_size, stat.st_size)
+        os.replace(staged, source)
+        self.assertEqual(get_data.load_subject_metadata(subj_id, source)['fix']['attrs'], {'reviewed': 1})
+
+        # rewritten in place
+        with h5py.File(source, 'r+') as f:
+            f['subjects'][subj_id]['fix'].attrs['reviewed'] = 2
+        self.assertEqual(get_data.load_subject_metadata(subj_id, source)['fix']['attrs'], {'reviewed': 2})
+
+
+class TransformTests(SyntheticStoreTestCase):
+    def setUp(self):
+        self.subj_id = self.subj_ids[0]
+        self.addCleanup(transforms.release_transforms)
+
+    def test_fill_gaps(self):
+        v = np.array([np.nan, 1.0, np.nan, np.nan, 4.0, np.nan])
+        np.testing.assert_array_equal(transforms.fill_gaps(v), [1.0, 1.0, 2.0, 3.0, 4.0, 4.0])
+        self.assertTrue(np.isnan(v[0]))                                      # input untouched
+        np.testing.assert_array_equal(transforms.fill_gaps(np.full(3, np.nan)), np.zeros(3))
+        clean = np.arange(4.0)
+        filled = transforms.fill_gaps(clean)
+        np.testing.assert_array_equal(filled, clean)
+        self.assertIsNot(filled, clean)
+
+    def test_bandpass_short_input(self):
+        short = np.array([1.0, 2.0, 6.0])
+        np.testing.assert_allclose(transforms.bandpass(short, 125.0, (0.5, 40.0)), short - 3.0)
+        self.assertEqual(transforms.bandpass(np.empty(0), 125.0, (0.5, 40.0)).size, 0)
+        t = np.arange(2500) / 125.0
+        out = transforms.bandpass(5.0 + np.sin(2 * np.pi * 5.0 * t), 125.0, (0.5, 40.0))
+        self.assertLess(abs(out[500:-500].mean()), 0.01)                     # offset removed, 5 Hz kept
+        self.assertAlmostEqual(out[500:-500].std(), np.sqrt(0.5), places=2)
+
+    def test_view_window_is_a_slice_of_the_whole_recording(self):
+        with h5py.File(self.h5_path, 'r') as f:
+            subj = f['subjects'][self.subj_id]
+            recording = {s.name: subj[s.group]['v'][()].astype(np.float32) for s in SIGNALS.values()}
+        for view, (_label, base, step) in list(transforms.VIEWS.items())[1:]:
+            with self.subTest(view=view):
+                window = transforms.load_view_window(self.subj_id, 2, view)
+                for name, v in recording.items():
+                    spec = SIGNALS[name]
+                    if base is not None:
+                        v = transforms.apply_step(v, 125.0, spec, transforms.VIEWS[base][2])
+                    expected = transforms.apply_step(v, 125.0, spec, step)[2500:3750]
+                    np.testing.assert_allclose(window[name], expected, rtol=1e-5, atol=1e-5)
+                    if view == 'bandpass':      # filtering the window alone would add edge transients
+                        self.assertFalse(np.allclose(window[name], transforms.apply_step(
+                            recording[name][2500:3750], 125.0, spec, step), atol=1e-3))
+
+    def test_rewritten_store_is_transformed_again(self):
+        source = str(self.tmp / 'transform-rewrite.h5')
+        shutil.copy(self.h5_path, source)
+        before = transforms.load_view_window(self.subj_id, 0, 'bandpass', h5_path=source, signals=['ecg'])
+        staged = str(self.tmp / 'transform-staged.h5')
+        shutil.copy(source, staged)
+        with h5py.File(staged, 'r+') as f:
+            v = f['subjects'][self.subj_id]['ekg']['v']
+            v[...] = 2 * v[()]
+        os.replace(staged, source)
+        after = transforms.load_view_window(self.subj_id, 0, 'bandpass', h5_path=source, signals=['ecg'])
+        np.testing.assert_allclose(after['ecg'], 2 * before['ecg'], rtol=1e-4, atol=1e-5)
+
+
+class CompareAnnotatorsTests(SyntheticStoreTestCase):
+    def compare(self, subj_id, store_a, store_b):
+        """Run `compare_annotators` over one subject's two stores and return its peak totals per signal."""
+        root = Path(tempfile.mkdtemp(dir=self.tmp))
+        for name, store in (('a', store_a), ('b', store_b)):
+            (root / name).mkdir()
+            (root / name / f"{subj_id}.json").write_text(json.dumps(store))
+        out = root / 'report.json'
+        call_command('compare_annotators', str(root / 'a'), str(root / 'b'), '--no-index', '--workers', '1',
+                     '-o', str(out), stdout=io.StringIO())
+        return json.loads(out.read_text())['subjects'][0]['signals']
+
+    def test_peaks_are_matched_at_the_subjects_rate(self):
+        # 30 samples apart: 0.12 s at 250 Hz (within the 0.15 s tolerance), 0.24 s at 125 Hz
+        store_a = {'window_labels': [], 'ecg': {'sample_peak_positions': [100, 400]}}
+        store_b = {'window_labels': [], 'ecg': {'sample_peak_positions': [130, 430]}}
+        call_command('ingest_recordings', str(self.write_npz('fast', fs=250.0)), stdout=io.StringIO())
+        self.assertEqual(self.compare('fast', store_a, store_b)['ecg']['tp'], 2)             # from the catalogue
+        self.assertEqual(self.compare(self.subj_ids[0], store_a, store_b)['ecg']['tp'], 0)   # 125 Hz subject
+        exported = {**store_a, 'fs': 250.0}
+        self.assertEqual(self.compare(self.subj_ids[0], exported, store_b)['ecg']['tp'], 2)  # the export's 'fs'
+
+
+class SearchIndexTests(SyntheticStoreTestCase):
+    """The main store's subject plus 'partial', an ingested subject with no ABP and PPG in its first 12 s only."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rng = np.random.default_rng(1)
+        path = cls.tmp / 'partial.npz'
+        np.savez(path, fs=125.0, ecg=rng.standard_normal(3000).astype(np.float32),
+                 pleth=rng.standard_normal(1500).astype(np.float32), af_status=np.int64(1))
+        call_command('ingest_recordings', str(path), stdout=io.StringIO())
+        cls.all_ids = [*cls.subj_ids, 'partial']
+
+    def setUp(self):
+        self.index = str(Path(tempfile.mkdtemp(dir=self.tmp)) / 'index.sqlite3')
+        self.stats = build_index(index_path=self.index)
+
+    def search(self, **filters):
+        return [(r['subj_id'], r['widx']) for r in search_windows(index_path=self.index, **filters)]
+
+    def test_feature_filters(self):
+        rows = search_windows(index_path=self.index)
+        self.assertEqual(len(rows), 6 + 3)
+        for filters, keep in (
+                ({'min_hr': 60, 'max_hr': 100}, lambda r: r['hr'] is not None and 60 <= r['hr'] <= 100),
+                ({'min_quality': 0.9}, lambda r: r['quality'] >= 0.9),
+                ({'has': ('abp',)}, lambda r: r['has_abp']),
+                ({'has': ('ecg', 'ppg')}, lambda r: r['has_ecg'] and r['has_ppg'])):
+            with self.subTest(**filters):
+                expected = [(r['subj_id'], r['widx']) for r in rows if keep(r)]
+                self.assertTrue(0 < len(expected) < len(rows))
+                self.assertEqual(self.search(**filters), expected)
+        self.assertNotIn('partial', {subj for subj, _ in self.search(has=('abp',))})
+        self.assertEqual(self.search(limit=2), [(r['subj_id'], r['widx']) for r in rows[:2]])
+        with self.assertRaises(ValueError):
+            self.search(has=('eeg',))
+
+    def test_meta_filters(self):
+        with h5py.File(self.h5_path, 'r') as f:
+            af_status = int(f['subjects'][self.subj_ids[0]]['fix']['af_status'][()])
+        self.assertEqual(meta_values('af_status', self.index), sorted({str(af_status), '1'}, key=int))
+        matching = [s for s, status in ((self.subj_ids[0], af_status), ('partial', 1)) if status == 1]
+        self.assertEqual(sorted({subj for subj, _ in self.search(meta={'af_status': 1})}), sorted(matching))
+        self.assertEqual({subj for subj, _ in self.search(meta={'rec_id': f"{self.subj_ids[0]}-synthetic"})},
+                         {self.subj_ids[0]})
+        self.assertEqual(self.search(meta={'af_status': 5}), [])
+
+    def test_labels(self):
+        subj_id = self.subj_ids[0]
+        record_label(subj_id, 2, label_code('noisy'), self.index)
+        record_label(subj_id, 4, label_code('clean'), self.index)
+        record_label(subj_id, 4, label_code('motion'), self.index)        # relabelled
+        self.assertEqual(self.search(label='noisy'), [(subj_id, 2)])
+        self.assertEqual(self.search(label='motion'), [(subj_id, 4)])
+        self.assertEqual(len(self.search(label='')), 6 + 3 - 2)
+        np.testing.assert_array_equal(load_labels(subj_id, 6, self.index), [0, 0, 2, 0, 3, 0])
+        np.testing.assert_array_equal(load_labels(subj_id, 3, self.index), [0, 0, 2])
+        np.testing.assert_array_equal(load_labels(subj_id, 3, str(self.tmp / 'no-index.sqlite3')), [0, 0, 0])
+        self.assertFalse((self.tmp / 'no-index.sqlite3').exists())
+
+    def test_incremental_build(self):
+        self.assertEqual(self.stats, {'indexed': 2, 'skipped': 0, 'windows': 9})
+        self.assertEqual(build_index(index_path=self.index), {'indexed': 0, 'skipped': 2, 'windows': 0})
+        self.assertEqual(build_index(index_path=self.index, force=True), {'indexed': 2, 'skipped': 0, 'windows': 9})
+        st = os.stat(self.h5_path)
+        os.utime(self.h5_path, ns=(st.st_atime_ns, st.st_mtime_ns + 1))     # only the main store changed
+        self.assertEqual(build_index(index_path=self.index), {'indexed': 1, 'skipped': 1, 'windows': 6})
+
+    def test_reindex_keeps_labels(self):
+        subj_id = self.subj_ids[0]
+        before = {r['widx']: r for r in search_windows(index_path=self.index) if r['subj_id'] == subj_id}
+        record_label(subj_id, 1, label_code('clean'), self.index)
+        record_label(subj_id, 9, label_code('noisy'), self.index)          # past the end: dropped on re-index
+        build_index(index_path=self.index, force=True)
+        after = {r['widx']: r for r in search_windows(index_path=self.index) if r['subj_id'] == subj_id}
+        self.assertEqual(sorted(after), list(range(6)))
+        self.assertEqual(after[1]['label'], 'clean')
+        for widx, row in after.items():
+            self.assertEqual({**row, 'label': ''}, {**before[widx], 'label': ''})
+
+
+class PeakClickTests(SyntheticStoreTestCase):
+    def test_click_on_a_250_hz_subject(self):
+        from .annotations.app import modify_peak_logic
+
+        call_command('ingest_recordings', str(self.write_npz('fast', fs=250.0)), stdout=io.StringIO())
+        fs = get_data.subject_fs('fast', ['ecg'])
+        self.assertEqual(fs, 250.0)
+        window = get_data.load_window_arrays('fast', 1, signals=['ecg'])
+        x = float(window['t'][100])                  # where the figure draws sample 1250 + 100
+        journal = AnnotationJournal(peak_store())
+        click = {'points': [{'x': x, 'y': 0.0, 'curveNumber': 0}]}
+        self.assertTrue(modify_peak_logic(click, journal, 1, 'add', ['ecg'], fs=fs))
+        self.assertEqual(ecg_peaks(journal.state), [1350])
+        self.assertAlmostEqual(journal.state['ecg']['time_peak_positions'][0], 1350 / 250)
+        self.assertTrue(modify_peak_logic(click, journal, 1, 'remove', ['ecg'], fs=fs))
+        self.assertEqual(ecg_peaks(journal.state), [])
+
+
+def plain(obj):
+    """A figure or layout as plain JSON values, as the browser receives it."""
+    return json.loads(json.dumps(obj, cls=PlotlyJSONEncoder))
+
+
+class FigureTemplateTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.t = (np.arange(1250, 1300) / 125).astype(np.float32)
+        self.signals = {name: rng.standard_normal(self.t.size).astype(np.float32) for name in ('ecg', 'ppg', 'abp')}
+        self.spectrogram = {'signal': 'ppg', 'times': np.float32([10.1, 10.2, 10.3]),
+                            'freqs': np.float32([0.5, 1.0, 1.5, 2.0]),
+                            'power': rng.uniform(-40, 0, (4, 3)).astype(np.float32)}
+
+    def assertSameFigure(self, reference, built):
+        reference, built = plain(reference.to_plotly_json()), plain(built)
+        self.assertEqual(len(built['data']), len(reference['data']))
+        for ref_trace, trace in zip(reference['data'], built['data']):
+            self.assertEqual((trace['type'], trace.get('xaxis'), trace.get('yaxis'), trace.get('mode')),
+                             (ref_trace['type'], ref_trace.get('xaxis'), ref_trace.get('yaxis'), ref_trace.get('mode')))
+            for key in ('x', 'y'):
+                np.testing.assert_array_equal(np.asarray(array_values(trace[key]), dtype=float),
+                                              np.asarray(array_values(ref_trace[key]), dtype=float))
+            if 'z' in ref_trace:
+                # the template path rounds spectrogram power to 0.1 dB
+                z = ref_trace['z']
+                shape = [int(n) for n in str(z['shape']).split(',')] if isinstance(z, dict) else -1   # e.g. '4, 3'
+                ref_z = np.asarray(array_values(z)).reshape(shape)
+                np.testing.assert_allclose(np.asarray(trace['z']).reshape(ref_z.shape), ref_z, atol=0.05)
+        self.assertEqual(built['layout'], reference['layout'])
+
+    def test_matches_plotly_figure(self):
+        for render_mode in RENDER_MODES:
+            for spectrogram in (None, self.spectrogram):
+                for names in (('ecg', 'ppg', 'abp'), ('ppg',)):
+                    with self.subTest(render_mode=render_mode, spectrogram=spectrogram is not None, signals=names):
+                        signals = {name: self.signals[name] for name in names}
+                        self.assertSameFigure(
+                            generate_shared_xaxis_figure(signals, self.t, render_mode=render_mode,
+                                                         spectrogram=spectrogram),
+                            build_shared_xaxis_figure(signals, self.t, render_mode, spectrogram))
+
+    def test_x_range(self):
+        fig = build_shared_xaxis_figure(self.signals, self.t, 'webgl', self.spectrogram)
+        for axis in ('xaxis', 'xaxis2', 'xaxis3', 'xaxis4'):
+            np.testing.assert_allclose(fig['layout'][axis]['range'], [10.0, 10.4], rtol=1e-6)
+
+    def test_short_time_axis(self):
+        for t in (np.float32([2.0]), np.float32([])):
+            signals = {'ecg': np.zeros(t.size, np.float32)}
+            with self.subTest(samples=t.size):
+                self.assertEqual(build_shared_xaxis_figure(signals, t)['layout']['xaxis']['range'],
+                                 [float(t[0]) if t.size else 0.0, (float(t[0]) if t.size else 0.0) + 1.0])
+                self.assertSameFigure(generate_shared_xaxis_figure(signals, t), build_shared_xaxis_figure(signals, t))
+
+
+class BenchmarkTests(SimpleTestCase):
+    def test_run_benchmarks_smoke(self):
+        """One tiny run of the whole suite: every benchmark completes and the report keeps its shape."""
+        with tempfile.TemporaryDirectory() as tmp:
+            h5_path = str(Path(tmp) / 'bench.h5')
+            subj_ids = write_synthetic_h5(h5_path, n_subjects=1, duration_sec=30)
+            # callback round-trips need their own test database, which SimpleTestCase does not allow
+            report = run_benchmarks(h5_path, subj_ids, 30 * 125, 125.0, peak_counts=(50,), repeat=1, warmup=0,
+                                    callbacks=False)
+
+        self.assertEqual(report['schema'], SCHEMA_VERSION)
+        self.assertEqual(report['config']['n_subjects'], 1)
+        self.assertTrue(report['results'])
+        for r in report['results']:
+            with self.subTest(name=r['name'], params=r['params']):
+                self.assertNotIn('error', r)
+                self.assertEqual(r['stats']['n'], 1)
+        json.dumps(report)                                                     # stays JSON-serializable